@@ -0,0 +1,182 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, SmallInteger, String, func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import Base
+
+# Faixas do histograma de risco: [0, 0.05), [0.05, 0.10), ..., [0.95, 1.0]
+N_FAIXAS_RISCO = 20
+
+
+class PredictionAgregado(Base):
+    """
+    Rollup das predições por hora, resultado, situação de moradia e faixa de risco.
+    Mantido incrementalmente pela fila de gravação, no mesmo commit das predições
+    """
+    __tablename__ = "predictions_agregados"
+    hora = Column(DateTime, primary_key=True)
+    resultado = Column(String(20), primary_key=True)
+    situacao_moradia = Column(String(10), primary_key=True)
+    faixa_risco = Column(SmallInteger, primary_key=True)
+    quantidade = Column(BigInteger, nullable=False, default=0)
+    soma_probabilidade = Column(Float, nullable=False, default=0.0)
+
+
+def faixa_risco(probabilidade: float) -> int:
+    return min(max(int(probabilidade * N_FAIXAS_RISCO), 0), N_FAIXAS_RISCO - 1)
+
+
+def _acumular(linhas, acumulado=None) -> dict:
+    acumulado = defaultdict(lambda: [0, 0.0]) if acumulado is None else acumulado
+    for linha in linhas:
+        if linha['timestamp'] is None or linha['probabilidade_risco'] is None:
+            continue
+        probabilidade = float(linha['probabilidade_risco'])
+        chave = (
+            hora_cheia(linha['timestamp']),
+            linha['resultado'],
+            linha['situacao_moradia'],
+            faixa_risco(probabilidade),
+        )
+        acumulado[chave][0] += 1
+        acumulado[chave][1] += probabilidade
+    return acumulado
+
+
+def _upsert(conn, acumulado: dict):
+    if not acumulado:
+        return
+    tabela = PredictionAgregado.__table__
+    dialeto = postgresql if conn.dialect.name == 'postgresql' else sqlite
+    # chaves ordenadas: workers concorrentes travam as linhas na mesma ordem (sem deadlock)
+    valores = [
+        {'hora': hora, 'resultado': resultado, 'situacao_moradia': moradia, 'faixa_risco': faixa,
+         'quantidade': quantidade, 'soma_probabilidade': soma}
+        for (hora, resultado, moradia, faixa), (quantidade, soma) in sorted(acumulado.items())
+    ]
+    # em blocos, para não estourar o limite de parâmetros por comando na carga inicial
+    for i in range(0, len(valores), 1000):
+        stmt = dialeto.insert(tabela).values(valores[i:i + 1000])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in tabela.primary_key.columns],
+            set_={
+                'quantidade': tabela.c.quantidade + stmt.excluded.quantidade,
+                'soma_probabilidade': tabela.c.soma_probabilidade + stmt.excluded.soma_probabilidade,
+            }
+        )
+        conn.execute(stmt)
+
+
+def atualizar_agregados(conn, linhas: list[dict]):
+    """Gancho da FilaPersistencia: soma o lote recém-gravado ao rollup na mesma transação"""
+    _upsert(conn, _acumular(linhas))
+
+
+def reconstruir_agregados(engine, tabela_predicoes, corte: datetime, tamanho_bloco: int = 50_000) -> int:
+    """
+    Preenche o rollup a partir das predições já gravadas antes de `corte`, se ele estiver vazio.
+    As predições posteriores a `corte` são somadas pela fila, então não são contadas duas vezes
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            # vários workers sobem juntos: só um deles faz a carga inicial
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('predictions_agregados'))"))
+
+        if conn.execute(select(PredictionAgregado.hora).limit(1)).first() is not None:
+            return 0
+
+        consulta = select(
+            tabela_predicoes.c.timestamp,
+            tabela_predicoes.c.resultado,
+            tabela_predicoes.c.situacao_moradia,
+            tabela_predicoes.c.probabilidade_risco,
+        ).where(tabela_predicoes.c.timestamp < corte)
+
+        acumulado = None
+        total = 0
+        resultado = conn.execution_options(yield_per=tamanho_bloco).execute(consulta)
+        for bloco in resultado.mappings().partitions():
+            acumulado = _acumular(bloco, acumulado)
+            total += len(bloco)
+
+        if acumulado:
+            _upsert(conn, acumulado)
+        return total
+
+
+def hora_cheia(instante: datetime) -> datetime:
+    return instante.replace(minute=0, second=0, microsecond=0)
+
+
+async def consultar_estatisticas(db, inicio: datetime | None = None, fim: datetime | None = None,
+                                 granularidade: str = 'dia') -> dict:
+    """
+    Estatísticas do dashboard lidas só do rollup (custo independente do tamanho de predictions).
+    O rollup é por hora, então os dois limites são arredondados do mesmo jeito: entram as horas
+    que contêm `inicio` e `fim`, inclusive a hora corrente ainda incompleta
+    """
+    t = PredictionAgregado
+    filtros = []
+    if inicio:
+        filtros.append(t.hora >= hora_cheia(inicio))
+    if fim:
+        filtros.append(t.hora <= hora_cheia(fim))
+
+    por_resultado_moradia = (await db.execute(
+        select(t.resultado, t.situacao_moradia, func.sum(t.quantidade), func.sum(t.soma_probabilidade))
+        .where(*filtros).group_by(t.resultado, t.situacao_moradia)
+    )).all()
+    histograma = (await db.execute(
+        select(t.faixa_risco, func.sum(t.quantidade)).where(*filtros).group_by(t.faixa_risco)
+    )).all()
+    por_hora = (await db.execute(
+        select(t.hora, t.resultado, func.sum(t.quantidade)).where(*filtros).group_by(t.hora, t.resultado)
+    )).all()
+
+    total = aprovados = 0
+    soma_probabilidade = 0.0
+    por_moradia = defaultdict(lambda: {'total': 0, 'aprovados': 0})
+    for resultado, moradia, quantidade, soma in por_resultado_moradia:
+        quantidade, soma = int(quantidade), float(soma)
+        total += quantidade
+        soma_probabilidade += soma
+        por_moradia[moradia]['total'] += quantidade
+        if resultado == "Aprovado":
+            aprovados += quantidade
+            por_moradia[moradia]['aprovados'] += quantidade
+
+    tendencia = defaultdict(lambda: {'total': 0, 'aprovados': 0})
+    for hora, resultado, quantidade in por_hora:
+        quantidade = int(quantidade)
+        periodo = hora if granularidade == 'hora' else hora.replace(hour=0)
+        tendencia[periodo]['total'] += quantidade
+        if resultado == "Aprovado":
+            tendencia[periodo]['aprovados'] += quantidade
+
+    contagem_faixas = {faixa: int(quantidade) for faixa, quantidade in histograma}
+
+    def taxa(aprovados_, total_):
+        return round(aprovados_ / total_ * 100, 2) if total_ > 0 else 0
+
+    return {
+        'total_predicoes': total,
+        'aprovados': aprovados,
+        'reprovados': total - aprovados,
+        'taxa_aprovacao': taxa(aprovados, total),
+        'probabilidade_media': round(soma_probabilidade / total, 4) if total > 0 else None,
+        'por_moradia': {
+            moradia: {**valores, 'taxa_aprovacao': taxa(valores['aprovados'], valores['total'])}
+            for moradia, valores in por_moradia.items()
+        },
+        'histograma_risco': [
+            {'faixa_inicio': round(i / N_FAIXAS_RISCO, 2), 'faixa_fim': round((i + 1) / N_FAIXAS_RISCO, 2),
+             'quantidade': contagem_faixas.get(i, 0)}
+            for i in range(N_FAIXAS_RISCO)
+        ],
+        'tendencia': [
+            {'periodo': periodo.isoformat(), **valores, 'taxa_aprovacao': taxa(valores['aprovados'], valores['total'])}
+            for periodo, valores in sorted(tendencia.items())
+        ],
+    }
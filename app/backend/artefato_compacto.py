@@ -0,0 +1,144 @@
+"""
+Artefato compacto do modelo linear: um .npz sem pickle, lido sem sklearn, pandas nem joblib.
+
+Guarda a ordem das features, os parâmetros do escalonamento (centro e escala, já compostos),
+os coeficientes e o intercepto da LogisticRegression, o threshold e as métricas, além de um
+canário (linhas da referência e as probabilidades que o pipeline sklearn deu a elas), que o
+registro confere ao carregar, e a identidade do .joblib de origem (sha256, tamanho e mtime).
+O registro prefere <versao>.npz a <versao>.joblib quando os dois existem, mas só se o .joblib
+ainda for o que gerou o .npz: um .joblib retreinado com o mesmo nome não fica escondido atrás
+de um .npz antigo. Modelos não lineares continuam só no .joblib.
+
+Uso (a partir de app/backend), para converter os artefatos que já existem:
+    python artefato_compacto.py
+    python artefato_compacto.py --versoes v3 v4
+"""
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+FORMATO = 'credito-linear'
+VERSAO_FORMATO = 1
+ARRAYS = ('centro', 'escala', 'coef', 'canario', 'canario_proba')
+
+
+def sha256_arquivo(caminho: Path) -> str:
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def identidade_fonte(caminho: Path) -> dict:
+    """O que o .npz guarda do .joblib de origem para detectar depois que ele foi trocado"""
+    estado = Path(caminho).stat()
+    return {'arquivo': Path(caminho).name, 'sha256': sha256_arquivo(caminho), 'tamanho': estado.st_size,
+            'mtime_ns': estado.st_mtime_ns}
+
+
+def fonte_confere(fonte: dict | None, caminho: Path) -> bool:
+    """
+    O .joblib em `caminho` ainda é o que gerou o .npz? Tamanho e mtime iguais bastam; com o
+    mtime diferente (um checkout ou cópia muda o mtime) decide o sha256. Sem a identidade
+    gravada (.npz de antes dela) não há como conferir
+    """
+    if not fonte:
+        return False
+    estado = Path(caminho).stat()
+    if estado.st_size != fonte.get('tamanho'):
+        return False
+    if estado.st_mtime_ns == fonte.get('mtime_ns'):
+        return True
+    return sha256_arquivo(caminho) == fonte.get('sha256')
+
+
+def salvar(caminho: Path, pipeline, features: list, threshold: float, metricas: dict,
+           canario: np.ndarray, fonte: Path | None = None) -> Path:
+    """
+    Extrai os parâmetros do pipeline e grava o .npz (escrita atômica: .tmp + rename).
+    `fonte` é o .joblib de onde o pipeline veio; a identidade dele vai nos metadados.
+    Lança ValueError se o pipeline não for linear ou se os parâmetros extraídos não
+    reproduzirem o pipeline no canário
+    """
+    import pandas as pd
+    from scoring import TOLERANCIA_AUTOVERIFICACAO, ScorerLinear, desvio_esperado, parametros_lineares
+
+    centro, escala, coef, intercepto = parametros_lineares(pipeline, features)
+    canario = np.ascontiguousarray(canario, dtype=np.float64)
+    canario_proba = pipeline.predict_proba(pd.DataFrame(canario, columns=list(features)))[:, 1]
+    desvio = desvio_esperado(ScorerLinear.dos_parametros(centro, escala, coef, intercepto, features),
+                             canario, canario_proba)
+    if not desvio <= TOLERANCIA_AUTOVERIFICACAO:
+        raise ValueError(f"Parâmetros extraídos divergem do pipeline no canário (desvio {desvio})")
+
+    metadados = {
+        'formato': FORMATO,
+        'versao_formato': VERSAO_FORMATO,
+        'features': list(features),
+        'threshold_f2': float(threshold),
+        'intercepto': intercepto,
+        'metricas': metricas,
+        'tipo_pipeline': [type(passo).__name__ for _, passo in pipeline.steps],
+        'fonte': identidade_fonte(fonte) if fonte is not None else None,
+    }
+    caminho = Path(caminho)
+    temporario = caminho.with_name(f".{caminho.name}.tmp")
+    with open(temporario, 'wb') as arquivo:
+        np.savez_compressed(arquivo, metadados=np.array(json.dumps(metadados, default=float, ensure_ascii=False)),
+                            centro=centro, escala=escala, coef=coef, canario=canario, canario_proba=canario_proba)
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def carregar(caminho: Path) -> dict:
+    """Lê o .npz (allow_pickle=False) e devolve metadados e arrays. Lança ValueError se o formato não for reconhecido"""
+    with np.load(caminho, allow_pickle=False) as arquivo:
+        try:
+            dados = json.loads(str(arquivo['metadados']))
+            for nome in ARRAYS:
+                dados[nome] = arquivo[nome]
+        except KeyError as e:
+            raise ValueError(f"Artefato compacto sem o campo {e}") from e
+    if dados.get('formato') != FORMATO or dados.get('versao_formato') != VERSAO_FORMATO:
+        raise ValueError(f"Formato não suportado: {dados.get('formato')} v{dados.get('versao_formato')}")
+    return dados
+
+
+def main(argv=None):
+    from logs import configurar_logs
+    from registro_modelos import RegistroModelos
+
+    raiz = Path(__file__).parent.parent.parent
+    parser = argparse.ArgumentParser(description="Converte os artefatos .joblib lineares para o formato compacto (.npz)")
+    parser.add_argument('--registro', type=Path,
+                        default=Path(os.getenv("CAMINHO_REGISTRO", raiz / "modelos" / "registro")))
+    parser.add_argument('--padrao', type=Path, default=raiz / "modelos" / "modelo_credito_final.joblib",
+                        help="Artefato usado quando o registro está vazio")
+    parser.add_argument('--referencia', type=Path, default=raiz / "data" / "dados_credito_processados.parquet")
+    parser.add_argument('--versoes', nargs='+', help="Versões a converter (padrão: todas, mais o artefato padrão)")
+    args = parser.parse_args(argv)
+    configurar_logs()
+
+    registro = RegistroModelos(args.registro, args.padrao, args.referencia)
+    versoes = args.versoes or sorted(set(registro.versoes_disponiveis()) | {args.padrao.stem})
+    for versao in versoes:
+        modelo = registro.carregar(versao, compacto=False)
+        if not modelo.scorer.compilado:
+            print(f"{versao}: não linear, mantido só em .joblib")
+            continue
+        canario = registro.matriz_canario(modelo.features)
+        if canario is None:
+            raise SystemExit(f"Dados de referência indisponíveis em {args.referencia}: o canário é obrigatório")
+        fonte = registro.caminho_artefato(versao, compacto=False)
+        destino = fonte.with_suffix('.npz')
+        salvar(destino, modelo.pipeline, list(modelo.features), modelo.threshold, modelo.metricas, canario, fonte)
+        print(f"{versao}: {destino} ({destino.stat().st_size} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def hash_entrada(dados: dict, versao: str | None = None) -> str:
+    """
+    Hash canônico da entrada já validada (ClienteInput.model_dump()): chaves ordenadas e
+    números normalizados pelo pydantic, então payloads equivalentes geram o mesmo hash
+    """
+    bruto = json.dumps(dados, sort_keys=True, separators=(',', ':'), default=str)
+    if versao is not None:
+        bruto = f"{versao}|{bruto}"
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+class CacheLRU:
+    """
+    Cache em memória com expulsão LRU e expiração por TTL, seguro entre threads.
+    Guarda no máximo `capacidade` entradas; cada uma vale por `ttl` segundos
+    """
+
+    def __init__(self, capacidade: int, ttl: float):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+        # métricas
+        self.acertos = 0
+        self.faltas = 0
+        self.expulsos = 0
+        self.expirados = 0
+        self.invalidacoes = 0
+
+    def obter(self, chave: str):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                self.faltas += 1
+                return None
+            expira_em, valor = entrada
+            if expira_em <= agora:
+                del self._dados[chave]
+                self.expirados += 1
+                self.faltas += 1
+                return None
+            self._dados.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave: str, valor):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+                self.expulsos += 1
+
+    def guardar_se_ausente(self, chave: str, valor) -> bool:
+        """Guarda só se a chave não existir (ou tiver expirado); devolve se guardou"""
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is not None and entrada[0] > agora:
+                return False
+            self.faltas += 1
+            self._dados[chave] = (agora + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+                self.expulsos += 1
+            return True
+
+    def remover(self, chave: str):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self.invalidacoes += 1
+
+    def metricas(self) -> dict:
+        consultas = self.acertos + self.faltas
+        return {
+            'tamanho': len(self._dados),
+            'capacidade': self.capacidade,
+            'ttl_segundos': self.ttl,
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': round(self.acertos / consultas * 100, 2) if consultas else 0,
+            'expulsos': self.expulsos,
+            'expirados': self.expirados,
+            'invalidacoes': self.invalidacoes,
+        }
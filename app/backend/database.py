@@ -0,0 +1,116 @@
+import os
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+
+# o .env é só para desenvolvimento: com DATABASE_URL no ambiente, o dotenv nem é importado
+if "DATABASE_URL" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+DATABASE_URL = os.getenv(
+    "DATABASE_URL"
+)
+
+# Pool do engine assíncrono, usado pelos endpoints
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "sim")
+
+# Pool do engine síncrono, usado só pela fila de gravação de predictions, pelo alocador de ids
+# e pela criação das tabelas
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "2"))
+
+# Pool do engine auxiliar: leituras longas (manutenção e arquivamento de partições, índice da
+# simulação de threshold) e a fila do desafiante, que assim nunca seguram a conexão do flush
+DB_AUX_POOL_SIZE = int(os.getenv("DB_AUX_POOL_SIZE", "1"))
+DB_AUX_MAX_OVERFLOW = int(os.getenv("DB_AUX_MAX_OVERFLOW", "1"))
+
+
+def opcoes_pool(url: str, pool_size: int, max_overflow: int) -> dict:
+    # SQLite (usado em testes) tem pools próprios que não aceitam esses parâmetros
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+def url_assincrona(url: str):
+    """Troca o driver da DATABASE_URL pelo equivalente assíncrono (asyncpg / aiosqlite)"""
+    url = make_url(url)
+    drivers = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+    backend = url.get_backend_name()
+    if backend not in drivers:
+        raise ValueError(f"Banco sem driver assíncrono configurado: {backend}")
+    return url.set(drivername=f"{backend}+{drivers[backend]}")
+
+
+engine = create_engine(DATABASE_URL, **opcoes_pool(DATABASE_URL, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW))
+engine_auxiliar = create_engine(DATABASE_URL, **opcoes_pool(DATABASE_URL, DB_AUX_POOL_SIZE, DB_AUX_MAX_OVERFLOW))
+
+async_engine = create_async_engine(url_assincrona(DATABASE_URL),
+                                   **opcoes_pool(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+Base = declarative_base()
+
+
+async def get_db():
+    """Dependência do FastAPI: a sessão é sempre fechada, mesmo quando o endpoint lança exceção"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def adicionar_colunas_faltantes(engine, tabela) -> list[str]:
+    """
+    create_all não altera tabelas existentes: adiciona (ALTER TABLE ... ADD COLUMN)
+    as colunas novas do modelo que ainda não existem no banco
+    """
+    existentes = {c['name'] for c in inspect(engine).get_columns(tabela.name)}
+    adicionadas = []
+    with engine.begin() as conn:
+        for coluna in tabela.columns:
+            if coluna.name in existentes:
+                continue
+            tipo = coluna.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}'))
+            adicionadas.append(coluna.name)
+    return adicionadas
+
+
+def tipos_divergentes(existentes: dict, tabela) -> list:
+    """
+    Colunas do modelo cujo tipo no banco (`existentes`: nome -> tipo lido pelo inspector) não é do
+    tipo do modelo, como INTEGER numa coluna BigInteger ou NUMERIC(5, 4) numa Float. Um tipo que
+    já é uma especialização do modelo (BIGINT numa coluna Integer) não entra: nunca estreita
+    """
+    return [coluna for coluna in tabela.columns
+            if coluna.name in existentes and not isinstance(existentes[coluna.name], type(coluna.type))]
+
+
+def converter_tipos_divergentes(engine, tabela) -> dict:
+    """
+    create_all também não muda o tipo de colunas existentes: no PostgreSQL, converte
+    (ALTER COLUMN ... TYPE ... USING) as colunas de tipos_divergentes
+    """
+    if engine.dialect.name != 'postgresql':
+        return {}
+    existentes = {c['name']: c['type'] for c in inspect(engine).get_columns(tabela.name)}
+    convertidas = {}
+    with engine.begin() as conn:
+        for coluna in tipos_divergentes(existentes, tabela):
+            tipo = coluna.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {tabela.name} ALTER COLUMN {coluna.name} TYPE {tipo} '
+                              f'USING {coluna.name}::{tipo}'))
+            convertidas[coluna.name] = f"{existentes[coluna.name].compile(dialect=conn.dialect)} -> {tipo}"
+    return convertidas
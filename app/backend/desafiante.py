@@ -0,0 +1,267 @@
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import BigInteger, Column, DateTime, Float, String
+
+from database import Base
+from features import COLUNAS_ENTRADA, calcular_features_tabela, matriz_features
+from persistencia import FilaCheia
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionDesafiante(Base):
+    """
+    Score do modelo desafiante (modo sombra) ao lado do score do campeão, por predição.
+    Gravada por uma fila própria, depois da resposta do /predict
+    """
+    __tablename__ = "predictions_desafiante"
+    # mesmos tipos de predictions: o id é BIGINT e as probabilidades, já arredondadas em 4 casas,
+    # são double precision
+    prediction_id = Column(BigInteger, primary_key=True)
+    timestamp = Column(DateTime, default=datetime.now)
+    versao_campeao = Column(String(64))
+    versao_desafiante = Column(String(64))
+    probabilidade_campeao = Column(Float)
+    probabilidade_desafiante = Column(Float)
+    resultado_campeao = Column(String(20))
+    resultado_desafiante = Column(String(20))
+    latencia_desafiante_ms = Column(Float)
+
+
+def _percentis(amostras) -> dict:
+    if not amostras:
+        return {'amostras': 0, 'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(np.asarray(amostras) * 1000, [50, 95, 99])
+    return {'amostras': len(amostras), 'p50': round(float(p50), 4),
+            'p95': round(float(p95), 4), 'p99': round(float(p99), 4)}
+
+
+# scorer do desafiante dentro de cada processo do pool (recebido uma vez, na criação do processo)
+_scorer_processo = None
+
+
+def _iniciar_processo(scorer):
+    global _scorer_processo
+    _scorer_processo = scorer
+
+
+def _pontuar_no_processo(matriz: np.ndarray) -> tuple[np.ndarray, float]:
+    """Probabilidades da classe 1 e o tempo de CPU gasto no processo do pool"""
+    inicio = time.process_time()
+    proba = _scorer_processo.proba_positiva(matriz)
+    return proba, time.process_time() - inicio
+
+
+class AvaliadorSombra:
+    """
+    Pontua o modelo desafiante fora do caminho da resposta.
+
+    Os endpoints só chamam submeter(), que nunca bloqueia: se a fila (limitada em linhas)
+    não tiver espaço, o tráfego sombra é descartado e contado. Um pool de threads próprio
+    consome a fila em lotes, pontua o desafiante com uma chamada vetorizada por lote,
+    grava o resultado em predictions_desafiante e alimenta a janela de comparação em memória.
+
+    O scorer compilado leva microssegundos e roda nas próprias threads. Um desafiante não
+    compilado (pipeline sklearn) seguraria o GIL do worker e atrasaria o /predict: ele é
+    pontuado num pool de processos (spawn, `workers` processos), e as threads só montam as
+    features e esperam o resultado. O tempo de CPU de cada lado fica em cpu_segundos
+    """
+
+    def __init__(self, modelo, capacidade: int = 10_000, workers: int = 1, tamanho_lote: int = 256,
+                 janela: int = 10_000, fila_gravacao=None):
+        self.modelo = modelo
+        self.capacidade = capacidade
+        self.workers = workers
+        self.tamanho_lote = tamanho_lote
+        self.fila_gravacao = fila_gravacao
+
+        self._pendentes = deque()
+        self._cond = threading.Condition()
+        self._parando = False
+        self._threads = []
+
+        # janela de comparação: (proba campeão, proba desafiante, aprovado campeão, aprovado desafiante)
+        self._lock_janela = threading.Lock()
+        self._lock_campeao = threading.Lock()
+        self._pares = deque(maxlen=janela)
+        self._latencias_campeao = deque(maxlen=janela)
+        self._latencias_desafiante = deque(maxlen=janela)
+
+        # métricas
+        self.avaliados = 0
+        self.descartados = 0
+        self.falhas = 0
+        self.cpu_segundos = {'worker': 0.0, 'processos': 0.0}
+        self._processos = None
+
+    def _criar_processos(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_iniciar_processo, initargs=(self.modelo.scorer,))
+
+    def iniciar(self):
+        if not self.modelo.scorer.compilado:
+            self._processos = self._criar_processos()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._executar, name=f"sombra-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def registrar_latencia_campeao(self, segundos: float, quantidade: int = 1):
+        """Latência de score do campeão por predição (em lotes, o tempo do lote dividido pelas linhas)"""
+        with self._lock_campeao:
+            self._latencias_campeao.extend([segundos / quantidade] * min(quantidade, self._latencias_campeao.maxlen))
+
+    def submeter(self, itens: list[dict]) -> bool:
+        """
+        Coloca as predições do campeão na fila do desafiante sem bloquear. Os itens são as
+        mesmas linhas enviadas à fila de gravação de predictions (entrada, resultado, id e versão).
+        Devolve False (e descarta os itens) se a fila estiver cheia
+        """
+        with self._cond:
+            if self._parando or len(self._pendentes) + len(itens) > self.capacidade:
+                self.descartados += len(itens)
+                return False
+            self._pendentes.extend(itens)
+            self._cond.notify()
+            return True
+
+    def _proximo_lote(self) -> list[dict]:
+        with self._cond:
+            while not self._pendentes and not self._parando:
+                self._cond.wait()
+            n = min(len(self._pendentes), self.tamanho_lote)
+            return [self._pendentes.popleft() for _ in range(n)]
+
+    def _avaliar(self, lote: list[dict]):
+        modelo = self.modelo
+        inicio = time.perf_counter()
+        tabela = {coluna: [item[coluna] for item in lote] for coluna in COLUNAS_ENTRADA}
+        matriz = matriz_features(calcular_features_tabela(tabela), list(modelo.features))
+        # mesma convenção do campeão no /predict: risco = 1 - probabilidade da classe 1
+        proba_risco = 1 - self._pontuar(matriz)
+        latencia = (time.perf_counter() - inicio) / len(lote)
+
+        aprovado = proba_risco < modelo.threshold
+        agora = datetime.now()
+        linhas = []
+        with self._lock_janela:
+            for item, p, a in zip(lote, proba_risco, aprovado):
+                aprovado_campeao = item['resultado'] == "Aprovado"
+                self._pares.append((item['probabilidade_risco'], float(p), aprovado_campeao, bool(a)))
+                self._latencias_desafiante.append(latencia)
+                # sem banco a predição não tem id: entra só na comparação em memória
+                if item.get('id') is None:
+                    continue
+                linhas.append({
+                    'prediction_id': item['id'],
+                    'timestamp': agora,
+                    'versao_campeao': item['versao_modelo'],
+                    'versao_desafiante': modelo.versao,
+                    'probabilidade_campeao': item['probabilidade_risco'],
+                    'probabilidade_desafiante': round(float(p), 4),
+                    'resultado_campeao': item['resultado'],
+                    'resultado_desafiante': "Aprovado" if a else "Reprovado",
+                    'latencia_desafiante_ms': round(latencia * 1000, 4),
+                })
+        self.avaliados += len(lote)
+
+        if linhas and self.fila_gravacao is not None:
+            try:
+                self.fila_gravacao.enfileirar(linhas)
+            except FilaCheia:
+                # o desafiante nunca segura o campeão: se a gravação não acompanha, descarta
+                self.descartados += len(linhas)
+
+    def _pontuar(self, matriz: np.ndarray) -> np.ndarray:
+        processos = self._processos
+        if processos is None:
+            return self.modelo.scorer.proba_positiva(matriz)
+        try:
+            proba, cpu = processos.submit(_pontuar_no_processo, matriz).result()
+        except BrokenProcessPool:
+            # um processo do pool morreu (ex.: OOM): o próximo lote vai para um pool novo
+            if self._processos is processos and not self._parando:
+                self._processos = self._criar_processos()
+            raise
+        self.cpu_segundos['processos'] += cpu
+        return proba
+
+    def _executar(self):
+        while True:
+            lote = self._proximo_lote()
+            if not lote:
+                return
+            inicio = time.thread_time()
+            try:
+                self._avaliar(lote)
+            except Exception as e:
+                self.falhas += len(lote)
+                logger.warning("Erro ao avaliar predições no desafiante",
+                               extra={'versao': self.modelo.versao, 'linhas': len(lote), 'erro': str(e)})
+            finally:
+                self.cpu_segundos['worker'] += time.thread_time() - inicio
+
+    def parar(self, timeout: float = 5.0):
+        """Encerra o pool; o que ainda está na fila é descartado (tráfego sombra é best-effort)"""
+        with self._cond:
+            self._parando = True
+            self.descartados += len(self._pendentes)
+            self._pendentes.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self._processos is not None:
+            self._processos.shutdown(wait=False, cancel_futures=True)
+
+    def comparacao(self) -> dict:
+        """Concordância de decisões, correlação dos scores e percentis de latência na janela recente"""
+        with self._lock_janela:
+            pares = np.array(self._pares, dtype=np.float64).reshape(-1, 4)
+            latencias_desafiante = list(self._latencias_desafiante)
+
+        with self._lock_campeao:
+            latencias_campeao = list(self._latencias_campeao)
+
+        resumo = {
+            'versao_desafiante': self.modelo.versao,
+            'amostras': len(pares),
+            'taxa_concordancia': None,
+            'correlacao_scores': None,
+            'diferenca_media_scores': None,
+            'taxa_aprovacao_campeao': None,
+            'taxa_aprovacao_desafiante': None,
+        }
+        if len(pares):
+            p_campeao, p_desafiante, a_campeao, a_desafiante = pares.T
+            resumo.update({
+                'taxa_concordancia': round(float(np.mean(a_campeao == a_desafiante)) * 100, 2),
+                'diferenca_media_scores': round(float(np.mean(p_desafiante - p_campeao)), 4),
+                'taxa_aprovacao_campeao': round(float(np.mean(a_campeao)) * 100, 2),
+                'taxa_aprovacao_desafiante': round(float(np.mean(a_desafiante)) * 100, 2),
+            })
+            # correlação de Pearson só é definida com variância nos dois scores
+            if len(pares) > 1 and np.std(p_campeao) > 0 and np.std(p_desafiante) > 0:
+                resumo['correlacao_scores'] = round(float(np.corrcoef(p_campeao, p_desafiante)[0, 1]), 4)
+
+        resumo['latencia_ms'] = {
+            'campeao': _percentis(latencias_campeao),
+            'desafiante': _percentis(latencias_desafiante),
+        }
+        resumo['fila'] = {
+            'profundidade': len(self._pendentes),
+            'capacidade': self.capacidade,
+            'avaliados': self.avaliados,
+            'descartados': self.descartados,
+            'falhas': self.falhas,
+        }
+        resumo['cpu_segundos'] = {local: round(segundos, 4) for local, segundos in self.cpu_segundos.items()}
+        resumo['pool_processos'] = self._processos is not None
+        return resumo
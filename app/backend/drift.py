@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from features import FEATURES_MODELO, calcular_features_tabela, matriz_features
+
+logger = logging.getLogger(__name__)
+
+VARIAVEL_SCORE = 'probabilidade_risco'
+# PSI < 0.1: estável; 0.1 a 0.25: mudança moderada; acima: mudança significativa
+LIMITES_PSI = (0.1, 0.25)
+# suaviza bins vazios no PSI (ln(p/q) com p ou q = 0)
+EPSILON = 1e-4
+
+
+def cortes_quantis(valores: np.ndarray, bins: int) -> np.ndarray:
+    """Cortes internos pelos quantis da referência; variáveis discretas ficam com menos bins"""
+    return np.unique(np.quantile(valores, np.linspace(0, 1, bins + 1)[1:-1]))
+
+
+def psi(atual: np.ndarray, referencia: np.ndarray) -> float:
+    p = np.maximum(atual, EPSILON)
+    q = np.maximum(referencia, EPSILON)
+    return float(np.sum((p - q) * np.log(p / q)))
+
+
+def ks(atual: np.ndarray, referencia: np.ndarray) -> float:
+    """Kolmogorov-Smirnov sobre as distribuições acumuladas nos bins"""
+    return float(np.max(np.abs(np.cumsum(atual) - np.cumsum(referencia))))
+
+
+def status_psi(valor: float | None) -> str:
+    if valor is None:
+        return 'amostras_insuficientes'
+    if valor < LIMITES_PSI[0]:
+        return 'estavel'
+    if valor < LIMITES_PSI[1]:
+        return 'moderado'
+    return 'significativo'
+
+
+class MonitorDrift:
+    """
+    Compara a distribuição recente das features e do score com a dos dados de referência
+    (data/dados_credito_processados.parquet), em PSI e KS por variável.
+
+    Cada variável tem um histograma de tamanho fixo, com cortes nos quantis da referência.
+    A janela deslizante é um anel de `subjanelas` histogramas de janela/subjanelas segundos:
+    a memória não cresce com o tráfego. Os endpoints só chamam registrar()/registrar_lote(),
+    que colocam os valores numa fila limitada; uma thread própria faz a contagem em lotes
+    """
+
+    def __init__(self, caminho_referencia, janela_segundos: float = 3600, subjanelas: int = 12, bins: int = 10,
+                 capacidade: int = 10_000, minimo_amostras: int = 100, intervalo: float = 0.5):
+        self.janela_segundos = janela_segundos
+        self.subjanelas = subjanelas
+        self.bins = bins
+        self.capacidade = capacidade
+        self.minimo_amostras = minimo_amostras
+        self.intervalo = intervalo
+
+        import pandas as pd
+        self._matriz_referencia = matriz_features(
+            calcular_features_tabela(pd.read_parquet(caminho_referencia)), FEATURES_MODELO)
+        self.variaveis = list(FEATURES_MODELO) + [VARIAVEL_SCORE]
+        cortes = [cortes_quantis(self._matriz_referencia[:, j], bins) for j in range(len(FEATURES_MODELO))]
+        self._cortes = cortes + [np.array([])]
+        self._proporcoes_referencia = [self._proporcoes(self._matriz_referencia[:, j], c)
+                                       for j, c in enumerate(cortes)] + [np.array([1.0])]
+        self.versao_modelo = None
+
+        largura = max(len(c) for c in self._cortes) + 1
+        self._lock = threading.Lock()
+        self._contagens = np.zeros((subjanelas, len(self.variaveis), largura), dtype=np.int64)
+        self._ids_subjanela = np.full(subjanelas, -1, dtype=np.int64)
+
+        self._pendentes = deque()
+        self._parar = threading.Event()
+        self._thread = None
+
+        # métricas
+        self.registradas = 0
+        self.descartadas = 0
+
+    @staticmethod
+    def _proporcoes(valores: np.ndarray, cortes: np.ndarray) -> np.ndarray:
+        contagem = np.bincount(np.searchsorted(cortes, valores, side='right'), minlength=len(cortes) + 1)
+        return contagem / max(contagem.sum(), 1)
+
+    def definir_modelo(self, modelo):
+        """
+        Recalcula a referência do score com o modelo ativo e zera as contagens do score:
+        scores de versões diferentes não são comparáveis
+        """
+        features = list(modelo.features)
+        indices = [FEATURES_MODELO.index(f) for f in features]
+        scores = 1 - modelo.scorer.proba_positiva(self._matriz_referencia[:, indices])
+        cortes = cortes_quantis(scores, self.bins)
+        largura = self._contagens.shape[2]
+        if len(cortes) + 1 > largura:
+            cortes = cortes[np.linspace(0, len(cortes) - 1, largura - 1).astype(int)]
+        with self._lock:
+            self._cortes[-1] = cortes
+            self._proporcoes_referencia[-1] = self._proporcoes(scores, cortes)
+            self._contagens[:, -1, :] = 0
+            self.versao_modelo = modelo.versao
+
+    # ------------------------------------------------------------ caminho quente
+    def registrar(self, valores: dict, probabilidade_risco: float):
+        """O(features) e sem lock: uma tupla na fila. Com a fila cheia, a amostra é descartada"""
+        if len(self._pendentes) >= self.capacidade:
+            self.descartadas += 1
+            return
+        self._pendentes.append(tuple(valores[f] for f in FEATURES_MODELO) + (probabilidade_risco,))
+
+    def registrar_lote(self, features: list, matriz: np.ndarray, probabilidade_risco: np.ndarray):
+        """Versão do /predict/batch: a matriz (na ordem de `features`) entra inteira na fila"""
+        if len(self._pendentes) >= self.capacidade:
+            self.descartadas += len(matriz)
+            return
+        self._pendentes.append((features, matriz, probabilidade_risco))
+
+    # ------------------------------------------------------------------ contagem
+    def _drenar(self) -> np.ndarray | None:
+        unitarias, lotes = [], []
+        for _ in range(len(self._pendentes)):
+            item = self._pendentes.popleft()
+            if isinstance(item[0], list):
+                features, matriz, scores = item
+                completa = np.full((len(matriz), len(self.variaveis)), np.nan)
+                for j, feature in enumerate(features):
+                    completa[:, FEATURES_MODELO.index(feature)] = matriz[:, j]
+                completa[:, -1] = scores
+                lotes.append(completa)
+            else:
+                unitarias.append(item)
+        if unitarias:
+            lotes.append(np.array(unitarias, dtype=np.float64))
+        return np.concatenate(lotes) if lotes else None
+
+    def _contar(self, amostras: np.ndarray, agora: float):
+        id_subjanela = int(agora // (self.janela_segundos / self.subjanelas))
+        posicao = id_subjanela % self.subjanelas
+        largura = self._contagens.shape[2]
+        with self._lock:
+            if self._ids_subjanela[posicao] != id_subjanela:
+                self._contagens[posicao] = 0
+                self._ids_subjanela[posicao] = id_subjanela
+            for j, cortes in enumerate(self._cortes):
+                coluna = amostras[:, j]
+                coluna = coluna[~np.isnan(coluna)]
+                self._contagens[posicao, j] += np.bincount(np.searchsorted(cortes, coluna, side='right'),
+                                                           minlength=largura)[:largura]
+        self.registradas += len(amostras)
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                amostras = self._drenar()
+                if amostras is not None:
+                    self._contar(amostras, time.monotonic())
+            except Exception as e:
+                logger.warning("Erro ao atualizar os histogramas de drift", extra={'erro': str(e)})
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name="monitor-drift", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # ------------------------------------------------------------------ consulta
+    def resumo(self) -> dict:
+        """PSI, KS e amostras por variável na janela deslizante"""
+        id_atual = int(time.monotonic() // (self.janela_segundos / self.subjanelas))
+        with self._lock:
+            ativas = self._ids_subjanela > id_atual - self.subjanelas
+            janela = self._contagens[ativas].sum(axis=0)
+            cortes = list(self._cortes)
+            referencias = list(self._proporcoes_referencia)
+            versao = self.versao_modelo
+
+        variaveis = {}
+        for j, variavel in enumerate(self.variaveis):
+            n_bins = len(cortes[j]) + 1
+            contagem = janela[j, :n_bins]
+            amostras = int(contagem.sum())
+            valor_psi = valor_ks = None
+            if amostras >= self.minimo_amostras:
+                atual = contagem / amostras
+                valor_psi = round(psi(atual, referencias[j]), 4)
+                valor_ks = round(ks(atual, referencias[j]), 4)
+            variaveis[variavel] = {'psi': valor_psi, 'ks': valor_ks, 'amostras': amostras,
+                                   'status': status_psi(valor_psi)}
+
+        return {
+            'janela_segundos': self.janela_segundos,
+            'versao_modelo': versao,
+            'variaveis': variaveis,
+            'fila': {
+                'profundidade': len(self._pendentes),
+                'capacidade': self.capacidade,
+                'registradas': self.registradas,
+                'descartadas': self.descartadas,
+            },
+        }
@@ -0,0 +1,191 @@
+import io
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from sqlalchemy import Float, cast, select
+
+# Colunas exportadas (e dos meses arquivados em Parquet, ver particoes.py); os valores numéricos
+# saem como float direto do banco, mesmo de uma tabela ainda com DECIMAL (sem objetos Decimal no Python)
+SCHEMA_EXPORTACAO = pa.schema([
+    ('id', pa.int64()),
+    ('timestamp', pa.timestamp('us')),
+    ('idade', pa.int64()),
+    ('valor_conta_poupanca', pa.float64()),
+    ('valor_conta_corrente', pa.float64()),
+    ('salario_anual', pa.float64()),
+    ('valor_emprestimo', pa.float64()),
+    ('prazo_meses', pa.int64()),
+    ('situacao_moradia', pa.string()),
+    ('resultado', pa.string()),
+    ('probabilidade_risco', pa.float64()),
+    ('threshold_utilizado', pa.float64()),
+    ('versao_modelo', pa.string()),
+    ('motivos', pa.string()),
+])
+COLUNAS_FLOAT = {campo.name for campo in SCHEMA_EXPORTACAO if campo.type == pa.float64()}
+
+# predições com timestamp mais recente que isso ainda podem estar na fila de gravação
+MARGEM_GRAVACAO_SEGUNDOS = 60
+
+TIPOS_MIDIA = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def limite_exportacao(data_fim: datetime | None, margem_segundos: float = MARGEM_GRAVACAO_SEGUNDOS,
+                      agora: datetime | None = None, pendente: datetime | None = None) -> datetime:
+    """
+    Fim efetivo (exclusivo) da janela exportada: `data_fim`, mas nunca depois de agora - margem
+    nem da predição mais antiga ainda na fila de gravação (`pendente`).
+
+    O id não serve de marca d'água para cargas incrementais: cada worker reserva ids em blocos
+    (AlocadorIds) e a fila grava fora da ordem de id, então um id menor pode aparecer depois de
+    um maior já exportado. O timestamp serve, desde que a janela pare antes das predições que
+    ainda podem estar na fila; a próxima carga começa exatamente neste limite. A margem vem do
+    pior atraso da fila (FilaPersistencia.atraso_maximo) e cobre as filas dos outros workers
+    """
+    limite = (agora or datetime.now()) - timedelta(seconds=margem_segundos)
+    if pendente is not None and pendente < limite:
+        limite = pendente
+    return limite if data_fim is None or data_fim > limite else data_fim
+
+
+def consulta_exportacao(tabela, data_inicio: datetime | None = None, data_fim: datetime | None = None):
+    """
+    SELECT de Core (sem ORM) em ordem de (timestamp, id), para leitura com cursor do lado do
+    servidor. A janela é [data_inicio, data_fim)
+    """
+    colunas = [cast(tabela.c[nome], Float).label(nome) if nome in COLUNAS_FLOAT else tabela.c[nome]
+               for nome in SCHEMA_EXPORTACAO.names]
+    consulta = select(*colunas)
+    if data_inicio is not None:
+        consulta = consulta.where(tabela.c.timestamp >= data_inicio)
+    if data_fim is not None:
+        consulta = consulta.where(tabela.c.timestamp < data_fim)
+    return consulta.order_by(tabela.c.timestamp, tabela.c.id)
+
+
+def tabela_arrow(linhas) -> pa.Table:
+    """Transpõe um bloco de linhas em colunas Arrow (uma conversão por coluna, não por valor)"""
+    colunas = list(zip(*linhas)) if linhas else [()] * len(SCHEMA_EXPORTACAO)
+    return pa.Table.from_arrays(
+        [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, SCHEMA_EXPORTACAO)],
+        schema=SCHEMA_EXPORTACAO,
+    )
+
+
+class _Destino(io.RawIOBase):
+    """
+    Arquivo só de escrita que acumula os bytes até o próximo esvaziar(). tell() conta o total já
+    escrito, porque o rodapé do Parquet guarda a posição absoluta de cada row group
+    """
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, dados) -> int:
+        dados = bytes(dados)
+        self._partes.append(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def esvaziar(self) -> bytes:
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+class Formatador:
+    """
+    Converte blocos em bytes de um formato; fim() devolve o que falta (rodapé). Os blocos vêm
+    como linhas do banco (bloco) ou já como tabelas Arrow, lidas do arquivo Parquet (tabela)
+    """
+
+    def bloco(self, linhas) -> bytes:
+        return self.tabela(tabela_arrow(linhas))
+
+    def tabela(self, tabela: pa.Table) -> bytes:
+        raise NotImplementedError
+
+    def fim(self) -> bytes:
+        return b''
+
+
+class FormatadorNdjson(Formatador):
+    def tabela(self, tabela: pa.Table) -> bytes:
+        if not tabela.num_rows:
+            return b''
+        df = tabela.to_pandas()
+        texto = df.to_json(orient='records', lines=True, date_format='iso', date_unit='us', force_ascii=False)
+        return (texto if texto.endswith('\n') else texto + '\n').encode()
+
+
+class FormatadorCsv(Formatador):
+    def __init__(self):
+        self._cabecalho = True
+
+    def tabela(self, tabela: pa.Table) -> bytes:
+        if not tabela.num_rows and not self._cabecalho:
+            return b''
+        saida = io.BytesIO()
+        pacsv.write_csv(tabela, saida, write_options=pacsv.WriteOptions(include_header=self._cabecalho))
+        self._cabecalho = False
+        return saida.getvalue()
+
+    def fim(self) -> bytes:
+        # exportação vazia ainda leva o cabeçalho
+        return self.bloco([]) if self._cabecalho else b''
+
+
+class FormatadorParquet(Formatador):
+    """Um row group por bloco; os bytes de cada row group saem assim que ele é escrito"""
+
+    def __init__(self):
+        self._destino = _Destino()
+        self._escritor = pq.ParquetWriter(self._destino, SCHEMA_EXPORTACAO, compression='zstd')
+
+    def tabela(self, tabela: pa.Table) -> bytes:
+        if tabela.num_rows:
+            self._escritor.write_table(tabela)
+        return self._destino.esvaziar()
+
+    def fim(self) -> bytes:
+        self._escritor.close()
+        return self._destino.esvaziar()
+
+
+class FormatadorArrow(Formatador):
+    """Arrow IPC em modo stream: um record batch por bloco"""
+
+    def __init__(self):
+        self._destino = _Destino()
+        self._escritor = pa.ipc.new_stream(self._destino, SCHEMA_EXPORTACAO)
+
+    def tabela(self, tabela: pa.Table) -> bytes:
+        if tabela.num_rows:
+            self._escritor.write_table(tabela)
+        return self._destino.esvaziar()
+
+    def fim(self) -> bytes:
+        self._escritor.close()
+        return self._destino.esvaziar()
+
+
+FORMATADORES = {
+    'ndjson': FormatadorNdjson,
+    'csv': FormatadorCsv,
+    'parquet': FormatadorParquet,
+    'arrow': FormatadorArrow,
+}
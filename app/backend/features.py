@@ -0,0 +1,147 @@
+import math
+
+import numpy as np
+
+# Ordem das colunas usada no treinamento (notebooks/03.2_machine_learning.ipynb)
+FEATURES_MODELO = [
+    'idade',
+    'log_valor_emprestimo',
+    'log_valor_conta_corrente',
+    'is_conta_corrente_zero',
+    'prazo_meses',
+    'comprometimento_renda',
+    'parcela_mensal_estimada',
+    'renda_livre_mensal',
+    'cobertura_liquidez',
+    'moradia_own',
+    'moradia_rent',
+]
+
+COLUNAS_ENTRADA = [
+    'idade',
+    'valor_conta_poupanca',
+    'valor_conta_corrente',
+    'salario_anual',
+    'valor_emprestimo',
+    'prazo_meses',
+    'situacao_moradia',
+]
+
+
+def features_cliente(idade, valor_conta_poupanca, valor_conta_corrente, salario_anual,
+                     valor_emprestimo, prazo_meses, situacao_moradia) -> dict:
+    """
+    Calcula as features de um único cliente com aritmética escalar do Python (sem NumPy/pandas)
+    """
+    # cria as variáveis derivadas
+    parcela_mensal_estimada = valor_emprestimo / prazo_meses
+    renda_mensal = salario_anual / 12
+    renda_livre_mensal = renda_mensal - parcela_mensal_estimada
+    comprometimento_renda = parcela_mensal_estimada / max(renda_mensal, 1)
+    cobertura_liquidez = (valor_conta_corrente + valor_conta_poupanca) / (parcela_mensal_estimada + 0.01)
+    is_conta_corrente_zero = 1 if valor_conta_corrente == 0 else 0
+
+    # cria as variáveis logaritmicas
+    log_valor_emprestimo = math.log1p(valor_emprestimo)
+    log_valor_conta_corrente = math.log1p(valor_conta_corrente)
+
+    # one hot encoding colocando free como referência
+    moradia_own = 1 if situacao_moradia == "own" else 0
+    moradia_rent = 1 if situacao_moradia == "rent" else 0
+
+    return {
+        'idade': idade,
+        'log_valor_emprestimo': log_valor_emprestimo,
+        'log_valor_conta_corrente': log_valor_conta_corrente,
+        'is_conta_corrente_zero': is_conta_corrente_zero,
+        'prazo_meses': prazo_meses,
+        'comprometimento_renda': comprometimento_renda,
+        'parcela_mensal_estimada': parcela_mensal_estimada,
+        'renda_livre_mensal': renda_livre_mensal,
+        'cobertura_liquidez': cobertura_liquidez,
+        'moradia_own': moradia_own,
+        'moradia_rent': moradia_rent,
+    }
+
+
+def calcular_features(idade, valor_conta_poupanca, valor_conta_corrente, salario_anual,
+                      valor_emprestimo, prazo_meses, situacao_moradia) -> dict:
+    """
+    Versão colunar de preparar_dados_modelo: recebe arrays (ou escalares) com os dados
+    de entrada e devolve um dicionário {feature: np.ndarray} calculado de uma só vez.
+    """
+    idade = np.asarray(idade, dtype=np.float64)
+    valor_conta_poupanca = np.asarray(valor_conta_poupanca, dtype=np.float64)
+    valor_conta_corrente = np.asarray(valor_conta_corrente, dtype=np.float64)
+    salario_anual = np.asarray(salario_anual, dtype=np.float64)
+    valor_emprestimo = np.asarray(valor_emprestimo, dtype=np.float64)
+    prazo_meses = np.asarray(prazo_meses, dtype=np.float64)
+    situacao_moradia = np.asarray(situacao_moradia)
+
+    # cria as variáveis derivadas
+    parcela_mensal_estimada = valor_emprestimo / prazo_meses
+    renda_mensal = salario_anual / 12
+    renda_livre_mensal = renda_mensal - parcela_mensal_estimada
+    comprometimento_renda = parcela_mensal_estimada / np.maximum(renda_mensal, 1)
+    cobertura_liquidez = (valor_conta_corrente + valor_conta_poupanca) / (parcela_mensal_estimada + 0.01)
+    is_conta_corrente_zero = (valor_conta_corrente == 0).astype(np.float64)
+
+    # cria as variáveis logaritmicas
+    log_valor_emprestimo = np.log1p(valor_emprestimo)
+    log_valor_conta_corrente = np.log1p(valor_conta_corrente)
+
+    # one hot encoding colocando free como referência
+    moradia_own = (situacao_moradia == 'own').astype(np.float64)
+    moradia_rent = (situacao_moradia == 'rent').astype(np.float64)
+
+    return {
+        'idade': idade,
+        'log_valor_emprestimo': log_valor_emprestimo,
+        'log_valor_conta_corrente': log_valor_conta_corrente,
+        'is_conta_corrente_zero': is_conta_corrente_zero,
+        'prazo_meses': prazo_meses,
+        'comprometimento_renda': comprometimento_renda,
+        'parcela_mensal_estimada': parcela_mensal_estimada,
+        'renda_livre_mensal': renda_livre_mensal,
+        'cobertura_liquidez': cobertura_liquidez,
+        'moradia_own': moradia_own,
+        'moradia_rent': moradia_rent,
+    }
+
+
+def matriz_features(features: dict, colunas: list) -> np.ndarray:
+    """
+    Empilha as features calculadas numa matriz (n_linhas, n_features) na ordem pedida.
+    """
+    colunas_faltantes = set(colunas) - set(features)
+    if colunas_faltantes:
+        raise KeyError(f"Faltam colunas calculadas: {colunas_faltantes}")
+
+    n = max(np.size(features[c]) for c in colunas)
+    matriz = np.empty((n, len(colunas)), dtype=np.float64)
+    for j, coluna in enumerate(colunas):
+        matriz[:, j] = features[coluna]
+    return matriz
+
+
+def calcular_features_tabela(tabela) -> dict:
+    """
+    Calcula as features a partir de uma tabela colunar (DataFrame ou dict de arrays).
+    Aceita a coluna situacao_moradia ou as colunas one-hot moradia_own/moradia_rent
+    de data/dados_credito_processados.parquet
+    """
+    if 'situacao_moradia' in tabela:
+        situacao_moradia = np.asarray(tabela['situacao_moradia'])
+    else:
+        situacao_moradia = np.where(np.asarray(tabela['moradia_own']) == 1, 'own',
+                                    np.where(np.asarray(tabela['moradia_rent']) == 1, 'rent', 'free'))
+
+    return calcular_features(
+        idade=tabela['idade'],
+        valor_conta_poupanca=tabela['valor_conta_poupanca'],
+        valor_conta_corrente=tabela['valor_conta_corrente'],
+        salario_anual=tabela['salario_anual'],
+        valor_emprestimo=tabela['valor_emprestimo'],
+        prazo_meses=tabela['prazo_meses'],
+        situacao_moradia=situacao_moradia,
+    )
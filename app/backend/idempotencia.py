@@ -0,0 +1,131 @@
+"""
+Idempotency-Keys do /predict. No banco, a chave vale para todos os workers do servidor pré-fork
+e para todos os hosts: a repetição de um request roteada para outro processo devolve a resposta
+original em vez de gravar outra predição. Sem banco, cada processo guarda as próprias chaves.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, String, Text, delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from cache_decisoes import CacheLRU
+from database import Base
+
+# Reserva sem resposta há mais que isso é de um request que morreu no meio (worker encerrado):
+# a chave volta a ficar livre em vez de responder 409 até o fim do TTL
+RESERVA_EXPIRA_SEGUNDOS = 60.0
+# Intervalo entre as limpezas das chaves expiradas, feitas por quem reserva
+LIMPEZA_INTERVALO_SEGUNDOS = 60.0
+
+
+class ChaveIdempotencia(Base):
+    """Uma Idempotency-Key: o hash do payload e a resposta (NULL enquanto o request está em andamento)"""
+    __tablename__ = "idempotencia"
+    chave = Column(String(255), primary_key=True)
+    hash_payload = Column(String(64), nullable=False)
+    resposta = Column(Text)
+    criado_em = Column(DateTime, nullable=False, index=True)
+
+
+class IdempotenciaMemoria:
+    """Chaves na memória do processo (CacheLRU): só valem para requests que caem no mesmo worker"""
+
+    def __init__(self, capacidade: int, ttl: float):
+        self.cache = CacheLRU(capacidade, ttl)
+
+    async def reservar(self, chave: str, hash_payload: str) -> tuple[str, dict | None] | None:
+        """None se a chave foi reservada para este request; senão (hash, resposta) do request original"""
+        if self.cache.guardar_se_ausente(chave, (hash_payload, None)):
+            return None
+        return self.cache.obter(chave) or (hash_payload, None)
+
+    async def concluir(self, chave: str, hash_payload: str, resposta: dict):
+        self.cache.guardar(chave, (hash_payload, resposta))
+
+    async def remover(self, chave: str):
+        self.cache.remover(chave)
+
+    def metricas(self) -> dict:
+        return {'armazem': 'memoria', **self.cache.metricas()}
+
+
+class IdempotenciaBanco:
+    """
+    Chaves na tabela `idempotencia`, pelo engine assíncrono dos endpoints. A reserva é um único
+    INSERT ... ON CONFLICT: entre requests concorrentes com a mesma chave, em qualquer worker ou
+    host, só um insere; os outros leem o hash e a resposta de quem chegou antes
+    """
+
+    def __init__(self, engine, ttl: float, reserva_expira: float = RESERVA_EXPIRA_SEGUNDOS,
+                 intervalo_limpeza: float = LIMPEZA_INTERVALO_SEGUNDOS):
+        self.engine = engine
+        self.ttl = ttl
+        self.reserva_expira = reserva_expira
+        self.intervalo_limpeza = intervalo_limpeza
+        self._proxima_limpeza = 0.0
+
+        # métricas
+        self.reservadas = 0
+        self.repetidas = 0
+        self.removidas = 0
+        self.expiradas = 0
+
+    async def reservar(self, chave: str, hash_payload: str) -> tuple[str, dict | None] | None:
+        """None se a chave foi reservada para este request; senão (hash, resposta) do request original"""
+        tabela = ChaveIdempotencia.__table__
+        dialeto = postgresql if self.engine.dialect.name == 'postgresql' else sqlite
+        agora = datetime.now()
+        stmt = dialeto.insert(tabela).values(chave=chave, hash_payload=hash_payload, resposta=None, criado_em=agora)
+        # uma chave expirada (ou uma reserva abandonada) é reaproveitada no mesmo comando
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c.chave],
+            set_={'hash_payload': stmt.excluded.hash_payload, 'resposta': None, 'criado_em': stmt.excluded.criado_em},
+            where=(tabela.c.criado_em <= agora - timedelta(seconds=self.ttl))
+            | (tabela.c.resposta.is_(None) & (tabela.c.criado_em <= agora - timedelta(seconds=self.reserva_expira)))
+        )
+        async with self.engine.begin() as conn:
+            await self._limpar(conn, agora)
+            if (await conn.execute(stmt)).rowcount == 1:
+                self.reservadas += 1
+                return None
+            linha = (await conn.execute(
+                select(tabela.c.hash_payload, tabela.c.resposta).where(tabela.c.chave == chave)
+            )).first()
+        self.repetidas += 1
+        if linha is None:
+            # o request original falhou e liberou a chave entre o INSERT e o SELECT
+            return hash_payload, None
+        return linha.hash_payload, json.loads(linha.resposta) if linha.resposta is not None else None
+
+    async def concluir(self, chave: str, hash_payload: str, resposta: dict):
+        tabela = ChaveIdempotencia.__table__
+        async with self.engine.begin() as conn:
+            await conn.execute(update(tabela).where(tabela.c.chave == chave, tabela.c.hash_payload == hash_payload)
+                               .values(resposta=json.dumps(resposta)))
+
+    async def remover(self, chave: str):
+        """Libera a chave de um request que falhou: a repetição é processada de novo"""
+        tabela = ChaveIdempotencia.__table__
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(tabela).where(tabela.c.chave == chave, tabela.c.resposta.is_(None)))
+        self.removidas += 1
+
+    async def _limpar(self, conn, agora: datetime):
+        if time.monotonic() < self._proxima_limpeza:
+            return
+        self._proxima_limpeza = time.monotonic() + self.intervalo_limpeza
+        tabela = ChaveIdempotencia.__table__
+        resultado = await conn.execute(delete(tabela).where(tabela.c.criado_em <= agora - timedelta(seconds=self.ttl)))
+        self.expiradas += resultado.rowcount
+
+    def metricas(self) -> dict:
+        return {
+            'armazem': 'banco',
+            'ttl_segundos': self.ttl,
+            'reservadas': self.reservadas,
+            'repetidas': self.repetidas,
+            'removidas': self.removidas,
+            'expiradas': self.expiradas,
+        }
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from metricas import LOGS_SUPRIMIDOS
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+# Acima de LOG_LIMITE_POR_SEGUNDO registros no mesmo segundo, só uma fração LOG_AMOSTRAGEM é escrita
+LOG_LIMITE_POR_SEGUNDO = int(os.getenv("LOG_LIMITE_POR_SEGUNDO", "50"))
+LOG_AMOSTRAGEM = float(os.getenv("LOG_AMOSTRAGEM", "0.01"))
+
+_CAMPOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class FormatadorJson(logging.Formatter):
+    """Uma linha JSON por registro; os campos passados em extra={...} viram chaves do JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        registro = {
+            'timestamp': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensagem': record.getMessage(),
+        }
+        registro.update({k: v for k, v in vars(record).items() if k not in _CAMPOS_PADRAO})
+        if record.exc_info:
+            registro['excecao'] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+class FiltroAmostragem(logging.Filter):
+    """
+    Deixa passar os primeiros `limite` registros de cada segundo; acima disso passa só uma
+    fração `taxa`, marcada com o campo amostragem (peso de cada linha). ERROR e acima sempre passam
+    """
+
+    def __init__(self, limite: int, taxa: float):
+        super().__init__()
+        self.limite = limite
+        self.taxa = taxa
+        self._lock = threading.Lock()
+        self._segundo = 0
+        self._contagem = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        segundo = int(time.monotonic())
+        with self._lock:
+            if segundo != self._segundo:
+                self._segundo, self._contagem = segundo, 0
+            self._contagem += 1
+            if self._contagem <= self.limite:
+                return True
+        if self.taxa > 0 and random.random() < self.taxa:
+            record.amostragem = round(1 / self.taxa)
+            return True
+        LOGS_SUPRIMIDOS.labels(record.levelname).inc()
+        return False
+
+
+def configurar_logs():
+    """Instala o handler JSON com amostragem no logger raiz (uma vez por processo)"""
+    raiz = logging.getLogger()
+    if any(isinstance(h.formatter, FormatadorJson) for h in raiz.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(FormatadorJson())
+    handler.addFilter(FiltroAmostragem(LOG_LIMITE_POR_SEGUNDO, LOG_AMOSTRAGEM))
+    raiz.addHandler(handler)
+    raiz.setLevel(LOG_NIVEL)
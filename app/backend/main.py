@@ -1,31 +1,109 @@
+import time
+
+# marca o início do import do app: base do tempo de importação e da primeira predição no startup
+INICIO_IMPORTACAO = time.perf_counter()
+
 from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field, field_validator
-from typing import Literal
-import pandas as pd
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator, ValidationError
+from typing import Literal, Any, Optional
+import anyio
 import numpy as np
-import joblib
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, DECIMAL
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy import BigInteger, Column, SmallInteger, String, Float, DateTime, Index, inspect, select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import logging
 import os
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+from database import Base, engine, engine_auxiliar, async_engine, get_db, adicionar_colunas_faltantes, converter_tipos_divergentes
+from features import calcular_features, features_cliente, matriz_features
+from registro_modelos import ArtefatoInvalido, ModeloCarregado, RegistroModelos
+from persistencia import AlocadorIds, FilaCheia, FilaPersistencia
+from agregados import atualizar_agregados, consultar_estatisticas, reconstruir_agregados
+from paginacao import CursorInvalido, codificar_cursor, decodificar_cursor, estimar_total
+from particoes import (ArquivoPredicoes, ManutencaoParticoes, criar_particoes, garantir_sequencia_id, inicio_mes,
+                       migrar_para_particionada, registrar_arquivos_locais, somar_meses)
+from desafiante import AvaliadorSombra, PredictionDesafiante
+from cache_decisoes import CacheLRU, hash_entrada
+from idempotencia import ChaveIdempotencia, IdempotenciaBanco, IdempotenciaMemoria
+from simulacao_threshold import MARGEM_GRAVACAO_SEGUNDOS, IndiceScores, consulta_decisoes_alteradas
+from simulacao_ofertas import simular_grade, simular_lista
+from drift import MonitorDrift
+import motivos as motivos_decisao
+from logs import configurar_logs
+import metricas
+
+configurar_logs()
+logger = logging.getLogger(__name__)
 
 SituacaoMoradia = Literal['own', 'rent', 'free']
 
+# Limite de threads usadas para tirar trabalho pesado (lotes, pipeline sklearn) do event loop
+THREADPOOL_TAMANHO = int(os.getenv("THREADPOOL_TAMANHO", "40"))
+TAMANHO_MAXIMO_LOTE = int(os.getenv("TAMANHO_MAXIMO_LOTE", "10000"))
+FILA_CAPACIDADE = int(os.getenv("FILA_CAPACIDADE", "50000"))
+FILA_TAMANHO_LOTE = int(os.getenv("FILA_TAMANHO_LOTE", "500"))
+FILA_INTERVALO_SEGUNDOS = float(os.getenv("FILA_INTERVALO_SEGUNDOS", "0.2"))
+FILA_TIMEOUT_SEGUNDOS = float(os.getenv("FILA_TIMEOUT_SEGUNDOS", "2"))
+# Lotes que o banco recusa (ou que sobram ao parar sem banco) vão para cá e são regravados no próximo início
+FILA_PENDENTES_DIR = Path(os.getenv("FILA_PENDENTES_DIR", Path(__file__).parent.parent.parent / "data" / "fila_pendentes"))
+# Intervalo do observador do registro de modelos (0 desliga a troca automática)
+MODELO_OBSERVAR_SEGUNDOS = float(os.getenv("MODELO_OBSERVAR_SEGUNDOS", "10"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Modelo desafiante (modo sombra): versão do registro pontuada fora do caminho da resposta
+MODELO_DESAFIANTE = os.getenv("MODELO_DESAFIANTE")
+DESAFIANTE_WORKERS = int(os.getenv("DESAFIANTE_WORKERS", "1"))
+DESAFIANTE_CAPACIDADE = int(os.getenv("DESAFIANTE_CAPACIDADE", "10000"))
+DESAFIANTE_TAMANHO_LOTE = int(os.getenv("DESAFIANTE_TAMANHO_LOTE", "256"))
+DESAFIANTE_JANELA = int(os.getenv("DESAFIANTE_JANELA", "10000"))
+# Cache de decisões do /predict (0 desliga) e janela de replay das Idempotency-Keys
+CACHE_DECISOES_TAMANHO = int(os.getenv("CACHE_DECISOES_TAMANHO", "0"))
+CACHE_DECISOES_TTL_SEGUNDOS = float(os.getenv("CACHE_DECISOES_TTL_SEGUNDOS", "300"))
+IDEMPOTENCIA_TAMANHO = int(os.getenv("IDEMPOTENCIA_TAMANHO", "10000"))
+IDEMPOTENCIA_TTL_SEGUNDOS = float(os.getenv("IDEMPOTENCIA_TTL_SEGUNDOS", "86400"))
+# Idempotency-Keys na tabela idempotencia, valendo para todos os workers e hosts (false: memória do processo)
+IDEMPOTENCIA_BANCO = os.getenv("IDEMPOTENCIA_BANCO", "true").lower() in ("1", "true", "sim")
+
+# Linhas lidas do cursor do banco (e convertidas) por vez no /predictions/exportar
+EXPORTACAO_TAMANHO_BLOCO = int(os.getenv("EXPORTACAO_TAMANHO_BLOCO", "10000"))
+# A exportação para antes das predições mais recentes que isso (ainda podem estar na fila);
+# sem a variável, a margem é o pior atraso da fila de gravação (FilaPersistencia.atraso_maximo)
+EXPORTACAO_MARGEM_SEGUNDOS = float(os.getenv("EXPORTACAO_MARGEM_SEGUNDOS")) if os.getenv("EXPORTACAO_MARGEM_SEGUNDOS") else None
+
+# Predições mais recentes que isso ficam fora da simulação de threshold (ainda podem estar na fila);
+# sem a variável, vale o pior atraso da fila de gravação, como na exportação
+SIMULACAO_MARGEM_SEGUNDOS = float(os.getenv("SIMULACAO_MARGEM_SEGUNDOS")) if os.getenv("SIMULACAO_MARGEM_SEGUNDOS") else None
+
+# Pontos (prazo × valor, ou ofertas da lista) pontuados por request no /predict/simulacao-ofertas
+SIMULACAO_OFERTAS_MAXIMO_PONTOS = int(os.getenv("SIMULACAO_OFERTAS_MAXIMO_PONTOS", "20000"))
+
+# Servidor pré-fork: intervalo em que cada worker publica as métricas para o /metrics dos outros
+METRICAS_PUBLICACAO_SEGUNDOS = float(os.getenv("METRICAS_PUBLICACAO_SEGUNDOS", "1"))
+
+# Motivos adversos (reason codes) calculados e gravados com cada decisão (0 desliga)
+MOTIVOS_QUANTIDADE = int(os.getenv("MOTIVOS_QUANTIDADE", "3"))
 
+# Monitor de drift: janela deslizante (em subjanelas), bins por variável e fila de amostras (0 desliga)
+DRIFT_JANELA_SEGUNDOS = float(os.getenv("DRIFT_JANELA_SEGUNDOS", "3600"))
+DRIFT_SUBJANELAS = int(os.getenv("DRIFT_SUBJANELAS", "12"))
+DRIFT_BINS = int(os.getenv("DRIFT_BINS", "10"))
+DRIFT_CAPACIDADE = int(os.getenv("DRIFT_CAPACIDADE", "10000"))
+DRIFT_MINIMO_AMOSTRAS = int(os.getenv("DRIFT_MINIMO_AMOSTRAS", "100"))
 
-DATABASE_URL = os.getenv(
-    "DATABASE_URL"
-)
+# Partições mensais de predictions (PostgreSQL): meses criados à frente, meses mantidos no banco
+# antes de arquivar em Parquet (0 nunca arquiva) e intervalo da manutenção em cada worker (0 desliga)
+PARTICOES_ANTECIPADAS = int(os.getenv("PARTICOES_ANTECIPADAS", "3"))
+PARTICOES_RETENCAO_MESES = int(os.getenv("PARTICOES_RETENCAO_MESES", "0"))
+PARTICOES_INTERVALO_SEGUNDOS = float(os.getenv("PARTICOES_INTERVALO_SEGUNDOS", "3600"))
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Cria/atualiza o schema do banco no startup. Desligado por padrão: o schema é preparado uma vez
+# por deploy com `python migrar.py`, fora do caminho de inicialização de cada worker
+PREPARAR_SCHEMA = os.getenv("PREPARAR_SCHEMA", "false").lower() in ("1", "true", "sim")
 
 
 class ClienteInput(BaseModel):
@@ -55,240 +133,1126 @@ class ClienteInput(BaseModel):
         return v
 
 
+class FaixaPrazos(BaseModel):
+    minimo: int = Field(title="Prazo mínimo", gt=0, le=360)
+    maximo: int = Field(title="Prazo máximo", gt=0, le=360)
+    passo: int = Field(1, title="Passo entre prazos", gt=0)
+
+
+class FaixaValores(BaseModel):
+    minimo: float = Field(title="Valor mínimo", gt=0)
+    maximo: float = Field(title="Valor máximo", gt=0)
+    pontos: int = Field(50, title="Quantidade de valores", description="Valores igualmente espaçados", ge=2)
+
+
+class OfertaCandidata(BaseModel):
+    valor_emprestimo: float = Field(title="Valor do empréstimo", gt=0)
+    prazo_meses: int = Field(title="Prazo do empréstimo", gt=0, le=360)
+
+
+class SimulacaoOfertasInput(BaseModel):
+    cliente: ClienteInput = Field(description="Dados do cliente; valor e prazo são a oferta pedida")
+    prazos: Optional[FaixaPrazos] = None
+    valores: Optional[FaixaValores] = None
+    ofertas: Optional[list[OfertaCandidata]] = Field(None, description="Ofertas candidatas, no lugar da grade")
+    precisao: float = Field(1.0, title="Precisão do valor máximo aprovável (R$)", ge=0.01)
+
+
 class Prediction(Base):
     __tablename__ = "predictions"
-    id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.now)
-    idade = Column(Integer)
-    valor_conta_poupanca = Column(DECIMAL(10, 2))
-    valor_conta_corrente = Column(DECIMAL(10, 2))
-    salario_anual = Column(DECIMAL(10, 2))
-    valor_emprestimo = Column(DECIMAL(10, 2))
-    prazo_meses = Column(Integer)
+    # no PostgreSQL a tabela é particionada por mês de timestamp (particoes.py), e a chave
+    # primária de uma tabela particionada precisa conter a coluna da partição. A sequência do
+    # id é criada por garantir_sequencia_id (chave composta não ganha SERIAL)
+    id = Column(BigInteger, primary_key=True, index=True)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.now)
+    idade = Column(SmallInteger)
+    # valores em double precision: 8 bytes fixos, sem o teto de R$ 100 milhões do DECIMAL(10, 2)
+    # nem a conversão de/para Decimal a cada leitura
+    valor_conta_poupanca = Column(Float)
+    valor_conta_corrente = Column(Float)
+    salario_anual = Column(Float)
+    valor_emprestimo = Column(Float)
+    prazo_meses = Column(SmallInteger)
     situacao_moradia = Column(String(10))
     resultado = Column(String(20))
-    probabilidade_risco = Column(DECIMAL(5, 4))
-    threshold_utilizado = Column(DECIMAL(5, 4))
-
-
-def preparar_dados_modelo(cliente: ClienteInput) -> pd.DataFrame:
-    # cria as variáveis derivadas
-    parcela_mensal_estimada = cliente.valor_emprestimo / cliente.prazo_meses
-    renda_mensal = cliente.salario_anual / 12
-    renda_livre_mensal = renda_mensal - parcela_mensal_estimada
-    comprometimento_renda = parcela_mensal_estimada / max(renda_mensal, 1)
-    cobertura_liquidez = (cliente.valor_conta_corrente + cliente.valor_conta_poupanca) / (
-                parcela_mensal_estimada + 0.01)
-    is_conta_corrente_zero = 1 if cliente.valor_conta_corrente == 0 else 0
-
-    # cria as variáveis logaritmicas
-    log_valor_emprestimo = np.log1p(cliente.valor_emprestimo)
-    log_valor_conta_corrente = np.log1p(cliente.valor_conta_corrente)
-
-    # one hot encoding colocando free como referência
-    moradia_own = 1 if cliente.situacao_moradia == "own" else 0
-    moradia_rent = 1 if cliente.situacao_moradia == "rent" else 0
-
-    dados = {
-        'idade': [cliente.idade],
-        'log_valor_emprestimo': [log_valor_emprestimo],
-        'log_valor_conta_corrente': [log_valor_conta_corrente],
-        'is_conta_corrente_zero': [is_conta_corrente_zero],
-        'prazo_meses': [cliente.prazo_meses],
-        'comprometimento_renda': [comprometimento_renda],
-        'parcela_mensal_estimada': [parcela_mensal_estimada],
-        'renda_livre_mensal': [renda_livre_mensal],
-        'cobertura_liquidez': [cobertura_liquidez],
-        'moradia_own': [moradia_own],
-        'moradia_rent': [moradia_rent]
+    # gravadas já arredondadas em 4 casas
+    probabilidade_risco = Column(Float)
+    threshold_utilizado = Column(Float)
+    versao_modelo = Column(String(64))
+    # códigos dos motivos adversos, do maior impacto para o menor ('R01,R05,R10'; ver motivos.py)
+    motivos = Column(String(40))
+
+    # Índices da paginação por cursor (timestamp, id) e dos filtros do histórico
+    __table_args__ = (
+        Index('ix_predictions_timestamp_id', 'timestamp', 'id'),
+        Index('ix_predictions_resultado_timestamp_id', 'resultado', 'timestamp', 'id'),
+        Index('ix_predictions_moradia_timestamp_id', 'situacao_moradia', 'timestamp', 'id'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+
+class PredictionArquivada(Base):
+    """
+    Catálogo dos meses de predictions arquivados em Parquet (particoes.py), lido por todos os
+    hosts: é ele que define a fronteira do arquivo. A partição de um mês só é removida depois que
+    o registro dele foi confirmado aqui
+    """
+    __tablename__ = "predictions_arquivadas"
+    mes = Column(DateTime, primary_key=True)
+    fim = Column(DateTime, nullable=False)
+    caminho = Column(String(1024), nullable=False)
+    linhas = Column(BigInteger, nullable=False)
+    arquivado_em = Column(DateTime, nullable=False)
+
+
+def serializar_predicao(p: Prediction) -> dict:
+    return {
+        'id': p.id,
+        'timestamp': p.timestamp.isoformat(),
+        'idade': p.idade,
+        'valor_conta_poupanca': float(p.valor_conta_poupanca),
+        'valor_conta_corrente': float(p.valor_conta_corrente),
+        'salario_anual': float(p.salario_anual),
+        'valor_emprestimo': float(p.valor_emprestimo),
+        'prazo_meses': p.prazo_meses,
+        'situacao_moradia': p.situacao_moradia,
+        'resultado': p.resultado,
+        'probabilidade_risco': float(p.probabilidade_risco),
+        'versao_modelo': p.versao_modelo,
+        'motivos': p.motivos.split(',') if p.motivos else [],
     }
 
-    return pd.DataFrame(dados)
+
+def preparar_dados_modelo(cliente: ClienteInput) -> dict:
+    # cria as variáveis derivadas, logaritmicas e o one hot encoding (free como referência)
+    return features_cliente(
+        idade=cliente.idade,
+        valor_conta_poupanca=cliente.valor_conta_poupanca,
+        valor_conta_corrente=cliente.valor_conta_corrente,
+        salario_anual=cliente.salario_anual,
+        valor_emprestimo=cliente.valor_emprestimo,
+        prazo_meses=cliente.prazo_meses,
+        situacao_moradia=cliente.situacao_moradia,
+    )
 
 
-modelos = {}
+def preparar_dados_lote(clientes: list[ClienteInput], colunas: list) -> np.ndarray:
+    """
+    Versão colunar de preparar_dados_modelo: calcula as features de todo o lote
+    com operações NumPy e devolve uma matriz na ordem de colunas do modelo
+    """
+    features = calcular_features(
+        idade=[c.idade for c in clientes],
+        valor_conta_poupanca=[c.valor_conta_poupanca for c in clientes],
+        valor_conta_corrente=[c.valor_conta_corrente for c in clientes],
+        salario_anual=[c.salario_anual for c in clientes],
+        valor_emprestimo=[c.valor_emprestimo for c in clientes],
+        prazo_meses=[c.prazo_meses for c in clientes],
+        situacao_moradia=[c.situacao_moradia for c in clientes],
+    )
+    return matriz_features(features, colunas)
+
+
+persistencia = {}
+sombra = {}
+drift = {}
 
 CAMINHO_MODELO = Path(__file__).parent.parent.parent / "modelos" / "modelo_credito_final.joblib"
+CAMINHO_REGISTRO = Path(os.getenv("CAMINHO_REGISTRO", Path(__file__).parent.parent.parent / "modelos" / "registro"))
+CAMINHO_REFERENCIA = Path(__file__).parent.parent.parent / "data" / "dados_credito_processados.parquet"
+CAMINHO_ARQUIVO_PREDICOES = Path(os.getenv("CAMINHO_ARQUIVO_PREDICOES",
+                                           Path(__file__).parent.parent.parent / "data" / "arquivo_predicoes"))
+
+registro = RegistroModelos(CAMINHO_REGISTRO, CAMINHO_MODELO, CAMINHO_REFERENCIA)
+
+cache_decisoes = CacheLRU(CACHE_DECISOES_TAMANHO, CACHE_DECISOES_TTL_SEGUNDOS) if CACHE_DECISOES_TAMANHO > 0 else None
+# sem o banco (ou com IDEMPOTENCIA_BANCO=false) as chaves ficam só na memória do processo
+idempotencia_memoria = IdempotenciaMemoria(IDEMPOTENCIA_TAMANHO, IDEMPOTENCIA_TTL_SEGUNDOS)
+indice_scores = IndiceScores()
+arquivo_predicoes = ArquivoPredicoes(CAMINHO_ARQUIVO_PREDICOES, PredictionArquivada.__table__)
+
+
+def invalidar_cache_decisoes(anterior: ModeloCarregado | None, novo: ModeloCarregado):
+    # a versão já faz parte da chave; limpar só devolve a memória das decisões antigas
+    if anterior is not None and cache_decisoes is not None:
+        cache_decisoes.limpar()
+
+
+def atualizar_referencia_drift(anterior: ModeloCarregado | None, novo: ModeloCarregado):
+    monitor = drift.get('monitor')
+    if monitor is not None:
+        monitor.definir_modelo(novo)
+
+
+registro.ao_trocar(invalidar_cache_decisoes)
+registro.ao_trocar(atualizar_referencia_drift)
+
+
+def preparar_schema():
+    """
+    Cria as tabelas e os índices, adiciona as colunas novas, converte os tipos antigos de
+    predictions_desafiante, converte predictions em tabela particionada (PostgreSQL) com as
+    partições dos próximos meses e faz a carga inicial do rollup de estatísticas. Roda no
+    `python migrar.py` (ou no startup, com PREPARAR_SCHEMA=true)
+    """
+    Base.metadata.create_all(bind=engine)
+    # create_all não adiciona índices novos a tabelas que já existem
+    for indice in Prediction.__table__.indexes:
+        indice.create(bind=engine, checkfirst=True)
+    adicionadas = adicionar_colunas_faltantes(engine, Prediction.__table__)
+    if adicionadas:
+        logger.info("Colunas adicionadas em predictions", extra={'colunas': adicionadas})
+    # predictions_desafiante foi criada com prediction_id INTEGER e probabilidades NUMERIC(5, 4)
+    adicionadas = adicionar_colunas_faltantes(engine, PredictionDesafiante.__table__)
+    convertidas = converter_tipos_divergentes(engine, PredictionDesafiante.__table__)
+    if adicionadas or convertidas:
+        logger.info("predictions_desafiante atualizada", extra={'colunas': adicionadas, 'tipos': convertidas})
+    migrar_para_particionada(engine, Prediction.__table__, PARTICOES_ANTECIPADAS)
+    if engine.dialect.name == 'postgresql':
+        mes_atual = inicio_mes(datetime.now())
+        with engine.begin() as conn:
+            garantir_sequencia_id(conn, Prediction.__table__)
+            criadas = criar_particoes(conn, Prediction.__table__, mes_atual, somar_meses(mes_atual, PARTICOES_ANTECIPADAS))
+            registrados = registrar_arquivos_locais(conn, Prediction.__table__, arquivo_predicoes)
+        if criadas:
+            logger.info("Partições de predictions criadas", extra={'particoes': criadas})
+        if registrados:
+            logger.info("Meses já arquivados registrados no catálogo", extra={'arquivos': registrados})
+    logger.info("Tabelas do banco de dados criadas/verificadas com sucesso")
+
+    # Carga inicial do rollup de estatísticas (só roda com a tabela de agregados vazia)
+    linhas_agregadas = reconstruir_agregados(engine, Prediction.__table__, corte=datetime.now())
+    if linhas_agregadas:
+        logger.info("Rollup de estatísticas reconstruído", extra={'linhas': linhas_agregadas})
+
+
+def criar_monitor_drift() -> MonitorDrift:
+    return MonitorDrift(
+        CAMINHO_REFERENCIA,
+        janela_segundos=DRIFT_JANELA_SEGUNDOS,
+        subjanelas=DRIFT_SUBJANELAS,
+        bins=DRIFT_BINS,
+        capacidade=DRIFT_CAPACIDADE,
+        minimo_amostras=DRIFT_MINIMO_AMOSTRAS
+    )
+
+
+def iniciar_drift(monitor: MonitorDrift | None = None):
+    """
+    Monta o monitor de drift (lê a referência com pandas) fora do caminho de inicialização:
+    até ele ficar pronto, os endpoints simplesmente não registram amostras. O servidor pré-fork
+    passa um monitor já montado no mestre
+    """
+    try:
+        monitor = monitor or criar_monitor_drift()
+        # publicado antes de ler registro.atual: uma troca de versão daqui em diante chega pelo ouvinte
+        drift['monitor'] = monitor
+        monitor.definir_modelo(registro.atual)
+        monitor.iniciar()
+        metricas.coletor.drift = monitor
+    except Exception as e:
+        drift.pop('monitor', None)
+        logger.warning("Monitor de drift desligado", extra={'erro': str(e)})
+
+
+def aquecer(modelo: ModeloCarregado):
+    """Pontua um cliente sintético pelo mesmo caminho do /predict (sem gravar): mede a primeira predição"""
+    cliente = ClienteInput(idade=35, valor_conta_poupanca=1000, valor_conta_corrente=500, salario_anual=60000,
+                           valor_emprestimo=5000, prazo_meses=24, situacao_moradia='own')
+    _, contribuicoes = pontuar_cliente(modelo.scorer, preparar_dados_modelo(cliente))
+    if contribuicoes is not None:
+        motivos_decisao.motivos_adversos_cliente(contribuicoes, modelo.features, MOTIVOS_QUANTIDADE)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    try:
-        dados_modelo = joblib.load(CAMINHO_MODELO)
-        modelos['pipeline'] = dados_modelo['modelo']
-        modelos['threshold'] = dados_modelo['threshold_f2']
-        modelos['features'] = dados_modelo['features']
-        print("✅ Modelo carregado com sucesso!")
-    except FileNotFoundError:
-        raise
+    inicio = time.perf_counter()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_TAMANHO
+
+    # no servidor pré-fork (servidor.py) o mestre já carregou o modelo antes do fork: o worker só
+    # herda as páginas, compartilhadas com os outros workers
+    modelo = registro.atual
+    if modelo is None:
+        modelo = registro.ativar()
+        logger.info("Modelo carregado com sucesso")
+    fim_modelo = time.perf_counter()
+
+    carga_drift = None
+    if DRIFT_CAPACIDADE > 0:
+        carga_drift = threading.Thread(target=iniciar_drift, args=(drift.pop('preparado', None),),
+                                       name="carga-drift", daemon=True)
+        carga_drift.start()
+    if MODELO_OBSERVAR_SEGUNDOS > 0:
+        registro.observar(MODELO_OBSERVAR_SEGUNDOS)
+    publicador = None
+    if metricas.MULTIPROCESSO_DIR:
+        publicador = metricas.PublicadorMetricas(METRICAS_PUBLICACAO_SEGUNDOS)
+        publicador.iniciar()
 
-    # Criar tabelas no banco de dados
     try:
-        Base.metadata.create_all(bind=engine)
-        print("✅ Tabelas do banco de dados criadas/verificadas com sucesso!")
+        if PREPARAR_SCHEMA:
+            preparar_schema()
+
+        alocador = AlocadorIds(engine, Prediction.__table__)
+        alocador.preparar()
+        fila = FilaPersistencia(
+            engine, Prediction.__table__,
+            capacidade=FILA_CAPACIDADE,
+            tamanho_lote=FILA_TAMANHO_LOTE,
+            intervalo=FILA_INTERVALO_SEGUNDOS,
+            timeout_enfileirar=FILA_TIMEOUT_SEGUNDOS,
+            ao_gravar=atualizar_agregados,
+            diretorio_pendentes=FILA_PENDENTES_DIR
+        )
+        fila.iniciar()
+        persistencia['alocador'] = alocador
+        persistencia['fila'] = fila
+        metricas.coletor.filas[Prediction.__tablename__] = fila
+        if IDEMPOTENCIA_BANCO:
+            if inspect(engine).has_table(ChaveIdempotencia.__tablename__):
+                persistencia['idempotencia'] = IdempotenciaBanco(async_engine, IDEMPOTENCIA_TTL_SEGUNDOS)
+            else:
+                logger.warning("Tabela de Idempotency-Keys ausente (rode `python migrar.py`); "
+                               "as chaves valem só dentro de cada worker")
+        if engine.dialect.name == 'postgresql':
+            # com PARTICOES_INTERVALO_SEGUNDOS=0 a thread só relê o catálogo dos meses arquivados
+            manutencao = ManutencaoParticoes(engine_auxiliar, Prediction.__table__, arquivo_predicoes,
+                                             PARTICOES_ANTECIPADAS, PARTICOES_RETENCAO_MESES,
+                                             PARTICOES_INTERVALO_SEGUNDOS)
+            manutencao.iniciar()
+            persistencia['particoes'] = manutencao
     except Exception as e:
-        print(f"⚠️ Aviso: Não foi possível conectar ao banco de dados: {e}")
-        print("   A API continuará funcionando, mas sem salvar predições.")
+        metricas.FALHAS_BANCO_CONEXAO.inc()
+        logger.warning("Não foi possível conectar ao banco de dados; a API continuará funcionando, "
+                       "mas sem salvar predições (o schema foi preparado com `python migrar.py`?)",
+                       extra={'erro': str(e)})
+
+    # Desafiante em modo sombra: uma falha aqui nunca impede o campeão de subir
+    if MODELO_DESAFIANTE:
+        try:
+            modelo_desafiante = registro.carregar(MODELO_DESAFIANTE)
+            fila_desafiante = None
+            if persistencia:
+                fila_desafiante = FilaPersistencia(
+                    engine_auxiliar, PredictionDesafiante.__table__,
+                    capacidade=DESAFIANTE_CAPACIDADE,
+                    tamanho_lote=FILA_TAMANHO_LOTE,
+                    intervalo=FILA_INTERVALO_SEGUNDOS,
+                    timeout_enfileirar=FILA_TIMEOUT_SEGUNDOS,
+                    diretorio_pendentes=FILA_PENDENTES_DIR
+                )
+                fila_desafiante.iniciar()
+                persistencia['fila_desafiante'] = fila_desafiante
+                metricas.coletor.filas[PredictionDesafiante.__tablename__] = fila_desafiante
+            avaliador = AvaliadorSombra(
+                modelo_desafiante,
+                capacidade=DESAFIANTE_CAPACIDADE,
+                workers=DESAFIANTE_WORKERS,
+                tamanho_lote=DESAFIANTE_TAMANHO_LOTE,
+                janela=DESAFIANTE_JANELA,
+                fila_gravacao=fila_desafiante
+            )
+            avaliador.iniciar()
+            sombra['avaliador'] = avaliador
+            metricas.coletor.sombra = avaliador
+            logger.info("Desafiante em modo sombra", extra={'versao': modelo_desafiante.versao})
+        except Exception as e:
+            logger.warning("Desafiante não carregado", extra={'versao': MODELO_DESAFIANTE, 'erro': str(e)})
+
+    aquecer(modelo)
+    fim = time.perf_counter()
+    metricas.INICIALIZACAO.update({
+        'inicializacao': fim - inicio,
+        'modelo': fim_modelo - inicio,
+        'primeira_predicao': fim - INICIO_IMPORTACAO,
+    })
+    logger.info("API pronta", extra={
+        'importacao_ms': round(metricas.INICIALIZACAO['importacao'] * 1000, 1),
+        'inicializacao_ms': round((fim - inicio) * 1000, 1),
+        'modelo_ms': round((fim_modelo - inicio) * 1000, 1),
+        'primeira_predicao_ms': round((fim - INICIO_IMPORTACAO) * 1000, 1),
+        'formato_modelo': modelo.formato,
+        'artefato_modelo': modelo.artefato,
+        'versao': modelo.versao,
+    })
 
     yield
 
-    modelos.clear()
+    if carga_drift is not None:
+        carga_drift.join(timeout=5)
+    if 'avaliador' in sombra:
+        sombra['avaliador'].parar()
+    sombra.clear()
+    metricas.coletor.sombra = None
+    if 'monitor' in drift:
+        drift['monitor'].parar()
+    drift.clear()
+    metricas.coletor.drift = None
+
+    if 'particoes' in persistencia:
+        persistencia['particoes'].parar()
+    # Grava as predições que ainda estão no buffer antes de encerrar
+    if 'fila_desafiante' in persistencia:
+        persistencia['fila_desafiante'].parar()
+    if 'fila' in persistencia:
+        persistencia['fila'].parar()
+        logger.info("Fila de persistência encerrada", extra=persistencia['fila'].metricas())
+    persistencia.clear()
+    if publicador is not None:
+        # os totais do worker ficam no arquivo dele e seguem somando depois que ele sai
+        publicador.parar()
+    metricas.coletor.filas.clear()
+    registro.parar()
+    await async_engine.dispose()
 
 
 app = FastAPI(title="Sistema de Análise de Crédito", lifespan=lifespan)
 
+metricas.coletor.engines['sincrono'] = engine
+metricas.coletor.engines['auxiliar'] = engine_auxiliar
+metricas.coletor.engines['assincrono'] = async_engine.sync_engine
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware, que custaria mais que o próprio /predict):
+    marca o início do request para as etapas do handler e conta status e duração por rota
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        scope.setdefault('state', {})['inicio'] = inicio
+        status = 500
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem['type'] == 'http.response.start':
+                status = mensagem['status']
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # rota pelo template (/predictions/{prediction_id}), nunca pelo caminho, para limitar os labels
+            rota = getattr(scope.get('route'), 'path', 'desconhecida')
+            metricas.registrar_requisicao(rota, scope['method'], status, time.perf_counter() - inicio)
+
+
+app.add_middleware(MiddlewareMetricas)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    """
+    Métricas no formato do Prometheus
+    """
+    conteudo, tipo = metricas.exportar()
+    return Response(content=conteudo, media_type=tipo)
+
+
+async def gravar_predicoes(linhas: list[dict]) -> list[int]:
+    """
+    Reserva os ids e coloca as linhas na fila de gravação sem bloquear o event loop:
+    só vai para o threadpool quando precisa reservar um novo bloco de ids ou esperar espaço na fila
+    """
+    alocador, fila = persistencia['alocador'], persistencia['fila']
+    if alocador.disponiveis >= len(linhas):
+        ids = alocador.reservar(len(linhas))
+    else:
+        ids = await run_in_threadpool(alocador.reservar, len(linhas))
+
+    for linha, prediction_id in zip(linhas, ids):
+        linha['id'] = prediction_id
+    if not fila.tentar_enfileirar(linhas):
+        await run_in_threadpool(fila.enfileirar, linhas)
+    return ids
+
+
+def margem_gravacao(configurada: float | None) -> tuple[float, datetime | None]:
+    """
+    Margem (segundos) e predição mais antiga ainda na fila deste worker, para as leituras que param
+    antes do que pode não ter sido gravado. Sem margem configurada, usa o pior atraso da fila
+    """
+    fila = persistencia.get('fila')
+    if fila is None:
+        return (configurada if configurada is not None else MARGEM_GRAVACAO_SEGUNDOS), None
+    return (configurada if configurada is not None else fila.atraso_maximo()), fila.pendente_mais_antiga()
+
+
+def enviar_para_sombra(linhas: list[dict], latencia: float | None):
+    """
+    Entrega as predições ao desafiante, se houver. Nunca bloqueia nem falha:
+    com a fila do desafiante cheia, o tráfego sombra é descartado. Sem `latencia`
+    (decisão do cache, o campeão não pontuou) a latência do campeão não é registrada
+    """
+    avaliador = sombra.get('avaliador')
+    if avaliador is None:
+        return
+    if latencia is not None:
+        avaliador.registrar_latencia_campeao(latencia, len(linhas))
+    avaliador.submeter(linhas)
+
+
+def registrar_decisao_cache(cliente: ClienteInput, dados: dict, modelo: ModeloCarregado, resultado: dict):
+    """
+    Uma decisão devolvida pelo cache também é uma decisão servida: entra nos contadores, no
+    drift e na comparação do desafiante. O desafiante recebe a linha sem id, então ela só entra
+    na janela em memória (a linha de predictions_desafiante já foi gravada com o id original)
+    """
+    metricas.registrar_decisoes(resultado['resultado'] == "Aprovado", resultado['probabilidade_risco'],
+                                do_cache=True)
+    if 'monitor' in drift:
+        drift['monitor'].registrar(preparar_dados_modelo(cliente), resultado['probabilidade_risco'])
+    enviar_para_sombra([{
+        **dados,
+        'id': None,
+        'resultado': resultado['resultado'],
+        'probabilidade_risco': resultado['probabilidade_risco'],
+        'versao_modelo': modelo.versao,
+    }], None)
+
+
+def pontuar_cliente(scorer, valores: dict) -> tuple[float, Any]:
+    """Probabilidade da classe 1 e, com os motivos ligados, as contribuições de cada feature"""
+    if MOTIVOS_QUANTIDADE > 0:
+        return scorer.proba_e_contribuicoes_valores(valores)
+    return scorer.proba_positiva_valores(valores), None
+
+
+async def decidir(cliente: ClienteInput, dados: dict, modelo: ModeloCarregado) -> dict:
+    """
+    Pontua e grava uma predição. Com o cache de decisões ligado, uma entrada idêntica
+    já avaliada pela mesma versão do modelo devolve a decisão (e o prediction_id) original
+    """
+    chave = hash_entrada(dados, modelo.versao) if cache_decisoes is not None else None
+    if chave is not None:
+        em_cache = cache_decisoes.obter(chave)
+        if em_cache is not None:
+            registrar_decisao_cache(cliente, dados, modelo, em_cache)
+            return dict(em_cache)
+
+    inicio = time.perf_counter()
+    valores = preparar_dados_modelo(cliente)
+    fim_features = time.perf_counter()
+    scorer = modelo.scorer
+    # o scorer compilado leva microssegundos; o pipeline sklearn roda fora do event loop
+    if scorer.compilado:
+        proba, contribuicoes = pontuar_cliente(scorer, valores)
+    else:
+        proba, contribuicoes = await run_in_threadpool(pontuar_cliente, scorer, valores)
+    lista_motivos = []
+    if contribuicoes is not None:
+        lista_motivos = motivos_decisao.motivos_adversos_cliente(contribuicoes, modelo.features, MOTIVOS_QUANTIDADE)
+    fim_score = time.perf_counter()
+    latencia = fim_score - inicio
+    metricas.ETAPA_FEATURES.observe(fim_features - inicio)
+    metricas.ETAPA_SCORE.observe(fim_score - fim_features)
+    threshold = modelo.threshold
+
+    # Inverte probabilidade (proba = prob de ser BOM, queremos prob de risco)
+    proba_inadimplente = 1 - proba
+    aprovado = proba_inadimplente < threshold
+
+    resultado_dict = {
+        'resultado': "Aprovado" if aprovado else "Reprovado",
+        'probabilidade_risco': round(float(proba_inadimplente), 4),
+        'threshold_utilizado': round(float(threshold), 4),
+        'motivos': lista_motivos
+    }
+    metricas.registrar_decisoes(aprovado, resultado_dict['probabilidade_risco'])
+
+    linha = {
+        'timestamp': datetime.now(),
+        **dados,
+        'resultado': resultado_dict['resultado'],
+        'probabilidade_risco': resultado_dict['probabilidade_risco'],
+        'threshold_utilizado': resultado_dict['threshold_utilizado'],
+        'versao_modelo': modelo.versao,
+        'motivos': ','.join(codigo for codigo, _ in lista_motivos) or None
+    }
+
+    # A gravação é feita em segundo plano pela fila; o id é gerado aqui mesmo
+    if persistencia:
+        inicio_persistencia = time.perf_counter()
+        try:
+            ids = await gravar_predicoes([linha])
+            resultado_dict['prediction_id'] = ids[0]
+            metricas.ETAPA_PERSISTENCIA.observe(time.perf_counter() - inicio_persistencia)
+        except FilaCheia as e:
+            raise HTTPException(status_code=503, detail=f"{e}. Tente novamente em segundos.")
+        except Exception as e:
+            metricas.FALHAS_BANCO_PREDICT.inc()
+            logger.warning("Erro ao salvar predição no banco", extra={'erro': str(e)})
+            # Continua mesmo se falhar (não quebra a API)
+
+    enviar_para_sombra([linha], latencia)
+    if 'monitor' in drift:
+        drift['monitor'].registrar(valores, proba_inadimplente)
+    if chave is not None:
+        cache_decisoes.guardar(chave, dict(resultado_dict))
+    return resultado_dict
+
+
+async def reservar_idempotencia(chave: str, hash_payload: str) -> tuple[Any, tuple[str, dict | None] | None]:
+    """
+    Reserva a chave no armazém do banco (ou na memória, sem ele). Devolve o armazém usado e
+    None se a chave ficou com este request, ou (hash, resposta) do request original
+    """
+    armazem = persistencia.get('idempotencia')
+    if armazem is not None:
+        try:
+            return armazem, await armazem.reservar(chave, hash_payload)
+        except Exception as e:
+            metricas.FALHAS_BANCO_IDEMPOTENCIA.inc()
+            logger.warning("Erro ao reservar a Idempotency-Key no banco; usando a memória do worker",
+                           extra={'erro': str(e)})
+    return idempotencia_memoria, await idempotencia_memoria.reservar(chave, hash_payload)
+
+
+async def liberar_idempotencia(armazem, chave: str):
+    try:
+        await armazem.remover(chave)
+    except Exception as e:
+        metricas.FALHAS_BANCO_IDEMPOTENCIA.inc()
+        logger.warning("Erro ao liberar a Idempotency-Key", extra={'erro': str(e)})
+
 
 @app.post('/predict')
-def predict_credit(cliente: ClienteInput):
-    if 'pipeline' not in modelos or 'features' not in modelos:
+async def predict_credit(request: Request, cliente: ClienteInput,
+                         idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+                         motivos: bool = Query(False, description="Inclui os motivos adversos na resposta")):
+    # leitura do corpo, parse do JSON e validação do ClienteInput acontecem antes do handler
+    inicio_request = request.state.inicio
+    inicio = time.perf_counter()
+    metricas.ETAPA_VALIDACAO.observe(inicio - inicio_request)
+
+    # referência única para todo o request: uma troca de versão no meio não o afeta
+    modelo = registro.atual
+    if modelo is None:
         raise HTTPException(status_code=503, detail="O modelo ainda não foi carregado. Tente novamente em segundos.")
 
+    dados = cliente.model_dump()
+
+    # Idempotency-Key: a repetição de um request devolve a resposta original (mesmo prediction_id),
+    # em qualquer worker quando as chaves estão no banco
+    if idempotency_key:
+        hash_payload = hash_entrada(dados)
+        armazem, original = await reservar_idempotencia(idempotency_key, hash_payload)
+        if original is not None:
+            hash_original, resposta = original
+            if hash_original != hash_payload:
+                raise HTTPException(status_code=409, detail="Idempotency-Key já usada com outro payload")
+            if resposta is None:
+                raise HTTPException(status_code=409, detail="Request com esta Idempotency-Key ainda em processamento")
+            return formatar_resposta(dict(resposta), motivos)
+
     try:
-        df = preparar_dados_modelo(cliente)
-        colunas_esperadas = modelos['features']
-        colunas_faltantes = set(colunas_esperadas) - set(df.columns)
-        if colunas_faltantes:
-            raise HTTPException(status_code=500, detail=f"Erro interno: Faltam colunas calculadas: {colunas_faltantes}")
+        resultado_dict = await decidir(cliente, dados, modelo)
+    except HTTPException:
+        if idempotency_key:
+            await liberar_idempotencia(armazem, idempotency_key)
+        raise
+    except Exception as e:
+        if idempotency_key:
+            await liberar_idempotencia(armazem, idempotency_key)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if idempotency_key:
+        try:
+            await armazem.concluir(idempotency_key, hash_payload, dict(resultado_dict))
+        except Exception as e:
+            # a decisão já foi gravada: a repetição recebe 409 até a reserva expirar, nunca outra linha
+            metricas.FALHAS_BANCO_IDEMPOTENCIA.inc()
+            logger.warning("Erro ao guardar a resposta da Idempotency-Key", extra={'erro': str(e)})
+    metricas.ETAPA_TOTAL.observe(time.perf_counter() - inicio_request)
+    return formatar_resposta(resultado_dict, motivos)
+
+
+def formatar_resposta(resultado: dict, motivos: bool) -> dict:
+    # o cache e a Idempotency-Key guardam os motivos como (código, impacto); a descrição só é
+    # montada quando pedida
+    if motivos:
+        resultado['motivos'] = motivos_decisao.descrever_cliente(resultado.get('motivos', []))
+    else:
+        resultado.pop('motivos', None)
+    return resultado
 
-        df_final = df[colunas_esperadas]
 
-        pipeline = modelos['pipeline']
-        proba = pipeline.predict_proba(df_final)[0][1]
-        threshold = modelos['threshold']
+def avaliar_lote(clientes: list[dict], modelo: ModeloCarregado,
+                 incluir_motivos: bool = False) -> tuple[list[dict], list[dict], list[int], float]:
+    """
+    Valida, calcula as features e pontua o lote com uma única chamada ao modelo. Devolve os
+    resultados na ordem de entrada, as linhas a gravar, os índices válidos e o tempo de score
+    """
+    resultados: list[dict] = [{'indice': i} for i in range(len(clientes))]
+    validos: list[ClienteInput] = []
+    indices_validos: list[int] = []
+
+    for i, item in enumerate(clientes):
+        try:
+            validos.append(ClienteInput.model_validate(item))
+            indices_validos.append(i)
+        except ValidationError as e:
+            resultados[i]['erros'] = e.errors(include_url=False, include_context=False)
+
+    if not validos:
+        return resultados, [], [], 0.0
+
+    try:
+        matriz = preparar_dados_lote(validos, list(modelo.features))
+
+        scorer = modelo.scorer
+        threshold = modelo.threshold
 
         # Inverte probabilidade (proba = prob de ser BOM, queremos prob de risco)
+        inicio = time.perf_counter()
+        if MOTIVOS_QUANTIDADE > 0:
+            proba, contribuicoes = scorer.proba_e_contribuicoes(matriz)
+        else:
+            proba, contribuicoes = scorer.proba_positiva(matriz), None
         proba_inadimplente = 1 - proba
+        latencia = time.perf_counter() - inicio
         aprovado = proba_inadimplente < threshold
+        proba_arredondada = np.round(proba_inadimplente.astype(float), 4)
+        threshold_arredondado = round(float(threshold), 4)
+    except KeyError as e:
+        raise HTTPException(status_code=500, detail=f"Erro interno: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # motivos do lote inteiro de uma vez; a descrição por linha só é montada se pedida
+    codigos_motivos = [None] * len(validos)
+    if contribuicoes is not None:
+        indices_motivos, impactos = motivos_decisao.motivos_adversos(contribuicoes, modelo.features, MOTIVOS_QUANTIDADE)
+        codigos_motivos = motivos_decisao.codificar(indices_motivos, modelo.features)
+        if incluir_motivos:
+            indices_motivos, impactos = indices_motivos.tolist(), impactos.tolist()
+
+    agora = datetime.now()
+    linhas = []
+    for j, (cliente, i) in enumerate(zip(validos, indices_validos)):
+        resultados[i].update({
+            'resultado': "Aprovado" if aprovado[j] else "Reprovado",
+            'probabilidade_risco': float(proba_arredondada[j]),
+            'threshold_utilizado': threshold_arredondado
+        })
+        if incluir_motivos:
+            resultados[i]['motivos'] = [] if contribuicoes is None else motivos_decisao.descrever(
+                indices_motivos[j], impactos[j], modelo.features)
+        linhas.append({
+            'timestamp': agora,
+            **cliente.model_dump(),
+            'resultado': resultados[i]['resultado'],
+            'probabilidade_risco': resultados[i]['probabilidade_risco'],
+            'threshold_utilizado': threshold_arredondado,
+            'versao_modelo': modelo.versao,
+            'motivos': codigos_motivos[j]
+        })
+    metricas.registrar_decisoes_lote(aprovado, proba_arredondada)
+    if 'monitor' in drift:
+        drift['monitor'].registrar_lote(list(modelo.features), matriz, proba_inadimplente)
+
+    return resultados, linhas, indices_validos, latencia
 
-        resultado_dict = {
-            'resultado': "Aprovado" if aprovado else "Reprovado",
-            'probabilidade_risco': round(float(proba_inadimplente), 4),
-            'threshold_utilizado': round(float(threshold), 4)
-        }
 
+@app.post('/predict/batch')
+async def predict_credit_batch(clientes: list[dict[str, Any]] = Body(...),
+                               motivos: bool = Query(False, description="Inclui os motivos adversos de cada cliente")):
+    """
+    Avalia um lote de clientes com uma única chamada ao modelo e um único INSERT.
+    Os resultados voltam na ordem de entrada; itens inválidos trazem seus erros de validação
+    """
+    modelo = registro.atual
+    if modelo is None:
+        raise HTTPException(status_code=503, detail="O modelo ainda não foi carregado. Tente novamente em segundos.")
+
+    if len(clientes) > TAMANHO_MAXIMO_LOTE:
+        raise HTTPException(status_code=413, detail=f"Lote muito grande; máximo de {TAMANHO_MAXIMO_LOTE} clientes")
 
+    resultados, linhas, indices_validos, latencia = await run_in_threadpool(avaliar_lote, clientes, modelo, motivos)
+
+    # O lote inteiro entra de uma vez na fila, que grava com INSERTs multi-linha
+    if persistencia and linhas:
         try:
-            db = SessionLocal()
-            nova_predicao = Prediction(
-                idade=cliente.idade,
-                valor_conta_poupanca=cliente.valor_conta_poupanca,
-                valor_conta_corrente=cliente.valor_conta_corrente,
-                salario_anual=cliente.salario_anual,
-                valor_emprestimo=cliente.valor_emprestimo,
-                prazo_meses=cliente.prazo_meses,
-                situacao_moradia=cliente.situacao_moradia,
-                resultado=resultado_dict['resultado'],
-                probabilidade_risco=resultado_dict['probabilidade_risco'],
-                threshold_utilizado=resultado_dict['threshold_utilizado']
-            )
-            db.add(nova_predicao)
-            db.commit()
-            db.refresh(nova_predicao)
-            resultado_dict['prediction_id'] = nova_predicao.id
-            db.close()
-            print(f"✅ Predição ID {nova_predicao.id} salva no banco de dados")
+            ids = await gravar_predicoes(linhas)
+            for i, prediction_id in zip(indices_validos, ids):
+                resultados[i]['prediction_id'] = prediction_id
+        except FilaCheia as e:
+            raise HTTPException(status_code=503, detail=f"{e}. Tente novamente em segundos.")
         except Exception as e:
-            print(f"⚠️ Erro ao salvar no banco: {e}")
+            metricas.FALHAS_BANCO_LOTE.inc()
+            logger.warning("Erro ao salvar lote no banco", extra={'linhas': len(linhas), 'erro': str(e)})
             # Continua mesmo se falhar (não quebra a API)
 
-        return resultado_dict
+    if linhas:
+        enviar_para_sombra(linhas, latencia)
+    return {
+        'total': len(clientes),
+        'processados': len(indices_validos),
+        'erros': len(clientes) - len(indices_validos),
+        'resultados': resultados
+    }
+
 
+@app.post('/predict/simulacao-ofertas')
+async def simular_ofertas(entrada: SimulacaoOfertasInput):
+    """
+    Simula ofertas para um cliente sem gravar nada: numa grade prazo × valor devolve a
+    superfície de aprovação, o maior valor aprovável por prazo e a curva de risco por valor no
+    prazo pedido; com uma lista de ofertas, a decisão de cada uma. Tudo é pontuado de uma vez
+    """
+    modelo = registro.atual
+    if modelo is None:
+        raise HTTPException(status_code=503, detail="O modelo ainda não foi carregado. Tente novamente em segundos.")
+
+    cliente = entrada.cliente.model_dump()
+    if entrada.ofertas is not None:
+        if not entrada.ofertas:
+            raise HTTPException(status_code=422, detail="Informe ao menos uma oferta")
+        pontos = len(entrada.ofertas)
+    else:
+        if entrada.prazos is None or entrada.valores is None:
+            raise HTTPException(status_code=422, detail="Informe as faixas de prazos e valores, ou a lista de ofertas")
+        if entrada.prazos.minimo > entrada.prazos.maximo or entrada.valores.minimo > entrada.valores.maximo:
+            raise HTTPException(status_code=422, detail="O mínimo de cada faixa deve ser menor ou igual ao máximo")
+        prazos = np.arange(entrada.prazos.minimo, entrada.prazos.maximo + 1, entrada.prazos.passo)
+        pontos = len(prazos) * entrada.valores.pontos
+    if pontos > SIMULACAO_OFERTAS_MAXIMO_PONTOS:
+        raise HTTPException(status_code=413,
+                            detail=f"Simulação muito grande; máximo de {SIMULACAO_OFERTAS_MAXIMO_PONTOS} pontos")
+
+    inicio = time.perf_counter()
+    try:
+        if entrada.ofertas is not None:
+            resposta = await run_in_threadpool(
+                simular_lista, modelo.scorer, list(modelo.features), modelo.threshold, cliente,
+                [oferta.model_dump() for oferta in entrada.ofertas])
+        else:
+            valores = np.linspace(entrada.valores.minimo, entrada.valores.maximo, entrada.valores.pontos)
+            resposta = await run_in_threadpool(
+                simular_grade, modelo.scorer, list(modelo.features), modelo.threshold, cliente,
+                prazos, valores, entrada.precisao)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    resposta['versao_modelo'] = modelo.versao
+    resposta['pontos'] = pontos
+    resposta['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+    # a resposta já é feita só de tipos do Python: o jsonable_encoder levaria mais que a
+    # simulação numa grade de 10 mil pontos
+    return JSONResponse(resposta)
 
 
-@app.get('/predictions')
-def get_predictions(limit: int = 10, skip: int = 0):
+def verificar_admin(x_admin_token: Optional[str] = Header(None)):
+    # sem ADMIN_TOKEN configurado os endpoints administrativos ficam abertos (uso local)
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Token administrativo inválido")
+
+
+@app.get('/admin/modelo', dependencies=[Depends(verificar_admin)])
+async def get_modelo():
+    """
+    Retorna a versão de modelo em uso e as versões disponíveis no registro
+    """
+    modelo = registro.atual
+    if modelo is None:
+        raise HTTPException(status_code=503, detail="O modelo ainda não foi carregado. Tente novamente em segundos.")
+    return {
+        'versao': modelo.versao,
+        'carregado_em': modelo.carregado_em.isoformat(),
+        'threshold': round(modelo.threshold, 4),
+        'scorer_compilado': modelo.scorer.compilado,
+        'formato': modelo.formato,
+        'artefato': modelo.artefato,
+        'metricas': {k: (float(v) if isinstance(v, (int, float, np.number)) else v) for k, v in modelo.metricas.items()},
+        'versao_desejada': registro.versao_desejada(),
+        'versoes_disponiveis': registro.versoes_disponiveis(),
+        'versoes_aposentadas_em_memoria': registro.aposentados_em_memoria(),
+    }
 
+
+@app.post('/admin/modelo/recarregar', dependencies=[Depends(verificar_admin)])
+async def recarregar_modelo(versao: Optional[str] = None):
+    """
+    Carrega e valida uma versão em segundo plano e a troca atomicamente pela atual.
+    A versão fica fixada no arquivo ATUAL do registro, e os outros workers a ativam pelo observador
+    """
+    try:
+        modelo = await run_in_threadpool(registro.ativar, versao, True)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ArtefatoInvalido as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {'versao': modelo.versao, 'carregado_em': modelo.carregado_em.isoformat()}
+
+
+@app.get('/desafiante/comparacao')
+async def get_comparacao_desafiante():
+    """
+    Compara campeão e desafiante na janela recente deste worker: concordância das decisões,
+    correlação dos scores e percentis de latência de cada modelo
+    """
+    avaliador = sombra.get('avaliador')
+    if avaliador is None:
+        raise HTTPException(status_code=404, detail="Nenhum modelo desafiante configurado (MODELO_DESAFIANTE)")
+    modelo = registro.atual
+    return {'versao_campeao': modelo.versao if modelo else None, **avaliador.comparacao()}
+
+
+@app.get('/drift')
+async def get_drift():
+    """
+    Compara a distribuição recente de cada feature e da probabilidade_risco com os dados de
+    referência (PSI e KS) na janela deslizante deste worker
+    """
+    monitor = drift.get('monitor')
+    if monitor is None:
+        raise HTTPException(status_code=404, detail="Monitor de drift desligado (DRIFT_CAPACIDADE=0 ou sem referência)")
+    return await run_in_threadpool(monitor.resumo)
+
+
+@app.get('/cache/metricas')
+async def get_cache_metricas():
+    """
+    Retorna acertos, faltas e expulsões do cache de decisões e das Idempotency-Keys
+    """
+    return {
+        'decisoes': cache_decisoes.metricas() if cache_decisoes is not None else None,
+        'idempotencia': persistencia.get('idempotencia', idempotencia_memoria).metricas(),
+    }
+
+
+@app.get('/persistencia/metricas')
+async def get_persistencia_metricas():
+    """
+    Retorna profundidade da fila de gravação e latência dos flushes
+    """
+    if 'fila' not in persistencia:
+        raise HTTPException(status_code=503, detail="Persistência indisponível: banco de dados não conectado")
+    return persistencia['fila'].metricas()
+
+
+@app.get('/predictions')
+async def get_predictions(
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        resultado: Optional[Literal['Aprovado', 'Reprovado']] = None,
+        situacao_moradia: Optional[SituacaoMoradia] = None,
+        data_inicio: Optional[datetime] = None,
+        data_fim: Optional[datetime] = None,
+        total: Literal['nenhum', 'estimado', 'exato'] = 'estimado',
+        db: AsyncSession = Depends(get_db)):
+    """
+    Histórico paginado por cursor (keyset em timestamp, id): o custo de cada página
+    é o mesmo na primeira e na milésima. Use o proximo_cursor da resposta para avançar.
+    Depois das partições do banco, a paginação segue pelos meses arquivados em Parquet
+    """
     try:
         if limit > 100:
             limit = 100
 
-        db = SessionLocal()
-        predictions = (
-            db.query(Prediction)
-            .order_by(Prediction.timestamp.desc())
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
+        filtros = []
+        if resultado:
+            filtros.append(Prediction.resultado == resultado)
+        if situacao_moradia:
+            filtros.append(Prediction.situacao_moradia == situacao_moradia)
+        if data_inicio:
+            filtros.append(Prediction.timestamp >= data_inicio)
+        if data_fim:
+            filtros.append(Prediction.timestamp < data_fim)
+        # antes da fronteira, as predições são lidas só do arquivo (mesmo que a partição ainda exista)
+        fronteira = arquivo_predicoes.fronteira
+        filtros_banco = filtros + ([Prediction.timestamp >= fronteira] if fronteira else [])
+
+        consulta = select(Prediction).where(*filtros_banco)
+        posicao = decodificar_cursor(cursor) if cursor else None
+        if posicao:
+            consulta = consulta.where(tuple_(Prediction.timestamp, Prediction.id) < tuple_(*posicao))
 
-        total = db.query(Prediction).count()
-        db.close()
+        # busca uma linha a mais só para saber se existe próxima página
+        predictions = list((await db.scalars(
+            consulta
+            .order_by(Prediction.timestamp.desc(), Prediction.id.desc())
+            .limit(limit + 1)
+        )).all())
+        if len(predictions) <= limit and fronteira and (data_inicio is None or data_inicio < fronteira):
+            arquivadas = await run_in_threadpool(
+                arquivo_predicoes.pagina, limit + 1 - len(predictions), posicao, data_inicio, data_fim,
+                resultado=resultado, situacao_moradia=situacao_moradia
+            )
+            predictions.extend(SimpleNamespace(**linha) for linha in arquivadas)
+
+        proximo_cursor = None
+        if len(predictions) > limit:
+            predictions = predictions[:limit]
+            proximo_cursor = codificar_cursor(predictions[-1].timestamp, predictions[-1].id)
+
+        if total == 'exato':
+            quantidade = await db.scalar(select(func.count()).select_from(Prediction).where(*filtros_banco))
+            if fronteira:
+                quantidade += await run_in_threadpool(arquivo_predicoes.contar, data_inicio, data_fim,
+                                                      resultado=resultado, situacao_moradia=situacao_moradia)
+        elif total == 'estimado' and not filtros:
+            quantidade = await estimar_total(db, Prediction.__table__)
+            if quantidade is not None and fronteira:
+                quantidade += await run_in_threadpool(arquivo_predicoes.total_linhas)
+        else:
+            quantidade = None
 
         return {
-            'total': total,
+            'total': quantidade,
+            'total_tipo': total if quantidade is not None else 'nenhum',
             'limit': limit,
-            'skip': skip,
-            'predictions': [{
-                'id': p.id,
-                'timestamp': p.timestamp.isoformat(),
-                'idade': p.idade,
-                'valor_conta_poupanca': float(p.valor_conta_poupanca),
-                'valor_conta_corrente': float(p.valor_conta_corrente),
-                'salario_anual': float(p.salario_anual),
-                'valor_emprestimo': float(p.valor_emprestimo),
-                'prazo_meses': p.prazo_meses,
-                'situacao_moradia': p.situacao_moradia,
-                'resultado': p.resultado,
-                'probabilidade_risco': float(p.probabilidade_risco),
-            } for p in predictions]
+            'proximo_cursor': proximo_cursor,
+            'predictions': [serializar_predicao(p) for p in predictions]
         }
+    except CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar predições: {str(e)}")
 
 
 @app.get('/predictions/stats')
-def get_stats():
+async def get_stats(
+        dias: Optional[int] = None,
+        inicio: Optional[datetime] = None,
+        fim: Optional[datetime] = None,
+        granularidade: Literal['hora', 'dia'] = 'dia',
+        db: AsyncSession = Depends(get_db)):
     """
-    Retorna estatísticas básicas das predições
+    Retorna estatísticas das predições a partir do rollup por hora (predictions_agregados).
+    A janela pode ser dada em `dias` (últimos N dias) ou por `inicio`/`fim`
     """
     try:
-        db = SessionLocal()
+        if dias is not None:
+            inicio = datetime.now() - timedelta(days=dias)
+        return await consultar_estatisticas(db, inicio=inicio, fim=fim, granularidade=granularidade)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular estatísticas: {str(e)}")
 
-        total = db.query(Prediction).count()
-        aprovados = db.query(Prediction).filter(Prediction.resultado == "Aprovado").count()
-        reprovados = db.query(Prediction).filter(Prediction.resultado == "Reprovado").count()
 
-        db.close()
+@app.get('/predictions/simulacao-threshold')
+async def get_simulacao_threshold(
+        thresholds: list[float] = Query(..., description="Thresholds candidatos (repita o parâmetro)"),
+        exemplos: int = Query(0, ge=0, le=100, description="ids de decisões alteradas por threshold"),
+        db: AsyncSession = Depends(get_db)):
+    """
+    Recalcula as decisões gravadas com outros thresholds: taxa de aprovação geral, por moradia,
+    faixa de idade e faixa de valor, e quantas decisões mudariam. Usa um índice de scores em
+    memória que só lê as predições gravadas desde a consulta anterior
+    """
+    if len(thresholds) > 50:
+        raise HTTPException(status_code=422, detail="Informe no máximo 50 thresholds")
+    if any(not 0 < t < 1 for t in thresholds):
+        raise HTTPException(status_code=422, detail="Os thresholds devem estar entre 0 e 1")
 
-        return {
-            'total_predicoes': total,
-            'aprovados': aprovados,
-            'reprovados': reprovados,
-            'taxa_aprovacao': round(aprovados / total * 100, 2) if total > 0 else 0
-        }
+    try:
+        margem, pendente = margem_gravacao(SIMULACAO_MARGEM_SEGUNDOS)
+        await run_in_threadpool(indice_scores.atualizar, engine_auxiliar, Prediction.__table__, arquivo_predicoes,
+                                margem_segundos=margem, pendente=pendente)
+        resposta = await run_in_threadpool(indice_scores.simular, thresholds)
+        if exemplos:
+            for simulacao in resposta['simulacoes']:
+                simulacao['exemplos_alterados'] = list(await db.scalars(
+                    consulta_decisoes_alteradas(Prediction.__table__, simulacao['threshold'], exemplos)
+                ))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao calcular estatísticas: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao simular thresholds: {str(e)}")
+
+    modelo = registro.atual
+    resposta['threshold_atual'] = round(modelo.threshold, 4) if modelo is not None else None
+    return resposta
+
+
+async def gerar_exportacao(consulta, formatador, arquivados=None):
+    """
+    Lê o cursor em blocos e converte cada bloco fora do event loop; a memória é de um bloco por vez.
+    Os blocos dos meses arquivados (um row group por vez), se houver, vêm antes dos do banco
+    """
+    try:
+        if arquivados is not None:
+            while True:
+                tabela = await run_in_threadpool(next, arquivados, None)
+                if tabela is None:
+                    break
+                dados = await run_in_threadpool(formatador.tabela, tabela)
+                if dados:
+                    yield dados
+        async with async_engine.connect() as conn:
+            resultado = await conn.stream(consulta.execution_options(yield_per=EXPORTACAO_TAMANHO_BLOCO))
+            async for bloco in resultado.partitions(EXPORTACAO_TAMANHO_BLOCO):
+                dados = await run_in_threadpool(formatador.bloco, bloco)
+                if dados:
+                    yield dados
+        yield await run_in_threadpool(formatador.fim)
+    except Exception as e:
+        # os headers já foram enviados: só resta interromper o corpo, e o cliente vê a resposta truncada
+        metricas.FALHAS_BANCO_EXPORTACAO.inc()
+        logger.error("Exportação interrompida", extra={'erro': str(e)})
+        raise
+
+
+@app.get('/predictions/exportar')
+async def exportar_predictions(
+        formato: Literal['ndjson', 'csv', 'parquet', 'arrow'] = 'ndjson',
+        data_inicio: Optional[datetime] = None,
+        data_fim: Optional[datetime] = None):
+    """
+    Exporta o histórico inteiro (ou a janela [data_inicio, data_fim)) em streaming, em ordem de
+    timestamp, sem limite de linhas. As linhas vêm de um cursor do lado do servidor e são
+    convertidas em blocos pelo pyarrow, sem objetos do ORM. Os meses arquivados em Parquet saem
+    antes. A janela para antes do que ainda pode estar na fila de gravação (margem_gravacao); o fim efetivo vai no header
+    X-Exportacao-Ate e é o data_inicio da próxima carga incremental
+    """
+    # pyarrow só é importado na primeira exportação, não no startup de cada worker
+    from exportacao import FORMATADORES, TIPOS_MIDIA, consulta_exportacao, limite_exportacao
+
+    margem, pendente = margem_gravacao(EXPORTACAO_MARGEM_SEGUNDOS)
+    data_fim = limite_exportacao(data_fim, margem, pendente=pendente)
+    fronteira = arquivo_predicoes.fronteira
+    arquivados = None
+    inicio_banco = data_inicio
+    if fronteira and (data_inicio is None or data_inicio < fronteira):
+        arquivados = arquivo_predicoes.blocos(data_inicio, data_fim)
+        inicio_banco = fronteira
+    consulta = consulta_exportacao(Prediction.__table__, inicio_banco, data_fim)
+    extensao = 'arrows' if formato == 'arrow' else formato
+    return StreamingResponse(
+        gerar_exportacao(consulta, FORMATADORES[formato](), arquivados),
+        media_type=TIPOS_MIDIA[formato],
+        headers={
+            'Content-Disposition': f'attachment; filename="predictions.{extensao}"',
+            'X-Exportacao-Ate': data_fim.isoformat(),
+        },
+    )
 
 
 @app.get('/predictions/{prediction_id}')
-def get_prediction_by_id(prediction_id: int):
+async def get_prediction_by_id(prediction_id: int, db: AsyncSession = Depends(get_db)):
     """
     Retorna uma predição específica por ID
     """
     try:
-        db = SessionLocal()
-        prediction = db.query(Prediction).filter(Prediction.id == prediction_id).first()
-        db.close()
+        prediction = await db.scalar(select(Prediction).where(Prediction.id == prediction_id).limit(1))
+        if prediction is None and arquivo_predicoes.fronteira:
+            arquivada = await run_in_threadpool(arquivo_predicoes.buscar, prediction_id)
+            prediction = SimpleNamespace(**arquivada) if arquivada else None
 
         if not prediction:
             raise HTTPException(status_code=404, detail="Predição não encontrada")
 
-        return {
-            'id': prediction.id,
-            'timestamp': prediction.timestamp.isoformat(),
-            'idade': prediction.idade,
-            'valor_conta_poupanca': float(prediction.valor_conta_poupanca),
-            'valor_conta_corrente': float(prediction.valor_conta_corrente),
-            'salario_anual': float(prediction.salario_anual),
-            'valor_emprestimo': float(prediction.valor_emprestimo),
-            'prazo_meses': prediction.prazo_meses,
-            'situacao_moradia': prediction.situacao_moradia,
-            'resultado': prediction.resultado,
-            'probabilidade_risco': float(prediction.probabilidade_risco),
-        }
+        return serializar_predicao(prediction)
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar predição: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar predição: {str(e)}")
+
+
+# tudo acima (rotas, tabelas do SQLAlchemy, métricas) roda no import do módulo pelo uvicorn
+metricas.INICIALIZACAO['importacao'] = time.perf_counter() - INICIO_IMPORTACAO
@@ -0,0 +1,344 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import values
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+logger = logging.getLogger(__name__)
+
+# Servidor pré-fork: cada worker grava as métricas em arquivos desse diretório e o /metrics de
+# qualquer worker soma os de todos (modo multiprocesso do prometheus_client)
+MULTIPROCESSO_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# De 5µs (scorer compilado) a alguns segundos (fila cheia, pipeline sklearn sob carga)
+BUCKETS_LATENCIA = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                    1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class HistogramaLeve:
+    """
+    Histograma sem lock para o caminho quente. O Histogram do prometheus_client custa ~2µs
+    por observação (lock por valor e busca linear nos buckets), o que somado em todas as
+    etapas passaria de 2% do /predict. Aqui é um bisect e dois incrementos; só o event loop
+    observa, então não há disputa entre threads. Exportado pelo ColetorEstado no scrape
+    """
+
+    def __init__(self, limites):
+        self.limites = list(limites)
+        self.contagens = [0] * (len(self.limites) + 1)
+        self.soma = 0.0
+
+    def observe(self, valor: float):
+        # mesmo critério do prometheus: o primeiro limite >= valor
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+
+    def observar_lote(self, valores: np.ndarray):
+        for i, quantidade in enumerate(np.bincount(np.searchsorted(self.limites, valores, side='left'),
+                                                   minlength=len(self.contagens))):
+            self.contagens[i] += int(quantidade)
+        self.soma += float(np.sum(valores))
+
+    def buckets(self, *outros: 'HistogramaLeve') -> list:
+        """Buckets cumulativos no formato do HistogramMetricFamily, somando os histogramas `outros`"""
+        contagens = [sum(c) for c in zip(self.contagens, *(o.contagens for o in outros))]
+        acumulado, saida = 0, []
+        for limite, quantidade in zip(self.limites + [float('inf')], contagens):
+            acumulado += quantidade
+            saida.append((floatToGoString(limite), acumulado))
+        return saida
+
+
+ETAPAS = ('validacao', 'features', 'score', 'persistencia', 'total')
+ETAPAS_PREDICT = {etapa: HistogramaLeve(BUCKETS_LATENCIA) for etapa in ETAPAS}
+ETAPA_VALIDACAO = ETAPAS_PREDICT['validacao']
+ETAPA_FEATURES = ETAPAS_PREDICT['features']
+ETAPA_SCORE = ETAPAS_PREDICT['score']
+ETAPA_PERSISTENCIA = ETAPAS_PREDICT['persistencia']
+ETAPA_TOTAL = ETAPAS_PREDICT['total']
+
+# (rota, método, status) -> requests; rota -> duração
+REQUISICOES = defaultdict(int)
+DURACAO_HTTP = defaultdict(lambda: HistogramaLeve(BUCKETS_LATENCIA))
+
+BUCKETS_SCORE = [round(i / 20, 2) for i in range(1, 21)]
+DECISOES = {'Aprovado': 0, 'Reprovado': 0}
+# parte de DECISOES que veio do cache de decisões (sem pontuar o modelo)
+DECISOES_CACHE = {'Aprovado': 0, 'Reprovado': 0}
+SCORE = HistogramaLeve(BUCKETS_SCORE)
+# o /predict/batch registra a partir do threadpool: estruturas próprias, sob lock (um por lote)
+_lock_lote = threading.Lock()
+DECISOES_LOTE = {'Aprovado': 0, 'Reprovado': 0}
+SCORE_LOTE = HistogramaLeve(BUCKETS_SCORE)
+
+
+def registrar_requisicao(rota: str, metodo: str, status: int, duracao: float):
+    REQUISICOES[(rota, metodo, status)] += 1
+    DURACAO_HTTP[rota].observe(duracao)
+
+
+def registrar_decisoes(aprovado: bool, probabilidade_risco: float, do_cache: bool = False):
+    resultado = "Aprovado" if aprovado else "Reprovado"
+    DECISOES[resultado] += 1
+    if do_cache:
+        DECISOES_CACHE[resultado] += 1
+    SCORE.observe(probabilidade_risco)
+
+
+def registrar_decisoes_lote(aprovado: np.ndarray, probabilidade_risco: np.ndarray):
+    """Versão vetorizada para o /predict/batch: conta por bucket com NumPy em vez de um observe por linha"""
+    aprovados = int(np.count_nonzero(aprovado))
+    with _lock_lote:
+        DECISOES_LOTE["Aprovado"] += aprovados
+        DECISOES_LOTE["Reprovado"] += len(aprovado) - aprovados
+        SCORE_LOTE.observar_lote(probabilidade_risco)
+
+
+# Duração de cada etapa da inicialização do worker (importacao, inicializacao, modelo, primeira_predicao)
+INICIALIZACAO = {}
+
+FALHAS_BANCO = Counter('credito_falhas_banco_total', 'Falhas de banco tratadas sem derrubar o request', ['operacao'])
+FALHAS_BANCO_CONEXAO = FALHAS_BANCO.labels('conexao')
+FALHAS_BANCO_PREDICT = FALHAS_BANCO.labels('predict')
+FALHAS_BANCO_LOTE = FALHAS_BANCO.labels('lote')
+FALHAS_BANCO_EXPORTACAO = FALHAS_BANCO.labels('exportacao')
+FALHAS_BANCO_PARTICOES = FALHAS_BANCO.labels('particoes')
+FALHAS_BANCO_IDEMPOTENCIA = FALHAS_BANCO.labels('idempotencia')
+DURACAO_FLUSH = Histogram('credito_fila_flush_segundos', 'Duração de cada flush das filas de gravação', ['tabela'],
+                          buckets=BUCKETS_LATENCIA)
+
+LOGS_SUPRIMIDOS = Counter('credito_logs_suprimidos_total', 'Logs descartados pela amostragem sob carga', ['nivel'])
+
+
+class ColetorEstado:
+    """
+    Lê os histogramas leves, o estado dos pools de conexão, das filas de gravação e o
+    drift na hora do scrape, sem custo nenhum no caminho dos requests
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self.filas = {}
+        self.drift = None
+        self.sombra = None
+
+    def describe(self):
+        # sem describe() o REGISTRY chamaria collect() já no import, pagando a leitura da memória
+        # do processo (psutil) na inicialização de cada worker
+        return []
+
+    def collect(self):
+        etapas = HistogramMetricFamily('credito_predict_etapa_segundos',
+                                       'Duração de cada etapa do /predict (validacao, features, score, persistencia, total)',
+                                       labels=['etapa'])
+        for etapa, histograma in ETAPAS_PREDICT.items():
+            etapas.add_metric([etapa], histograma.buckets(), histograma.soma)
+        yield etapas
+
+        requisicoes = CounterMetricFamily('credito_http_requisicoes', 'Requests por rota, método e status',
+                                          labels=['rota', 'metodo', 'status'])
+        for (rota, metodo, status), quantidade in list(REQUISICOES.items()):
+            requisicoes.add_metric([rota, metodo, str(status)], quantidade)
+        yield requisicoes
+
+        duracao = HistogramMetricFamily('credito_http_duracao_segundos', 'Duração dos requests por rota', labels=['rota'])
+        for rota, histograma in list(DURACAO_HTTP.items()):
+            duracao.add_metric([rota], histograma.buckets(), histograma.soma)
+        yield duracao
+
+        decisoes = CounterMetricFamily('credito_decisoes', 'Decisões de crédito por resultado', labels=['resultado'])
+        for resultado, quantidade in DECISOES.items():
+            decisoes.add_metric([resultado], quantidade + DECISOES_LOTE[resultado])
+        yield decisoes
+
+        decisoes_cache = CounterMetricFamily('credito_decisoes_cache',
+                                             'Decisões devolvidas pelo cache (já contadas em credito_decisoes)',
+                                             labels=['resultado'])
+        for resultado, quantidade in DECISOES_CACHE.items():
+            decisoes_cache.add_metric([resultado], quantidade)
+        yield decisoes_cache
+
+        score = HistogramMetricFamily('credito_probabilidade_risco', 'Distribuição da probabilidade_risco devolvida')
+        with _lock_lote:
+            score.add_metric([], SCORE.buckets(SCORE_LOTE), SCORE.soma + SCORE_LOTE.soma)
+        yield score
+
+        em_uso = GaugeMetricFamily('credito_pool_conexoes_em_uso', 'Conexões emprestadas pelo pool', labels=['engine'])
+        overflow = GaugeMetricFamily('credito_pool_overflow', 'Conexões acima de pool_size', labels=['engine'])
+        tamanho = GaugeMetricFamily('credito_pool_tamanho', 'pool_size configurado', labels=['engine'])
+        for nome, engine in self.engines.items():
+            pool = engine.pool
+            # pools do SQLite não têm contagem de conexões
+            if not hasattr(pool, 'checkedout'):
+                continue
+            em_uso.add_metric([nome], pool.checkedout())
+            overflow.add_metric([nome], max(pool.overflow(), 0))
+            tamanho.add_metric([nome], pool.size())
+        yield em_uso
+        yield overflow
+        yield tamanho
+
+        profundidade = GaugeMetricFamily('credito_fila_profundidade', 'Linhas aguardando gravação', labels=['tabela'])
+        gravadas = CounterMetricFamily('credito_fila_linhas_gravadas', 'Linhas gravadas pela fila', labels=['tabela'])
+        perdidas = CounterMetricFamily('credito_fila_linhas_perdidas', 'Linhas descartadas (fila sem diretório de pendentes)',
+                                       labels=['tabela'])
+        pendentes = CounterMetricFamily('credito_fila_linhas_pendentes',
+                                        'Linhas guardadas no arquivo de pendentes para regravar', labels=['tabela'])
+        recuperadas = CounterMetricFamily('credito_fila_linhas_recuperadas',
+                                          'Linhas de pendentes devolvidas à fila no início', labels=['tabela'])
+        rejeitadas = CounterMetricFamily('credito_fila_linhas_rejeitadas', 'Linhas recusadas com a fila cheia (503)',
+                                         labels=['tabela'])
+        for nome, fila in self.filas.items():
+            estado = fila.metricas()
+            profundidade.add_metric([nome], estado['profundidade'])
+            gravadas.add_metric([nome], estado['linhas_gravadas'])
+            perdidas.add_metric([nome], estado['linhas_perdidas'])
+            pendentes.add_metric([nome], estado['linhas_pendentes'])
+            recuperadas.add_metric([nome], estado['linhas_recuperadas'])
+            rejeitadas.add_metric([nome], estado['linhas_rejeitadas'])
+        yield profundidade
+        yield gravadas
+        yield perdidas
+        yield pendentes
+        yield recuperadas
+        yield rejeitadas
+
+        memoria = GaugeMetricFamily('credito_memoria_processo_bytes',
+                                    'Memória do worker: rss, pss (compartilhadas divididas entre os processos) e uss',
+                                    labels=['tipo'])
+        for tipo, valor in memoria_processo().items():
+            memoria.add_metric([tipo], valor)
+        yield memoria
+
+        inicializacao = GaugeMetricFamily('credito_inicializacao_segundos',
+                                          'Duração de cada etapa da inicialização do worker', labels=['etapa'])
+        for etapa, segundos in INICIALIZACAO.items():
+            inicializacao.add_metric([etapa], segundos)
+        yield inicializacao
+
+        if self.drift is not None:
+            resumo = self.drift.resumo()
+            psi = GaugeMetricFamily('credito_drift_psi', 'PSI da variável na janela contra a referência',
+                                    labels=['variavel'])
+            ks = GaugeMetricFamily('credito_drift_ks', 'KS da variável na janela contra a referência',
+                                   labels=['variavel'])
+            amostras = GaugeMetricFamily('credito_drift_amostras', 'Amostras da variável na janela',
+                                         labels=['variavel'])
+            for variavel, estado in resumo['variaveis'].items():
+                amostras.add_metric([variavel], estado['amostras'])
+                # sem amostras suficientes o PSI não é exportado (evita alertas falsos)
+                if estado['psi'] is not None:
+                    psi.add_metric([variavel], estado['psi'])
+                    ks.add_metric([variavel], estado['ks'])
+            yield psi
+            yield ks
+            yield amostras
+            yield CounterMetricFamily('credito_drift_descartadas', 'Amostras descartadas com a fila do drift cheia',
+                                      value=resumo['fila']['descartadas'])
+
+        if self.sombra is not None:
+            cpu = CounterMetricFamily('credito_desafiante_cpu_segundos',
+                                      'Tempo de CPU do modo sombra: nas threads do worker e no pool de processos',
+                                      labels=['local'])
+            for local, segundos in self.sombra.cpu_segundos.items():
+                cpu.add_metric([local], segundos)
+            yield cpu
+
+
+def memoria_processo(pid: int | None = None) -> dict:
+    """
+    RSS, PSS e USS do processo, em bytes. Com workers criados por fork, o RSS conta as páginas
+    compartilhadas com o mestre em cada worker; o PSS as divide entre os processos que as usam
+    """
+    import psutil
+    try:
+        info = psutil.Process(pid).memory_full_info()
+    except psutil.Error:
+        return {}
+    return {'rss': info.rss, 'pss': getattr(info, 'pss', info.rss), 'uss': info.uss}
+
+
+coletor = ColetorEstado()
+REGISTRY.register(coletor)
+
+
+_publicados = {}
+_lock_publicacao = threading.Lock()
+
+
+def _valor_publicado(tipo: str, familia, amostra: str, rotulos: dict):
+    chave = (tipo, amostra, tuple(rotulos.items()))
+    valor = _publicados.get(chave)
+    if valor is None:
+        valor = _publicados[chave] = values.ValueClass(tipo, familia.name, amostra, list(rotulos), list(rotulos.values()),
+                                                       familia.documentation, multiprocess_mode='liveall')
+    return valor
+
+
+def publicar():
+    """
+    Copia o que o ColetorEstado lê (histogramas leves, contadores, pools, filas, drift) para os
+    arquivos deste processo no PROMETHEUS_MULTIPROC_DIR. O caminho dos requests continua sem lock:
+    só esta cópia escreve nos arquivos. Contadores e histogramas guardam o total do processo e são
+    somados entre os workers, inclusive os já encerrados; os gauges saem com o rótulo pid e somem
+    quando o mestre marca o worker como morto
+    """
+    with _lock_publicacao:
+        for familia in coletor.collect():
+            acumulado = {}
+            for amostra in familia.samples:
+                if familia.type == 'gauge':
+                    _valor_publicado('gauge', familia, amostra.name, amostra.labels).set(amostra.value)
+                elif familia.type == 'counter' and amostra.name.endswith('_total'):
+                    _valor_publicado('counter', familia, amostra.name, amostra.labels).set(amostra.value)
+                elif familia.type == 'histogram' and amostra.name.endswith('_bucket'):
+                    # o arquivo guarda a contagem de cada bucket; o MultiProcessCollector acumula
+                    serie = tuple((k, v) for k, v in amostra.labels.items() if k != 'le')
+                    _valor_publicado('histogram', familia, amostra.name, amostra.labels).set(
+                        amostra.value - acumulado.get(serie, 0))
+                    acumulado[serie] = amostra.value
+                elif familia.type == 'histogram' and amostra.name.endswith('_sum'):
+                    _valor_publicado('histogram', familia, amostra.name, amostra.labels).set(amostra.value)
+
+
+class PublicadorMetricas:
+    """Thread que publica as métricas do worker a cada `intervalo` segundos, e uma última vez ao parar"""
+
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name="publicador-metricas", daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                publicar()
+            except Exception as e:
+                logger.warning("Falha ao publicar as métricas do worker", extra={'erro': str(e)})
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        publicar()
+
+
+def exportar() -> tuple[bytes, str]:
+    if MULTIPROCESSO_DIR:
+        # os valores deste worker saem atualizados; os dos outros, da última publicação deles
+        publicar()
+        registro = CollectorRegistry()
+        MultiProcessCollector(registro, MULTIPROCESSO_DIR)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
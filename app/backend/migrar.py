@@ -0,0 +1,13 @@
+"""
+Prepara o schema do banco: cria as tabelas e os índices, adiciona as colunas novas, converte
+predictions em tabela particionada com as partições dos próximos meses (PostgreSQL) e faz a
+carga inicial do rollup de estatísticas. Roda uma vez por deploy, antes de subir a API: os
+workers não criam o schema no startup (a não ser com PREPARAR_SCHEMA=true).
+
+Uso (a partir de app/backend):
+    python migrar.py
+"""
+from main import preparar_schema
+
+if __name__ == '__main__':
+    preparar_schema()
@@ -0,0 +1,98 @@
+from functools import lru_cache
+from operator import itemgetter
+
+import numpy as np
+
+# Código e descrição de cada fator. Features que descrevem o mesmo fato são um único fator, e
+# as contribuições delas são somadas antes de ordenar os motivos: as duas colunas one-hot de
+# moradia e as duas do saldo em conta corrente (o indicador de saldo zero e o log do saldo,
+# que com saldo zero se compensam em boa parte). O R04 deixou de existir ao entrar no R03
+MOTIVOS = {
+    'comprometimento_renda': ('R01', 'Comprometimento da renda com o empréstimo'),
+    'cobertura_liquidez': ('R02', 'Cobertura do empréstimo pelas reservas (conta corrente e poupança)'),
+    'is_conta_corrente_zero': ('R03', 'Saldo em conta corrente'),
+    'log_valor_conta_corrente': ('R03', 'Saldo em conta corrente'),
+    'renda_livre_mensal': ('R05', 'Renda mensal livre após a parcela'),
+    'parcela_mensal_estimada': ('R06', 'Valor da parcela mensal'),
+    'log_valor_emprestimo': ('R07', 'Valor do empréstimo solicitado'),
+    'prazo_meses': ('R08', 'Prazo do empréstimo'),
+    'idade': ('R09', 'Idade'),
+    'moradia_own': ('R10', 'Situação de moradia'),
+    'moradia_rent': ('R10', 'Situação de moradia'),
+}
+DESCRICOES = dict(MOTIVOS.values())
+
+
+@lru_cache(maxsize=8)
+def agrupamento(features: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Códigos dos fatores e a matriz (features, fatores) que leva as contribuições ao impacto de
+    cada fator no risco. As contribuições são no log-odds da classe 1 (bom pagador), então o
+    impacto no risco é a soma delas com o sinal trocado
+    """
+    codigos = np.array(sorted({MOTIVOS[f][0] for f in features}))
+    matriz = np.zeros((len(features), len(codigos)))
+    for j, feature in enumerate(features):
+        matriz[j, np.searchsorted(codigos, MOTIVOS[feature][0])] = -1.0
+    return codigos, matriz
+
+
+def motivos_adversos(contribuicoes: np.ndarray, features: tuple, quantidade: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Os `quantidade` fatores que mais aumentaram o risco de cada linha de `contribuicoes`
+    (n, features), vetorizado. Devolve os índices dos fatores em agrupamento(features)[0] e os
+    impactos, (n, quantidade) em ordem decrescente; fatores que reduziram o risco ficam com -1
+    """
+    _, matriz = agrupamento(tuple(features))
+    impacto = contribuicoes @ matriz
+    ordem = np.argsort(-impacto, axis=1)[:, :quantidade]
+    impactos = np.take_along_axis(impacto, ordem, axis=1)
+    return np.where(impactos > 0, ordem, -1), impactos
+
+
+def codificar(indices: np.ndarray, features: tuple) -> list[str | None]:
+    """
+    Forma compacta gravada em predictions.motivos: 'R01,R05,R10' (None sem motivos). Monta a
+    string uma vez por combinação distinta de fatores, não uma vez por linha
+    """
+    codigos = agrupamento(tuple(features))[0].tolist()
+    base = len(codigos) + 1
+    chaves = ((indices + 1) * base ** np.arange(indices.shape[1])[::-1]).sum(axis=1)
+    combinacoes, posicoes = np.unique(chaves, return_inverse=True)
+    textos = []
+    for chave in combinacoes.tolist():
+        partes = []
+        for _ in range(indices.shape[1]):
+            chave, resto = divmod(chave, base)
+            if resto:
+                partes.append(codigos[resto - 1])
+        textos.append(','.join(reversed(partes)) or None)
+    return np.array(textos, dtype=object)[posicoes].tolist()
+
+
+def descrever(indices: list[int], impactos: list[float], features: tuple) -> list[dict]:
+    codigos = agrupamento(tuple(features))[0]
+    return [{'codigo': str(codigos[i]), 'descricao': DESCRICOES[codigos[i]], 'impacto': round(impacto, 4)}
+            for i, impacto in zip(indices, impactos) if i >= 0]
+
+
+@lru_cache(maxsize=8)
+def _codigos_features(features: tuple) -> tuple:
+    return tuple(MOTIVOS[f][0] for f in features)
+
+
+def motivos_adversos_cliente(contribuicoes: list, features: tuple, quantidade: int) -> list[tuple[str, float]]:
+    """
+    Versão do /predict para um único cliente, em Python puro: com ~10 fatores, o custo fixo de
+    cada operação NumPy pesaria mais que a conta. Devolve (código, impacto) em ordem decrescente
+    """
+    impactos = {}
+    for codigo, contribuicao in zip(_codigos_features(features), contribuicoes):
+        impactos[codigo] = impactos.get(codigo, 0.0) - contribuicao
+    maiores = sorted(impactos.items(), key=itemgetter(1), reverse=True)[:quantidade]
+    return [(codigo, impacto) for codigo, impacto in maiores if impacto > 0]
+
+
+def descrever_cliente(motivos: list[tuple[str, float]]) -> list[dict]:
+    return [{'codigo': codigo, 'descricao': DESCRICOES[codigo], 'impacto': round(impacto, 4)}
+            for codigo, impacto in motivos]
@@ -0,0 +1,46 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+
+class CursorInvalido(ValueError):
+    """O token de página não foi gerado por esta API ou está corrompido"""
+
+
+def codificar_cursor(timestamp: datetime, id_: int) -> str:
+    """Token opaco com a posição (timestamp, id) da última linha da página"""
+    bruto = json.dumps([timestamp.isoformat(), id_], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, id_ = json.loads(bruto)
+        return datetime.fromisoformat(timestamp), int(id_)
+    except (ValueError, TypeError) as e:
+        raise CursorInvalido("Cursor de paginação inválido") from e
+
+
+async def estimar_total(db, tabela) -> int | None:
+    """
+    Estimativa do número de linhas pelo pg_class.reltuples (atualizado pelo ANALYZE/autovacuum).
+    Numa tabela particionada, soma as partições já analisadas (a tabela mãe não tem estatística
+    própria). Devolve None se a tabela nunca foi analisada; em outros bancos faz o COUNT exato
+    """
+    if db.bind.dialect.name != 'postgresql':
+        return await db.scalar(select(func.count()).select_from(tabela))
+
+    estimativa = await db.scalar(
+        text("SELECT CASE WHEN c.relkind = 'p' THEN ("
+             "  SELECT sum(p.reltuples) FILTER (WHERE p.reltuples >= 0) FROM pg_inherits i"
+             "  JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = c.oid"
+             ") ELSE c.reltuples END::bigint "
+             "FROM pg_class c WHERE c.oid = CAST(:tabela AS regclass)"),
+        {'tabela': tabela.name}
+    )
+    if estimativa is None or estimativa < 0:
+        return None
+    return estimativa
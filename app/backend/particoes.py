@@ -0,0 +1,583 @@
+"""
+Partições mensais de predictions (PostgreSQL) e arquivamento dos meses antigos em Parquet.
+
+No PostgreSQL, predictions é particionada por faixa de timestamp, uma partição por mês
+(predictions_2026_10), mais a partição padrão (predictions_padrao), que recebe o que chega sem a
+partição do mês; a manutenção cria a partição e move essas linhas para ela. As partições dos
+próximos meses são criadas com antecedência; as dos meses além da retenção são gravadas em
+Parquet (<arquivo>/predictions_2025_01.parquet, ordenado por timestamp e id) e registradas no
+catálogo predictions_arquivadas (caminho, faixa do mês e linhas). Só numa manutenção seguinte,
+depois que todos os hosts já leram o catálogo, a partição é desanexada e removida. O histórico,
+a exportação, a busca por id e a simulação de threshold continuam enxergando os meses
+arquivados pelo ArquivoPredicoes, que segue o catálogo.
+O rollup de /predictions/stats não é tocado: as estatísticas dos meses arquivados ficam lá.
+
+Em outros bancos (SQLite em testes) a tabela é uma só e nada é particionado nem arquivado.
+
+Uso (a partir de app/backend):
+    python particoes.py                 # cria as partições à frente e arquiva as vencidas
+    python particoes.py --simular       # só mostra o que seria feito
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+# linhas por row group no Parquet (e lidas do banco por vez ao arquivar)
+ARQUIVO_TAMANHO_BLOCO = 100_000
+# Intervalo em que cada worker relê o catálogo dos meses arquivados
+CATALOGO_ATUALIZAR_SEGUNDOS = 60.0
+# Um mês registrado no catálogo só tem a partição removida depois disso: bem mais que o intervalo
+# de leitura do catálogo, para nenhum worker ainda procurar o mês no banco
+REMOCAO_ESPERA_SEGUNDOS = 600.0
+
+
+def inicio_mes(data: datetime) -> datetime:
+    return datetime(data.year, data.month, 1)
+
+
+def somar_meses(mes: datetime, quantidade: int) -> datetime:
+    indice = mes.year * 12 + mes.month - 1 + quantidade
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def nome_particao(tabela, mes: datetime) -> str:
+    return f"{tabela.name}_{mes:%Y_%m}"
+
+
+def _mes_do_nome(prefixo: str, nome: str) -> datetime | None:
+    encontrado = re.fullmatch(rf'{re.escape(prefixo)}_(\d{{4}})_(\d{{2}})', nome)
+    return datetime(int(encontrado[1]), int(encontrado[2]), 1) if encontrado else None
+
+
+def particionada(conn, tabela) -> bool:
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:tabela)"),
+                        {'tabela': tabela.name}).scalar() is True
+
+
+def meses_particionados(conn, tabela) -> list[datetime]:
+    """Meses das partições existentes, em ordem"""
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:tabela)"
+    ), {'tabela': tabela.name}).scalars()
+    return sorted(mes for mes in (_mes_do_nome(tabela.name, nome) for nome in nomes) if mes is not None)
+
+
+def nome_padrao(tabela) -> str:
+    return f"{tabela.name}_padrao"
+
+
+def meses_no_padrao(conn, tabela) -> list[datetime]:
+    """Meses com linhas na partição padrão (inserções sem a partição do mês), em ordem"""
+    if conn.execute(text("SELECT to_regclass(:padrao)"), {'padrao': nome_padrao(tabela)}).scalar() is None:
+        return []
+    return [inicio_mes(mes) for mes in conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', timestamp) FROM {nome_padrao(tabela)} ORDER BY 1"
+    )).scalars()]
+
+
+def _criar_particao(conn, tabela, mes: datetime) -> int:
+    """
+    Cria a partição do mês. As linhas do mês que caíram na partição padrão passam para ela: a
+    tabela nova é preenchida antes do ATTACH, que só confere que nenhuma ficou no padrão.
+    Devolve quantas linhas foram movidas
+    """
+    nome, padrao = nome_particao(tabela, mes), nome_padrao(tabela)
+    faixa = f"FROM ('{mes:%Y-%m-%d}') TO ('{somar_meses(mes, 1):%Y-%m-%d}')"
+    janela = {'inicio': mes, 'fim': somar_meses(mes, 1)}
+    no_padrao = conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {padrao} WHERE timestamp >= :inicio AND timestamp < :fim)"
+    ), janela).scalar()
+    if not no_padrao:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {nome} PARTITION OF {tabela.name} FOR VALUES {faixa}"))
+        return 0
+    colunas = ', '.join(coluna.name for coluna in tabela.columns)
+    conn.execute(text(f"CREATE TABLE {nome} (LIKE {tabela.name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    movidas = conn.execute(text(
+        f"WITH movidas AS (DELETE FROM {padrao} WHERE timestamp >= :inicio AND timestamp < :fim "
+        f"RETURNING {colunas}) INSERT INTO {nome} ({colunas}) SELECT {colunas} FROM movidas"
+    ), janela).rowcount
+    conn.execute(text(f"ALTER TABLE {tabela.name} ATTACH PARTITION {nome} FOR VALUES {faixa}"))
+    logger.warning("Linhas da partição padrão movidas para a partição do mês",
+                   extra={'particao': nome, 'linhas': movidas})
+    return movidas
+
+
+def criar_particoes(conn, tabela, desde: datetime, ate: datetime) -> list[str]:
+    """
+    Cria a partição padrão, as partições mensais que faltam de `desde` até `ate` (inclusive) e as
+    dos meses que já têm linhas na partição padrão, movendo essas linhas para elas. Com a padrão,
+    um INSERT sem a partição do mês (manutenção parada além das antecipadas) nunca falha
+    """
+    # o mesmo lock da manutenção (reentrante na mesma sessão): dois processos não movem o mesmo mês
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('predictions_particoes'))"))
+    criadas = []
+    if conn.execute(text("SELECT to_regclass(:padrao)"), {'padrao': nome_padrao(tabela)}).scalar() is None:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {nome_padrao(tabela)} PARTITION OF {tabela.name} DEFAULT"))
+        criadas.append(nome_padrao(tabela))
+    existentes = set(meses_particionados(conn, tabela))
+    meses = set(meses_no_padrao(conn, tabela))
+    mes = inicio_mes(desde)
+    while mes <= ate:
+        meses.add(mes)
+        mes = somar_meses(mes, 1)
+    for mes in sorted(meses - existentes):
+        _criar_particao(conn, tabela, mes)
+        criadas.append(nome_particao(tabela, mes))
+    return criadas
+
+
+def garantir_sequencia_id(conn, tabela):
+    """
+    Cria a sequência do id, dona da coluna (é ela que o AlocadorIds encontra pelo
+    pg_get_serial_sequence), se ainda não existir: com a chave primária composta
+    (id, timestamp), o SQLAlchemy não cria o SERIAL
+    """
+    if conn.execute(text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': tabela.name}).scalar():
+        return
+    sequencia = f"{tabela.name}_id_seq"
+    conn.execute(text(f"CREATE SEQUENCE {sequencia} OWNED BY {tabela.name}.id"))
+    conn.execute(text(f"ALTER TABLE {tabela.name} ALTER COLUMN id SET DEFAULT nextval('{sequencia}')"))
+
+
+def registrar_arquivos_locais(conn, tabela, arquivo: 'ArquivoPredicoes') -> list[str]:
+    """
+    Registra no catálogo os Parquet do diretório local de meses cuja partição já foi removida,
+    arquivados antes de existir o catálogo. Meses com partição no banco ficam para a manutenção
+    """
+    import pyarrow.parquet as pq
+
+    if not arquivo.diretorio.is_dir():
+        return []
+    existentes = set(meses_particionados(conn, tabela))
+    catalogo = arquivo.ler_catalogo(conn)
+    registrados = []
+    for caminho in sorted(arquivo.diretorio.glob(f"{arquivo.prefixo}_*.parquet")):
+        mes = _mes_do_nome(arquivo.prefixo, caminho.stem)
+        if mes is None or mes in existentes or mes in catalogo:
+            continue
+        arquivo.registrar(conn, mes, caminho.resolve(), pq.ParquetFile(caminho).metadata.num_rows)
+        registrados.append(caminho.name)
+    return registrados
+
+
+def migrar_para_particionada(engine, tabela, antecipadas: int) -> int | None:
+    """
+    Converte a predictions antiga (sem partições) numa só transação: a antiga vira
+    <tabela>_legado (com índices e sequência renomeados), a nova é criada já particionada, com
+    uma partição por mês existente, e recebe as linhas com INSERT ... SELECT (convertendo os
+    tipos). A antiga fica para conferência: remova-a com DROP TABLE depois. Devolve as linhas
+    copiadas, ou None se não havia o que migrar
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name != 'postgresql':
+            return None
+        # vários `migrar.py` (ou workers com PREPARAR_SCHEMA) ao mesmo tempo: só um migra
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('predictions_particoes'))"))
+        tipo = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:tabela)"),
+                            {'tabela': tabela.name}).scalar()
+        if tipo != 'r':
+            return None
+
+        legado = f"{tabela.name}_legado"
+        sem_timestamp = conn.execute(text(f"SELECT count(*) FROM {tabela.name} WHERE timestamp IS NULL")).scalar()
+        if sem_timestamp:
+            raise RuntimeError(f"{tabela.name} tem {sem_timestamp} linhas sem timestamp, que não cabem em "
+                               "nenhuma partição: preencha o timestamp antes de migrar")
+        sequencia = conn.execute(text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': tabela.name}).scalar()
+        indices = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :tabela"
+        ), {'tabela': tabela.name}).scalars().all()
+
+        conn.execute(text(f"ALTER TABLE {tabela.name} RENAME TO {legado}"))
+        for indice in indices:
+            conn.execute(text(f'ALTER INDEX "{indice}" RENAME TO "{indice}_legado"'))
+        if sequencia is not None:
+            conn.execute(text(f"ALTER SEQUENCE {sequencia} RENAME TO {legado}_id_seq"))
+        tabela.create(conn)
+        garantir_sequencia_id(conn, tabela)
+
+        minimo, maximo, maior_id = conn.execute(text(f"SELECT min(timestamp), max(timestamp), max(id) FROM {legado}")).one()
+        agora = datetime.now()
+        criar_particoes(conn, tabela, minimo or agora, somar_meses(inicio_mes(max(maximo or agora, agora)), antecipadas))
+        colunas = ', '.join(coluna.name for coluna in tabela.columns)
+        copiadas = conn.execute(text(f"INSERT INTO {tabela.name} ({colunas}) SELECT {colunas} FROM {legado}")).rowcount
+        if maior_id is not None:
+            # os ids novos (reservados em blocos pelo AlocadorIds) continuam depois dos antigos
+            conn.execute(text("SELECT setval(pg_get_serial_sequence(:tabela, 'id'), :valor)"),
+                         {'tabela': tabela.name, 'valor': maior_id})
+    logger.info("predictions convertida em tabela particionada", extra={'linhas': copiadas, 'tabela_antiga': legado})
+    return copiadas
+
+
+class ArquivoIndisponivel(RuntimeError):
+    """Mês registrado no catálogo cujo Parquet este host não enxerga"""
+
+
+class ArquivoPredicoes:
+    """
+    Meses arquivados de predictions: um Parquet por mês, ordenado por (timestamp, id), com as
+    colunas da exportação. Os meses arquivados são os do catálogo no banco (`catalogo`, a tabela
+    predictions_arquivadas), o mesmo para todos os hosts, e não os arquivos do diretório local.
+    Tudo o que tem timestamp anterior à `fronteira` é lido daqui, nunca do banco (inclusive um mês
+    já registrado cuja partição ainda não foi removida)
+    """
+
+    def __init__(self, diretorio: Path, catalogo, prefixo: str = 'predictions'):
+        self.diretorio = Path(diretorio)
+        self.catalogo = catalogo
+        self.prefixo = prefixo
+        # mês -> linha do catálogo; trocado inteiro a cada leitura, lido sem lock pelos endpoints
+        self._registros = {}
+
+    def destino(self, mes: datetime) -> Path:
+        """Onde este host grava o Parquet do mês"""
+        return self.diretorio / f"{self.prefixo}_{mes:%Y_%m}.parquet"
+
+    def caminho(self, mes: datetime) -> Path:
+        """Parquet do mês registrado no catálogo. ArquivoIndisponivel se ele não existe neste host"""
+        caminho = Path(self._registros[mes]['caminho'])
+        if not caminho.is_file():
+            raise ArquivoIndisponivel(f"{caminho} ({mes:%Y-%m}) está no catálogo, mas não existe neste host: "
+                                      "CAMINHO_ARQUIVO_PREDICOES precisa ser um armazenamento compartilhado")
+        return caminho
+
+    def meses(self) -> list[datetime]:
+        return sorted(self._registros)
+
+    @property
+    def fronteira(self) -> datetime | None:
+        """Fim do mês arquivado mais recente (None sem arquivo)"""
+        meses = self.meses()
+        return self._registros[meses[-1]]['fim'] if meses else None
+
+    # ----------------------------------------------------------------- catálogo
+    def ler_catalogo(self, conn) -> dict:
+        return {linha['mes']: dict(linha) for linha in conn.execute(select(self.catalogo)).mappings()}
+
+    def atualizar(self, engine):
+        """Relê o catálogo. Um mês novo cujo Parquet não existe neste host é avisado já aqui"""
+        with engine.connect() as conn:
+            registros = self.ler_catalogo(conn)
+        for mes in sorted(set(registros) - set(self._registros)):
+            if not Path(registros[mes]['caminho']).is_file():
+                logger.error("Mês arquivado inacessível neste host (o arquivo precisa ser compartilhado)",
+                             extra={'mes': f"{mes:%Y-%m}", 'caminho': registros[mes]['caminho']})
+        self._registros = registros
+
+    def registrar(self, conn, mes: datetime, caminho: Path, linhas: int):
+        dialeto = postgresql if conn.dialect.name == 'postgresql' else sqlite
+        valores = {'mes': mes, 'fim': somar_meses(mes, 1), 'caminho': str(caminho), 'linhas': linhas,
+                   'arquivado_em': datetime.now()}
+        stmt = dialeto.insert(self.catalogo).values(**valores)
+        conn.execute(stmt.on_conflict_do_update(index_elements=['mes'],
+                                                set_={nome: stmt.excluded[nome] for nome in valores if nome != 'mes'}))
+
+    def gravar(self, mes: datetime, blocos) -> int:
+        """Grava os blocos de linhas (na ordem das colunas da exportação) como o Parquet do mês (escrita atômica)"""
+        import pyarrow.parquet as pq
+
+        from exportacao import SCHEMA_EXPORTACAO, tabela_arrow
+
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        destino = self.destino(mes)
+        temporario = destino.with_name(f".{destino.name}.tmp")
+        linhas = 0
+        with pq.ParquetWriter(temporario, SCHEMA_EXPORTACAO, compression='zstd') as escritor:
+            for bloco in blocos:
+                escritor.write_table(tabela_arrow(bloco), row_group_size=ARQUIVO_TAMANHO_BLOCO)
+                linhas += len(bloco)
+        os.replace(temporario, destino)
+        return linhas
+
+    def total_linhas(self) -> int:
+        return sum(registro['linhas'] for registro in self._registros.values())
+
+    # ------------------------------------------------------------------ leitura
+    def _meses_na_janela(self, inicio: datetime | None, fim: datetime | None) -> list[datetime]:
+        return [mes for mes in self.meses()
+                if (inicio is None or somar_meses(mes, 1) > inicio) and (fim is None or mes < fim)]
+
+    @staticmethod
+    def _filtrar(tabela, inicio=None, fim=None, resultado=None, situacao_moradia=None):
+        import pyarrow.compute as pc
+
+        condicoes = []
+        if inicio is not None:
+            condicoes.append(pc.field('timestamp') >= inicio)
+        if fim is not None:
+            condicoes.append(pc.field('timestamp') < fim)
+        if resultado is not None:
+            condicoes.append(pc.field('resultado') == resultado)
+        if situacao_moradia is not None:
+            condicoes.append(pc.field('situacao_moradia') == situacao_moradia)
+        if not condicoes:
+            return tabela
+        expressao = condicoes[0]
+        for condicao in condicoes[1:]:
+            expressao = expressao & condicao
+        return tabela.filter(expressao)
+
+    def blocos(self, inicio: datetime | None = None, fim: datetime | None = None, colunas: list | None = None,
+               **filtros):
+        """Tabelas Arrow de um row group por vez, do mês mais antigo ao mais recente"""
+        import pyarrow.parquet as pq
+
+        for mes in self._meses_na_janela(inicio, fim):
+            arquivo = pq.ParquetFile(self.caminho(mes))
+            for i in range(arquivo.num_row_groups):
+                tabela = self._filtrar(arquivo.read_row_group(i, columns=colunas), inicio, fim, **filtros)
+                if tabela.num_rows:
+                    yield tabela
+
+    def contar(self, inicio: datetime | None = None, fim: datetime | None = None, **filtros) -> int:
+        colunas = ['timestamp'] + [nome for nome, valor in filtros.items() if valor is not None]
+        return sum(tabela.num_rows for tabela in self.blocos(inicio, fim, colunas=colunas, **filtros))
+
+    def pagina(self, limite: int, antes: tuple[datetime, int] | None = None, inicio: datetime | None = None,
+               fim: datetime | None = None, **filtros) -> list[dict]:
+        """
+        Até `limite` linhas em ordem decrescente de (timestamp, id), anteriores ao cursor `antes`.
+        Lê os row groups do mais recente para o mais antigo e para assim que junta o bastante
+        """
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        # meses inteiramente posteriores ao cursor nem são abertos
+        limite_meses = fim
+        if antes is not None and (fim is None or antes[0] < fim):
+            limite_meses = antes[0] + timedelta(microseconds=1)
+        linhas = []
+        for mes in reversed(self._meses_na_janela(inicio, limite_meses)):
+            arquivo = pq.ParquetFile(self.caminho(mes))
+            coluna_timestamp = arquivo.schema_arrow.get_field_index('timestamp')
+            for i in reversed(range(arquivo.num_row_groups)):
+                estatisticas = arquivo.metadata.row_group(i).column(coluna_timestamp).statistics
+                if antes is not None and estatisticas is not None and estatisticas.has_min_max \
+                        and estatisticas.min > antes[0]:
+                    continue
+                tabela = self._filtrar(arquivo.read_row_group(i), inicio, fim, **filtros)
+                if antes is not None:
+                    tabela = tabela.filter((pc.field('timestamp') < antes[0])
+                                           | ((pc.field('timestamp') == antes[0]) & (pc.field('id') < antes[1])))
+                if not tabela.num_rows:
+                    continue
+                tabela = tabela.sort_by([('timestamp', 'descending'), ('id', 'descending')])
+                linhas.extend(tabela.slice(0, limite - len(linhas)).to_pylist())
+                if len(linhas) >= limite:
+                    return linhas
+        return linhas
+
+    def buscar(self, prediction_id: int) -> dict | None:
+        """Busca por id; as estatísticas de cada row group descartam quase todo o arquivo sem lê-lo"""
+        import pyarrow.parquet as pq
+
+        for mes in reversed(self.meses()):
+            tabela = pq.read_table(self.caminho(mes), filters=[('id', '=', prediction_id)])
+            if tabela.num_rows:
+                return tabela.slice(0, 1).to_pylist()[0]
+        return None
+
+
+# ------------------------------------------------------------------ manutenção
+def arquivar_particao(conn, tabela, mes: datetime, arquivo: ArquivoPredicoes) -> int:
+    """
+    Grava a partição do mês no arquivo, lida em blocos em ordem de (timestamp, id), confere as
+    linhas do Parquet gravado e registra o mês no catálogo. A partição continua no banco: quem a
+    remove é remover_particao, numa manutenção seguinte
+    """
+    import pyarrow.parquet as pq
+
+    from exportacao import consulta_exportacao
+
+    consulta = (consulta_exportacao(tabela, mes, somar_meses(mes, 1))
+                .order_by(None).order_by(tabela.c.timestamp, tabela.c.id))
+    with conn.begin():
+        resultado = conn.execution_options(yield_per=ARQUIVO_TAMANHO_BLOCO).execute(consulta)
+        linhas = arquivo.gravar(mes, resultado.partitions())
+    destino = arquivo.destino(mes)
+    no_arquivo = pq.ParquetFile(destino).metadata.num_rows
+    if no_arquivo != linhas:
+        raise RuntimeError(f"{destino} tem {no_arquivo} linhas, mas {linhas} foram lidas da partição")
+    with conn.begin():
+        arquivo.registrar(conn, mes, destino.resolve(), linhas)
+    return linhas
+
+
+def remover_particao(conn, tabela, mes: datetime, arquivo: ArquivoPredicoes) -> int:
+    """
+    Desanexa e remove a partição de um mês já registrado no catálogo (gravado em outra transação,
+    já confirmada), conferindo na mesma transação que a partição e o Parquet registrado têm as
+    linhas do registro. Sem registro, ou com o Parquet inacessível daqui, nada é removido
+    """
+    import pyarrow.parquet as pq
+
+    nome = nome_particao(tabela, mes)
+    with conn.begin():
+        registro = conn.execute(select(arquivo.catalogo).where(arquivo.catalogo.c.mes == mes)).mappings().first()
+        if registro is None:
+            raise RuntimeError(f"{nome} não está no catálogo de meses arquivados: a partição não é removida")
+        caminho = Path(registro['caminho'])
+        if not caminho.is_file():
+            raise ArquivoIndisponivel(f"{caminho} ({mes:%Y-%m}) não existe neste host: {nome} não é removida")
+        no_arquivo = pq.ParquetFile(caminho).metadata.num_rows
+        if no_arquivo != registro['linhas']:
+            raise RuntimeError(f"{caminho} tem {no_arquivo} linhas, mas o catálogo registra {registro['linhas']}")
+        conn.execute(text(f"ALTER TABLE {tabela.name} DETACH PARTITION {nome}"))
+        na_particao = conn.execute(text(f"SELECT count(*) FROM {nome}")).scalar()
+        if na_particao != registro['linhas']:
+            # o rollback anexa a partição de volta
+            raise RuntimeError(f"{nome} tem {na_particao} linhas, mas {registro['linhas']} foram arquivadas")
+        conn.execute(text(f"DROP TABLE {nome}"))
+    return na_particao
+
+
+def manter(engine, tabela, arquivo: ArquivoPredicoes, antecipadas: int, retencao_meses: int,
+           agora: datetime | None = None, simular: bool = False,
+           espera_remocao: float = REMOCAO_ESPERA_SEGUNDOS) -> dict:
+    """
+    Cria as partições do mês atual e dos `antecipadas` seguintes e arquiva as que terminaram há
+    mais de `retencao_meses` (0 não arquiva). Um mês vencido fora do catálogo é gravado e
+    registrado; um registrado há mais de `espera_remocao` segundos tem a partição removida. Usa
+    uma conexão só e um advisory lock: com vários workers, um faz a manutenção e os outros saem
+    sem fazer nada
+    """
+    agora = agora or datetime.now()
+    mes_atual = inicio_mes(agora)
+    feito = {'criadas': [], 'arquivadas': {}, 'removidas': {}}
+    with engine.connect() as conn:
+        if not particionada(conn, tabela):
+            conn.rollback()
+            return feito
+        obtido = conn.execute(text("SELECT pg_try_advisory_lock(hashtext('predictions_particoes'))")).scalar()
+        conn.commit()
+        if not obtido:
+            return feito
+        try:
+            existentes = meses_particionados(conn, tabela)
+            catalogo = arquivo.ler_catalogo(conn)
+            ate = somar_meses(mes_atual, antecipadas)
+            vencidos = [] if retencao_meses <= 0 else [
+                mes for mes in existentes if somar_meses(mes, 1) <= somar_meses(mes_atual, -retencao_meses)
+            ]
+            a_arquivar = [mes for mes in vencidos if mes not in catalogo]
+            a_remover = [mes for mes in vencidos if mes in catalogo
+                         and catalogo[mes]['arquivado_em'] <= agora - timedelta(seconds=espera_remocao)]
+            conn.rollback()
+            if simular:
+                faltantes = set(meses_no_padrao(conn, tabela))
+                mes = mes_atual
+                while mes <= ate:
+                    faltantes.add(mes)
+                    mes = somar_meses(mes, 1)
+                faltantes = [nome_particao(tabela, mes) for mes in sorted(faltantes - set(existentes))]
+                conn.rollback()
+                return {'criadas': faltantes,
+                        'arquivadas': {nome_particao(tabela, mes): None for mes in a_arquivar},
+                        'removidas': {nome_particao(tabela, mes): catalogo[mes]['linhas'] for mes in a_remover}}
+
+            with conn.begin():
+                feito['criadas'] = criar_particoes(conn, tabela, mes_atual, ate)
+            for mes in a_remover:
+                feito['removidas'][nome_particao(tabela, mes)] = remover_particao(conn, tabela, mes, arquivo)
+            for mes in a_arquivar:
+                feito['arquivadas'][nome_particao(tabela, mes)] = arquivar_particao(conn, tabela, mes, arquivo)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('predictions_particoes'))"))
+            conn.commit()
+    return feito
+
+
+class ManutencaoParticoes:
+    """
+    Numa thread, relê o catálogo dos meses arquivados a cada `intervalo_catalogo` segundos e roda
+    manter() ao iniciar e depois a cada `intervalo` segundos (0 só relê o catálogo)
+    """
+
+    def __init__(self, engine, tabela, arquivo: ArquivoPredicoes, antecipadas: int, retencao_meses: int,
+                 intervalo: float, intervalo_catalogo: float = CATALOGO_ATUALIZAR_SEGUNDOS):
+        self.engine = engine
+        self.tabela = tabela
+        self.arquivo = arquivo
+        self.antecipadas = antecipadas
+        self.retencao_meses = retencao_meses
+        self.intervalo = intervalo
+        self.intervalo_catalogo = intervalo_catalogo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _atualizar_catalogo(self):
+        from metricas import FALHAS_BANCO_PARTICOES
+
+        try:
+            self.arquivo.atualizar(self.engine)
+        except Exception as e:
+            FALHAS_BANCO_PARTICOES.inc()
+            logger.warning("Falha ao ler o catálogo dos meses arquivados", extra={'erro': str(e)})
+
+    def _executar(self):
+        from metricas import FALHAS_BANCO_PARTICOES
+
+        proxima_manutencao = time.monotonic()
+        while True:
+            if self.intervalo > 0 and time.monotonic() >= proxima_manutencao:
+                proxima_manutencao = time.monotonic() + self.intervalo
+                try:
+                    feito = manter(self.engine, self.tabela, self.arquivo, self.antecipadas, self.retencao_meses)
+                    if feito['criadas'] or feito['arquivadas'] or feito['removidas']:
+                        logger.info("Manutenção das partições", extra=feito)
+                except Exception as e:
+                    FALHAS_BANCO_PARTICOES.inc()
+                    logger.warning("Falha na manutenção das partições", extra={'erro': str(e)})
+                self._atualizar_catalogo()
+            espera = self.intervalo_catalogo if self.intervalo <= 0 else min(self.intervalo, self.intervalo_catalogo)
+            if self._parar.wait(espera):
+                return
+            self._atualizar_catalogo()
+
+    def iniciar(self):
+        # o catálogo é lido antes do primeiro request: a fronteira do arquivo já vale para ele
+        self._atualizar_catalogo()
+        self._thread = threading.Thread(target=self._executar, name="manutencao-particoes", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cria as partições à frente, arquiva as vencidas em Parquet e "
+                                                 f"remove as já arquivadas há mais de {REMOCAO_ESPERA_SEGUNDOS / 60:.0f} minutos")
+    parser.add_argument('--antecipadas', type=int, help="Meses à frente (padrão: PARTICOES_ANTECIPADAS)")
+    parser.add_argument('--retencao-meses', type=int, help="Meses mantidos no banco (padrão: PARTICOES_RETENCAO_MESES)")
+    parser.add_argument('--simular', action='store_true', help="Só mostra o que seria criado e arquivado")
+    args = parser.parse_args(argv)
+
+    # só importa o backend aqui: database.py exige DATABASE_URL
+    import main as api
+    from database import engine
+
+    feito = manter(engine, api.Prediction.__table__, api.arquivo_predicoes,
+                   api.PARTICOES_ANTECIPADAS if args.antecipadas is None else args.antecipadas,
+                   api.PARTICOES_RETENCAO_MESES if args.retencao_meses is None else args.retencao_meses,
+                   simular=args.simular)
+    print(json.dumps(feito, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
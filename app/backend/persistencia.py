@@ -0,0 +1,363 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import DateTime, func, insert, select, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from metricas import DURACAO_FLUSH, FALHAS_BANCO
+
+logger = logging.getLogger(__name__)
+
+# Latência de flush de um lote usada no pior atraso enquanto a fila ainda não mediu uma maior
+LATENCIA_FLUSH_REFERENCIA_SEGUNDOS = 0.5
+
+
+class FilaCheia(Exception):
+    """A fila de persistência atingiu a capacidade e não liberou espaço a tempo"""
+
+
+class AlocadorIds:
+    """
+    Gera os ids das predições no próprio processo, reservando blocos de ids de uma vez
+    (estratégia hi/lo), para que a resposta não precise esperar o INSERT + refresh.
+
+    No PostgreSQL a sequência do SERIAL passa a incrementar de tamanho_bloco em tamanho_bloco:
+    cada nextval reserva um bloco exclusivo, inclusive entre vários workers, e INSERTs sem id
+    continuam recebendo valores que não colidem. Em outros bancos (ex.: SQLite em testes)
+    os blocos são contados localmente a partir do maior id existente
+    """
+
+    def __init__(self, engine, tabela, tamanho_bloco: int = 1000):
+        self.engine = engine
+        self.tabela = tabela
+        self.tamanho_bloco = tamanho_bloco
+        self._lock = threading.Lock()
+        self._sequencia = None
+        self._proximo_local = 1
+        self._proximo = 0
+        self._fim = 0
+
+    def preparar(self):
+        with self.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                self._sequencia = conn.execute(
+                    text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': self.tabela.name}
+                ).scalar()
+                if self._sequencia is None:
+                    raise RuntimeError(f"A tabela {self.tabela.name} não possui sequência para o id")
+                conn.execute(text(f"ALTER SEQUENCE {self._sequencia} INCREMENT BY {int(self.tamanho_bloco)}"))
+            else:
+                maximo = conn.execute(select(func.max(self.tabela.c.id))).scalar() or 0
+                self._proximo_local = maximo + 1
+
+    def _reservar_bloco(self):
+        if self._sequencia is not None:
+            with self.engine.connect() as conn:
+                inicio = conn.execute(text("SELECT nextval(:seq)"), {'seq': self._sequencia}).scalar()
+        else:
+            inicio = self._proximo_local
+            self._proximo_local += self.tamanho_bloco
+        self._proximo, self._fim = inicio, inicio + self.tamanho_bloco
+
+    @property
+    def disponiveis(self) -> int:
+        """Ids que ainda restam no bloco atual (reservar até esse limite não acessa o banco)"""
+        return self._fim - self._proximo
+
+    def reservar(self, quantidade: int = 1) -> list[int]:
+        with self._lock:
+            ids = []
+            while len(ids) < quantidade:
+                if self._proximo >= self._fim:
+                    self._reservar_bloco()
+                n = min(quantidade - len(ids), self._fim - self._proximo)
+                ids.extend(range(self._proximo, self._proximo + n))
+                self._proximo += n
+            return ids
+
+
+def _serializar(valor):
+    """Datas em ISO 8601; escalares numpy como o tipo Python equivalente"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor.item()
+
+
+def falha_transitoria(erro: Exception) -> bool:
+    """Banco fora do ar, conexão perdida ou timeout: o mesmo lote pode ser gravado quando ele voltar"""
+    return isinstance(erro, (OperationalError, InterfaceError)) or getattr(erro, 'connection_invalidated', False)
+
+
+class FilaPersistencia:
+    """
+    Buffer write-behind com memória limitada para as linhas de uma tabela.
+
+    Os endpoints enfileiram as linhas e respondem imediatamente; uma thread em segundo
+    plano grava o buffer com INSERTs multi-linha quando ele atinge tamanho_lote ou
+    quando passa intervalo segundos desde o último flush. O gancho ao_gravar(conn, lote)
+    roda na mesma transação do INSERT.
+
+    Nenhuma linha enfileirada é descartada: a resposta já levou o prediction_id. Com o banco
+    fora do ar, o lote volta para o início do buffer e é tentado de novo até gravar; o buffer
+    enche e o enfileirar aplica backpressure (FilaCheia, 503). Um lote que o banco recusa
+    (constraint, tipo) e o que sobra no buffer ao parar sem banco vão para um arquivo de
+    pendentes em `diretorio_pendentes`, regravado no próximo iniciar()
+    """
+
+    def __init__(self, engine, tabela, capacidade: int = 50_000, tamanho_lote: int = 500,
+                 intervalo: float = 0.2, timeout_enfileirar: float = 2.0, tentativas: int = 5,
+                 ao_gravar=None, diretorio_pendentes: Path | None = None):
+        self.engine = engine
+        self.tabela = tabela
+        self.ao_gravar = ao_gravar
+        self.capacidade = capacidade
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.timeout_enfileirar = timeout_enfileirar
+        self.tentativas = tentativas
+        self.diretorio_pendentes = Path(diretorio_pendentes) if diretorio_pendentes is not None else None
+
+        self._buffer = deque()
+        # lote retirado do buffer e ainda não confirmado no banco
+        self._em_voo = []
+        self._cond = threading.Condition()
+        self._parando = False
+        self._thread = None
+
+        # métricas
+        self.linhas_gravadas = 0
+        self.lotes_gravados = 0
+        self.linhas_rejeitadas = 0
+        self.linhas_perdidas = 0
+        self.linhas_pendentes = 0
+        self.linhas_recuperadas = 0
+        self.falhas_flush = 0
+        self._latencia_ultima = 0.0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def iniciar(self):
+        self._recuperar_pendentes()
+        self._thread = threading.Thread(target=self._executar, name=f"fila-{self.tabela.name}", daemon=True)
+        self._thread.start()
+
+    def tentar_enfileirar(self, linhas: list[dict]) -> bool:
+        """Versão que nunca bloqueia: devolve False se não houver espaço no buffer agora"""
+        with self._cond:
+            if self._buffer and len(self._buffer) + len(linhas) > self.capacidade:
+                return False
+            self._buffer.extend(linhas)
+            if len(self._buffer) >= self.tamanho_lote:
+                self._cond.notify_all()
+            return True
+
+    def enfileirar(self, linhas: list[dict]):
+        """
+        Adiciona as linhas ao buffer de uma só vez. Se não houver espaço, espera até
+        timeout_enfileirar segundos (backpressure) e então lança FilaCheia
+        """
+        prazo = time.monotonic() + self.timeout_enfileirar
+        with self._cond:
+            # um lote maior que a capacidade só entra com o buffer vazio
+            while self._buffer and len(self._buffer) + len(linhas) > self.capacidade:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    self.linhas_rejeitadas += len(linhas)
+                    raise FilaCheia(f"Fila de persistência cheia ({len(self._buffer)}/{self.capacidade})")
+                self._cond.wait(restante)
+            self._buffer.extend(linhas)
+            if len(self._buffer) >= self.tamanho_lote:
+                self._cond.notify_all()
+
+    def _proximo_lote(self) -> list[dict]:
+        prazo = time.monotonic() + self.intervalo
+        with self._cond:
+            while len(self._buffer) < self.tamanho_lote and not self._parando:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+            n = min(len(self._buffer), self.tamanho_lote)
+            lote = [self._buffer.popleft() for _ in range(n)]
+            self._em_voo = lote
+            # acorda quem está esperando espaço no buffer
+            self._cond.notify_all()
+            return lote
+
+    def _descarregar(self, lote: list[dict]) -> Exception | None:
+        """Grava o lote com até `tentativas` tentativas. Devolve o último erro, ou None se gravou"""
+        erro = None
+        for tentativa in range(1, self.tentativas + 1):
+            inicio = time.perf_counter()
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(self.tabela), lote)
+                    if self.ao_gravar is not None:
+                        self.ao_gravar(conn, lote)
+            except Exception as e:
+                erro = e
+                self.falhas_flush += 1
+                FALHAS_BANCO.labels('flush').inc()
+                logger.warning("Erro ao gravar lote", extra={
+                    'tabela': self.tabela.name, 'linhas': len(lote),
+                    'tentativa': tentativa, 'tentativas': self.tentativas, 'erro': str(e)
+                })
+                if not falha_transitoria(e) or self._parando:
+                    return e
+                if tentativa < self.tentativas:
+                    time.sleep(min(0.1 * 2 ** tentativa, 5.0))
+                continue
+
+            latencia = time.perf_counter() - inicio
+            DURACAO_FLUSH.labels(self.tabela.name).observe(latencia)
+            self.linhas_gravadas += len(lote)
+            self.lotes_gravados += 1
+            self._latencia_ultima = latencia
+            self._latencia_total += latencia
+            self._latencia_max = max(self._latencia_max, latencia)
+            return None
+        return erro
+
+    def _devolver(self, lote: list[dict]):
+        """Põe o lote de volta no início do buffer, na ordem original"""
+        with self._cond:
+            self._buffer.extendleft(reversed(lote))
+            self._em_voo = []
+
+    def _concluir_lote(self):
+        with self._cond:
+            self._em_voo = []
+
+    def atraso_maximo(self) -> float:
+        """
+        Pior atraso, em segundos, entre o timestamp de uma linha e o commit dela com o banco no ar:
+        a espera por espaço (timeout_enfileirar), o buffer cheio à frente (um flush por lote, na maior
+        latência já medida), o intervalo e as tentativas do próprio lote com as esperas entre elas
+        """
+        latencia = max(self._latencia_max, LATENCIA_FLUSH_REFERENCIA_SEGUNDOS)
+        lotes = math.ceil(self.capacidade / self.tamanho_lote)
+        esperas = sum(min(0.1 * 2 ** tentativa, 5.0) for tentativa in range(1, self.tentativas))
+        return self.timeout_enfileirar + self.intervalo + lotes * latencia + self.tentativas * latencia + esperas
+
+    def pendente_mais_antiga(self) -> datetime | None:
+        """Menor timestamp entre as linhas ainda não gravadas (None com a fila vazia)"""
+        with self._cond:
+            cabecas = [linhas[0].get('timestamp') for linhas in (self._em_voo, self._buffer) if linhas]
+        cabecas = [timestamp for timestamp in cabecas if timestamp is not None]
+        return min(cabecas) if cabecas else None
+
+    # --------------------------------------------------------------- pendentes
+    def _guardar_pendentes(self, linhas: list[dict], motivo: str):
+        """Grava as linhas num arquivo JSON Lines novo (escrita atômica); sem diretório, elas se perdem"""
+        if not linhas:
+            return
+        if self.diretorio_pendentes is None:
+            self.linhas_perdidas += len(linhas)
+            logger.error("Linhas descartadas: fila sem diretório de pendentes",
+                         extra={'tabela': self.tabela.name, 'linhas': len(linhas), 'motivo': motivo})
+            return
+        self.diretorio_pendentes.mkdir(parents=True, exist_ok=True)
+        destino = self.diretorio_pendentes / f"{self.tabela.name}_{time.time_ns()}_{os.getpid()}.jsonl"
+        temporario = destino.with_name(f".{destino.name}.tmp")
+        with open(temporario, 'w') as arquivo:
+            for linha in linhas:
+                arquivo.write(json.dumps(linha, default=_serializar) + '\n')
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, destino)
+        self.linhas_pendentes += len(linhas)
+        logger.error("Linhas guardadas em arquivo de pendentes",
+                     extra={'tabela': self.tabela.name, 'linhas': len(linhas), 'arquivo': str(destino), 'motivo': motivo})
+
+    def _recuperar_pendentes(self):
+        """
+        Devolve ao buffer as linhas dos arquivos de pendentes desta tabela. Cada arquivo é tomado
+        por rename antes de ser lido: com vários workers, só um o recupera
+        """
+        if self.diretorio_pendentes is None or not self.diretorio_pendentes.is_dir():
+            return
+        datas = [coluna.name for coluna in self.tabela.columns if isinstance(coluna.type, DateTime)]
+        for arquivo in sorted(self.diretorio_pendentes.glob(f"{self.tabela.name}_*.jsonl")):
+            tomado = arquivo.with_name(f".{arquivo.name}.{os.getpid()}")
+            try:
+                os.rename(arquivo, tomado)
+            except FileNotFoundError:
+                continue
+            linhas = []
+            with open(tomado) as entrada:
+                for texto in entrada:
+                    linha = json.loads(texto)
+                    for nome in datas:
+                        if linha.get(nome) is not None:
+                            linha[nome] = datetime.fromisoformat(linha[nome])
+                    linhas.append(linha)
+            with self._cond:
+                self._buffer.extend(linhas)
+            tomado.unlink()
+            self.linhas_recuperadas += len(linhas)
+            logger.info("Linhas pendentes devolvidas à fila",
+                        extra={'tabela': self.tabela.name, 'linhas': len(linhas), 'arquivo': arquivo.name})
+
+    def _executar(self):
+        while True:
+            lote = self._proximo_lote()
+            if not lote:
+                if self._parando:
+                    return
+                continue
+            erro = self._descarregar(lote)
+            if erro is None:
+                self._concluir_lote()
+                continue
+            if not falha_transitoria(erro):
+                # o banco recusa o lote: tentar de novo só travaria a fila inteira
+                self._guardar_pendentes(lote, str(erro))
+                self._concluir_lote()
+            elif self._parando:
+                # encerrando sem banco: o lote e o resto do buffer vão para o arquivo
+                with self._cond:
+                    restantes = list(self._buffer)
+                    self._buffer.clear()
+                self._guardar_pendentes(lote + restantes, str(erro))
+                self._concluir_lote()
+                return
+            else:
+                # banco fora do ar: o lote volta para o início e a fila cheia aplica backpressure
+                self._devolver(lote)
+                logger.error("Banco indisponível; lote devolvido à fila",
+                             extra={'tabela': self.tabela.name, 'linhas': len(lote), 'profundidade': len(self._buffer)})
+                with self._cond:
+                    self._cond.wait_for(lambda: self._parando, timeout=5.0)
+
+    def parar(self, timeout: float = 30.0):
+        """Grava o que restou no buffer e encerra a thread"""
+        with self._cond:
+            self._parando = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metricas(self) -> dict:
+        return {
+            'profundidade': len(self._buffer),
+            'capacidade': self.capacidade,
+            'linhas_gravadas': self.linhas_gravadas,
+            'lotes_gravados': self.lotes_gravados,
+            'linhas_rejeitadas': self.linhas_rejeitadas,
+            'linhas_perdidas': self.linhas_perdidas,
+            'linhas_pendentes': self.linhas_pendentes,
+            'linhas_recuperadas': self.linhas_recuperadas,
+            'falhas_flush': self.falhas_flush,
+            'latencia_flush_ultima_ms': round(self._latencia_ultima * 1000, 3),
+            'latencia_flush_media_ms': round(self._latencia_total / self.lotes_gravados * 1000, 3)
+            if self.lotes_gravados else 0.0,
+            'latencia_flush_max_ms': round(self._latencia_max * 1000, 3),
+            'atraso_maximo_segundos': round(self.atraso_maximo(), 3),
+        }
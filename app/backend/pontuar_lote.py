@@ -0,0 +1,410 @@
+"""
+Pontuação offline da carteira inteira, sem passar pela API.
+
+Lê um Parquet ou CSV em blocos (pyarrow), calcula as features e pontua cada bloco num
+pool de processos e grava as decisões como partes Parquet em um diretório de saída.
+Opcionalmente carrega as decisões em `predictions` com COPY. Uma execução interrompida
+é retomada rodando o mesmo comando: as partes já gravadas (e já carregadas) são puladas.
+
+Uso (a partir de app/backend):
+    python pontuar_lote.py ../../data/dados_credito_processados.parquet saida/
+    python pontuar_lote.py carteira.csv saida/ --processos 8 --copiar-banco
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from features import COLUNAS_ENTRADA, calcular_features_tabela, matriz_features
+from motivos import codificar, motivos_adversos
+from registro_modelos import RegistroModelos
+
+RAIZ = Path(__file__).parent.parent.parent
+MOTIVOS_QUANTIDADE = int(os.getenv("MOTIVOS_QUANTIDADE", "3"))
+CAMINHO_MODELO = RAIZ / "modelos" / "modelo_credito_final.joblib"
+CAMINHO_REGISTRO = Path(os.getenv("CAMINHO_REGISTRO", RAIZ / "modelos" / "registro"))
+CAMINHO_REFERENCIA = RAIZ / "data" / "dados_credito_processados.parquet"
+
+ARQUIVO_EXECUCAO = "_execucao.json"
+
+COLUNAS_MORADIA_ONE_HOT = ['moradia_own', 'moradia_rent']
+
+
+# ---------------------------------------------------------------------- leitura
+def colunas_disponiveis(caminho: Path) -> list[str]:
+    if caminho.suffix == '.parquet':
+        return pq.ParquetFile(caminho).schema_arrow.names
+    with pacsv.open_csv(caminho) as leitor:
+        return leitor.schema.names
+
+
+def colunas_necessarias(disponiveis: list[str], extras: list[str]) -> list[str]:
+    """
+    Colunas a ler do arquivo: as de entrada (ou o one-hot de moradia) mais as extras pedidas.
+    Só o schema processado é aceito: o german_credit_data.csv bruto não tem os valores das contas
+    nem o salário (o notebook 01 os sorteia a partir das faixas), então precisa passar por ele antes
+    """
+    necessarias = [c for c in COLUNAS_ENTRADA if c != 'situacao_moradia']
+    if 'situacao_moradia' in disponiveis:
+        necessarias.append('situacao_moradia')
+    else:
+        necessarias.extend(COLUNAS_MORADIA_ONE_HOT)
+    faltantes = [c for c in necessarias + extras if c not in disponiveis]
+    if faltantes:
+        raise SystemExit(f"Colunas ausentes na entrada: {faltantes} "
+                         f"(é preciso o schema processado, como em data/dados_credito_processados.parquet)")
+    return necessarias + extras
+
+
+def ler_blocos(caminho: Path, colunas: list[str], tamanho_lote: int, bloco_csv_mb: int):
+    """Gera pa.RecordBatch de tamanho limitado: a memória não depende do tamanho do arquivo"""
+    if caminho.suffix == '.parquet':
+        yield from pq.ParquetFile(caminho).iter_batches(batch_size=tamanho_lote, columns=colunas)
+        return
+    leitor = pacsv.open_csv(
+        caminho,
+        read_options=pacsv.ReadOptions(block_size=bloco_csv_mb * 1024 * 1024),
+        convert_options=pacsv.ConvertOptions(include_columns=colunas),
+    )
+    for bloco in leitor:
+        yield bloco
+
+
+# --------------------------------------------------------------- processo worker
+_modelo = None
+
+
+def _iniciar_worker(scorer, features, threshold, versao):
+    # o ScorerLinear chega pelos parâmetros (__reduce__), sem o pipeline: serve também para o .npz
+    global _modelo
+    _modelo = (scorer, list(features), threshold, versao)
+
+
+def _validos(tabela: dict) -> np.ndarray:
+    """Mesmas regras do ClienteInput, vetorizadas (NaN também invalida a linha)"""
+    with np.errstate(invalid='ignore'):
+        return (
+            (tabela['idade'] >= 18) & (tabela['idade'] <= 120)
+            & (tabela['valor_conta_poupanca'] >= 0) & (tabela['valor_conta_corrente'] >= 0)
+            & (tabela['salario_anual'] >= 0) & (tabela['valor_emprestimo'] > 0)
+            & (tabela['prazo_meses'] > 0) & (tabela['prazo_meses'] <= 360)
+            & np.isin(tabela['situacao_moradia'], ['own', 'rent', 'free'])
+        )
+
+
+def _inteiros(valores: np.ndarray) -> pa.Array:
+    # NaN vira nulo; os valores já foram lidos como float para a validação vetorizada
+    return pa.array(valores, from_pandas=True).cast(pa.int64(), safe=False)
+
+
+def pontuar_bloco(indice: int, inicio_linha: int, bloco: pa.RecordBatch, destino: str, extras: list[str]) -> dict:
+    """Pontua um bloco e grava a parte correspondente (escrita atômica: .tmp + rename)"""
+    scorer, features, threshold, versao = _modelo
+
+    tabela = {}
+    for coluna in COLUNAS_ENTRADA:
+        if coluna == 'situacao_moradia':
+            continue
+        tabela[coluna] = bloco.column(coluna).to_numpy(zero_copy_only=False).astype(np.float64)
+    if 'situacao_moradia' in bloco.schema.names:
+        tabela['situacao_moradia'] = np.asarray(bloco.column('situacao_moradia').to_pylist(), dtype=object)
+    else:
+        own = bloco.column('moradia_own').to_numpy(zero_copy_only=False)
+        rent = bloco.column('moradia_rent').to_numpy(zero_copy_only=False)
+        tabela['situacao_moradia'] = np.where(own == 1, 'own', np.where(rent == 1, 'rent', 'free')).astype(object)
+
+    validos = _validos(tabela)
+    proba_risco = np.full(len(validos), np.nan)
+    codigos_motivos = np.full(len(validos), None, dtype=object)
+    if validos.any():
+        filtrada = {c: v[validos] for c, v in tabela.items()}
+        matriz = matriz_features(calcular_features_tabela(filtrada), features)
+        # mesma convenção do /predict: risco = 1 - probabilidade da classe 1
+        if MOTIVOS_QUANTIDADE > 0:
+            proba, contribuicoes = scorer.proba_e_contribuicoes(matriz)
+        else:
+            proba, contribuicoes = scorer.proba_positiva(matriz), None
+        proba_risco[validos] = np.round(1 - proba, 4)
+        if contribuicoes is not None:
+            indices, _ = motivos_adversos(contribuicoes, tuple(features), MOTIVOS_QUANTIDADE)
+            codigos_motivos[validos] = codificar(indices, tuple(features))
+    aprovado = proba_risco < threshold
+
+    resultado = np.where(aprovado, "Aprovado", "Reprovado").astype(object)
+    resultado[~validos] = None
+    saida = pa.table({
+        'linha': pa.array(np.arange(inicio_linha, inicio_linha + len(validos)), pa.int64()),
+        **{c: bloco.column(c) for c in extras},
+        'idade': _inteiros(tabela['idade']),
+        'valor_conta_poupanca': tabela['valor_conta_poupanca'],
+        'valor_conta_corrente': tabela['valor_conta_corrente'],
+        'salario_anual': tabela['salario_anual'],
+        'valor_emprestimo': tabela['valor_emprestimo'],
+        'prazo_meses': _inteiros(tabela['prazo_meses']),
+        'situacao_moradia': pa.array(tabela['situacao_moradia'], pa.string()),
+        'resultado': pa.array(resultado, pa.string()),
+        'probabilidade_risco': pa.array(proba_risco, from_pandas=True),
+        'threshold_utilizado': pa.array(np.full(len(validos), round(threshold, 4))),
+        'versao_modelo': pa.array([versao] * len(validos), pa.string()),
+        'motivos': pa.array(codigos_motivos, pa.string()),
+    })
+
+    temporario = Path(destino).with_suffix('.tmp')
+    pq.write_table(saida, temporario, compression='zstd')
+    os.replace(temporario, destino)
+    return {
+        'indice': indice,
+        'linhas': len(validos),
+        'invalidas': int((~validos).sum()),
+        'aprovados': int(np.count_nonzero(aprovado & validos)),
+    }
+
+
+# ------------------------------------------------------------- carga no banco
+def inserir_arrow(conn, tabela, dados: pa.Table):
+    """Grava uma tabela Arrow com COPY no PostgreSQL; em outros bancos, com INSERTs em lote"""
+    from sqlalchemy import insert
+
+    if conn.dialect.name == 'postgresql':
+        buffer = io.BytesIO()
+        pacsv.write_csv(dados, buffer, write_options=pacsv.WriteOptions(include_header=False))
+        buffer.seek(0)
+        cursor = conn.connection.driver_connection.cursor()
+        cursor.copy_expert(
+            f"COPY {tabela.name} ({', '.join(dados.schema.names)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+        return
+    linhas = dados.to_pylist()
+    for i in range(0, len(linhas), 5000):
+        conn.execute(insert(tabela), linhas[i:i + 5000])
+
+
+def carregar_parte(engine, tabela_predicoes, tabela_cargas, execucao_id: str, indice: int, caminho: Path,
+                   alocador) -> int:
+    """
+    Carrega uma parte em predictions com COPY (INSERT em lote fora do PostgreSQL) e registra a
+    parte em cargas_lote na mesma transação: uma retomada nunca carrega a mesma parte duas vezes
+    """
+    from sqlalchemy import insert, select
+
+    from agregados import atualizar_agregados
+
+    parte = pq.read_table(caminho).filter(pc.is_valid(pc.field('resultado')))
+    colunas = ['id', 'timestamp', *COLUNAS_ENTRADA, 'resultado', 'probabilidade_risco',
+               'threshold_utilizado', 'versao_modelo', 'motivos']
+    agora = datetime.now()
+
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{execucao_id}:{indice}",))
+        ja_carregada = conn.execute(
+            select(tabela_cargas.c.parte)
+            .where(tabela_cargas.c.execucao == execucao_id, tabela_cargas.c.parte == indice)
+        ).first()
+        if ja_carregada is not None:
+            return 0
+
+        ids = alocador.reservar(parte.num_rows)
+        parte = parte.append_column('id', pa.array(ids, pa.int64()))
+        parte = parte.append_column('timestamp', pa.array([agora] * parte.num_rows, pa.timestamp('us')))
+        if 'motivos' not in parte.schema.names:
+            # parte pontuada por uma versão anterior deste script, retomada agora
+            parte = parte.append_column('motivos', pa.nulls(parte.num_rows, pa.string()))
+        parte = parte.select(colunas)
+
+        inserir_arrow(conn, tabela_predicoes, parte)
+
+        # o rollup de /predictions/stats é mantido na mesma transação, como faz a fila da API
+        atualizar_agregados(conn, parte.select(
+            ['timestamp', 'resultado', 'situacao_moradia', 'probabilidade_risco']
+        ).to_pylist())
+        conn.execute(insert(tabela_cargas), {'execucao': execucao_id, 'parte': indice, 'linhas': parte.num_rows,
+                                             'carregada_em': agora})
+    return parte.num_rows
+
+
+def preparar_banco():
+    """Importa o backend só quando a carga no banco é pedida (exige DATABASE_URL)"""
+    from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+    from database import engine
+    from main import Prediction, preparar_schema
+    from persistencia import AlocadorIds
+
+    metadata = MetaData()
+    tabela_cargas = Table(
+        'cargas_lote', metadata,
+        Column('execucao', String(36), primary_key=True),
+        Column('parte', Integer, primary_key=True),
+        Column('linhas', Integer),
+        Column('carregada_em', DateTime),
+    )
+    # o mesmo preparo do `python migrar.py`: no PostgreSQL, predictions já sai particionada
+    preparar_schema()
+    metadata.create_all(bind=engine)
+
+    alocador = AlocadorIds(engine, Prediction.__table__)
+    alocador.preparar()
+    return engine, Prediction.__table__, tabela_cargas, alocador
+
+
+# -------------------------------------------------------------------- execução
+def ler_execucao(saida: Path, assinatura: dict, reiniciar: bool) -> dict:
+    """Retoma a execução anterior se a entrada, o lote e o modelo forem os mesmos"""
+    arquivo = saida / ARQUIVO_EXECUCAO
+    if arquivo.is_file():
+        execucao = json.loads(arquivo.read_text())
+        if execucao['assinatura'] == assinatura and not reiniciar:
+            return execucao
+        if not reiniciar:
+            raise SystemExit(f"{saida} contém outra execução ({execucao['assinatura']}); use --reiniciar")
+        for parte in saida.glob("parte-*.parquet"):
+            parte.unlink()
+
+    execucao = {'id': str(uuid.uuid4()), 'assinatura': assinatura}
+    saida.mkdir(parents=True, exist_ok=True)
+    arquivo.write_text(json.dumps(execucao, indent=2))
+    return execucao
+
+
+def pico_rss_mb() -> float:
+    # ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class AmostradorRss:
+    """
+    Pico de RSS dos workers do pool, amostrado com psutil a cada parte concluída. O
+    RUSAGE_CHILDREN não serve: só conta filhos já encerrados e recolhidos, e os workers do
+    pool vivem até o fim da execução
+    """
+
+    def __init__(self):
+        self.maximo_worker = 0
+        self.maximo_soma = 0
+
+    def amostrar(self):
+        import psutil
+        rss = []
+        for filho in psutil.Process().children(recursive=True):
+            try:
+                rss.append(filho.memory_info().rss)
+            except psutil.Error:
+                continue
+        if rss:
+            self.maximo_worker = max(self.maximo_worker, max(rss))
+            self.maximo_soma = max(self.maximo_soma, sum(rss))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pontuação offline de carteiras em Parquet/CSV",
+        epilog="A entrada precisa do schema processado (colunas do ClienteInput: " + ", ".join(COLUNAS_ENTRADA)
+        + "; ou moradia_own/moradia_rent no lugar de situacao_moradia). O german_credit_data.csv bruto "
+        "não é aceito: passe-o antes pelo notebook 01_importacao_e_limpeza.")
+    parser.add_argument('entrada', type=Path, help="Arquivo .parquet ou .csv no schema processado")
+    parser.add_argument('saida', type=Path, help="Diretório das partes Parquet com as decisões")
+    parser.add_argument('--versao', help="Versão do registro de modelos (padrão: a versão ativa)")
+    parser.add_argument('--tamanho-lote', type=int, default=50_000, help="Linhas por bloco do Parquet")
+    parser.add_argument('--bloco-csv-mb', type=int, default=8, help="Tamanho de cada bloco lido do CSV")
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--manter-colunas', nargs='*', default=[],
+                        help="Colunas da entrada copiadas para a saída (ex.: cliente_id)")
+    parser.add_argument('--copiar-banco', action='store_true', help="Carrega as decisões em predictions (COPY)")
+    parser.add_argument('--reiniciar', action='store_true', help="Descarta uma execução anterior no diretório")
+    args = parser.parse_args(argv)
+
+    registro = RegistroModelos(CAMINHO_REGISTRO, CAMINHO_MODELO, CAMINHO_REFERENCIA)
+    modelo = registro.carregar(args.versao or registro.versao_desejada())
+
+    colunas = colunas_necessarias(colunas_disponiveis(args.entrada), args.manter_colunas)
+    estado = args.entrada.stat()
+    assinatura = {
+        'entrada': str(args.entrada.resolve()),
+        'tamanho_bytes': estado.st_size,
+        'modificado_em': estado.st_mtime,
+        'tamanho_lote': args.tamanho_lote if args.entrada.suffix == '.parquet' else args.bloco_csv_mb,
+        'versao_modelo': modelo.versao,
+        'colunas_extras': args.manter_colunas,
+    }
+    execucao = ler_execucao(args.saida, assinatura, args.reiniciar)
+
+    banco = preparar_banco() if args.copiar_banco else None
+
+    inicio = time.perf_counter()
+    total = invalidas = aprovados = puladas = carregadas = 0
+    pendentes = set()
+    maximo_pendentes = 2 * args.processos
+    amostrador = AmostradorRss()
+
+    def concluir(futuros):
+        nonlocal total, invalidas, aprovados, carregadas
+        amostrador.amostrar()
+        for futuro in futuros:
+            r = futuro.result()
+            total += r['linhas']
+            invalidas += r['invalidas']
+            aprovados += r['aprovados']
+            if banco is not None:
+                carregadas += carregar_parte(*banco[:3], execucao['id'], r['indice'],
+                                             args.saida / f"parte-{r['indice']:06d}.parquet", banco[3])
+            print(f"   parte {r['indice']:06d}: {r['linhas']} linhas", file=sys.stderr)
+
+    with ProcessPoolExecutor(
+        max_workers=args.processos,
+        initializer=_iniciar_worker,
+        initargs=(modelo.scorer, modelo.features, modelo.threshold, modelo.versao),
+    ) as pool:
+        inicio_linha = 0
+        for indice, bloco in enumerate(ler_blocos(args.entrada, colunas, args.tamanho_lote, args.bloco_csv_mb)):
+            destino = args.saida / f"parte-{indice:06d}.parquet"
+            if destino.is_file():
+                # retomada: a parte já foi pontuada; só falta carregar, se a carga for pedida
+                puladas += 1
+                if banco is not None:
+                    carregadas += carregar_parte(*banco[:3], execucao['id'], indice, destino, banco[3])
+            else:
+                # no máximo 2 blocos por processo em memória, qualquer que seja o tamanho do arquivo
+                if len(pendentes) >= maximo_pendentes:
+                    prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                    concluir(prontos)
+                pendentes.add(pool.submit(pontuar_bloco, indice, inicio_linha, bloco, str(destino),
+                                          args.manter_colunas))
+            inicio_linha += bloco.num_rows
+        concluir(wait(pendentes).done)
+
+    duracao = time.perf_counter() - inicio
+    print(json.dumps({
+        'execucao': execucao['id'],
+        'versao_modelo': modelo.versao,
+        'linhas_pontuadas': total,
+        'linhas_invalidas': invalidas,
+        'aprovados': aprovados,
+        'partes_retomadas': puladas,
+        'linhas_carregadas_no_banco': carregadas if banco is not None else None,
+        'segundos': round(duracao, 2),
+        'linhas_por_segundo': round(total / duracao) if duracao > 0 else None,
+        'pico_rss_mb': {
+            'principal': round(pico_rss_mb(), 1),
+            # amostrado ao fim de cada parte: o maior worker e a maior soma dos workers
+            'worker': round(amostrador.maximo_worker / 2 ** 20, 1),
+            'workers_soma': round(amostrador.maximo_soma / 2 ** 20, 1),
+        },
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
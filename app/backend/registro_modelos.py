@@ -0,0 +1,289 @@
+import logging
+import os
+import threading
+import weakref
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+import artefato_compacto
+from features import FEATURES_MODELO, calcular_features_tabela, matriz_features
+from scoring import TOLERANCIA_AUTOVERIFICACAO, ScorerLinear, criar_scorer, desvio_esperado
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_VERSAO_ATIVA = "ATUAL"
+TAMANHO_CANARIO = 200
+
+
+class ArtefatoInvalido(Exception):
+    """O artefato não passou na validação e não foi ativado"""
+
+
+class ArtefatoDesatualizado(ArtefatoInvalido):
+    """O .npz não corresponde ao .joblib da mesma versão (que foi trocado depois da conversão)"""
+
+
+@dataclass(frozen=True, eq=False)
+class ModeloCarregado:
+    """
+    Versão de modelo pronta para servir. É imutável: um request pega a referência uma vez
+    (registro.atual) e usa o mesmo objeto até o fim, mesmo que outra versão seja ativada
+    """
+    versao: str
+    pipeline: Any  # None quando carregado do artefato compacto (.npz)
+    scorer: Any
+    threshold: float
+    features: tuple
+    metricas: dict = field(default_factory=dict)
+    formato: str = 'joblib'
+    artefato: str = ''
+    carregado_em: datetime = field(default_factory=datetime.now)
+
+
+class RegistroModelos:
+    """
+    Registro de artefatos versionados em `diretorio` (um <versao>.joblib e/ou <versao>.npz por
+    versão). O .npz (artefato_compacto.py) tem preferência: carrega sem sklearn, pandas nem joblib.
+    Se houver um .joblib ao lado e ele não for o que gerou o .npz (retreinado com o mesmo nome),
+    o .npz é recusado e a versão sai do .joblib.
+
+    A versão ativa é a indicada no arquivo ATUAL ou, sem ele, a última em ordem de nome;
+    sem nenhuma versão no diretório, usa o artefato padrão (CAMINHO_MODELO). A troca de
+    versão é uma única atribuição de referência, então requests em andamento terminam
+    na versão antiga, que é liberada da memória quando o último deles acaba
+    """
+
+    def __init__(self, diretorio: Path, caminho_padrao: Path, caminho_referencia: Path):
+        self.diretorio = Path(diretorio)
+        self.caminho_padrao = Path(caminho_padrao)
+        self.caminho_referencia = Path(caminho_referencia)
+        self.atual: ModeloCarregado | None = None
+
+        self._lock = threading.Lock()
+        self._ouvintes = []
+        self._aposentados = weakref.WeakSet()
+        self._referencia = None
+        self._observador = None
+        self._parar_observador = threading.Event()
+        self._falha_observada = None
+
+    # ------------------------------------------------------------------ versões
+    def versoes_disponiveis(self) -> list[str]:
+        if not self.diretorio.is_dir():
+            return []
+        return sorted({p.stem for extensao in ("*.joblib", "*.npz") for p in self.diretorio.glob(extensao)})
+
+    def versao_desejada(self) -> str:
+        arquivo = self.diretorio / ARQUIVO_VERSAO_ATIVA
+        if arquivo.is_file():
+            versao = arquivo.read_text().strip()
+            if versao:
+                return versao
+        versoes = self.versoes_disponiveis()
+        return versoes[-1] if versoes else self.caminho_padrao.stem
+
+    def _candidatos(self, versao: str, compacto: bool = True) -> list[Path]:
+        candidatos = [self.diretorio / f"{versao}.joblib"]
+        if versao == self.caminho_padrao.stem:
+            candidatos.append(self.caminho_padrao)
+        if compacto:
+            candidatos = [c.with_suffix('.npz') for c in candidatos] + candidatos
+        return candidatos
+
+    def caminho_artefato(self, versao: str, compacto: bool = True) -> Path:
+        """Arquivo da versão no registro ou, para a versão padrão, o artefato padrão; .npz primeiro"""
+        for caminho in self._candidatos(versao, compacto):
+            if caminho.is_file():
+                return caminho
+        raise FileNotFoundError(f"Versão de modelo não encontrada: {versao}")
+
+    def assinatura(self, versao: str) -> tuple:
+        """
+        A versão e o (arquivo, mtime, tamanho) de cada artefato dela. Muda quando um artefato é
+        corrigido no lugar, e então o observador tenta de novo uma versão que já falhou
+        """
+        arquivos = []
+        for caminho in self._candidatos(versao):
+            try:
+                estado = caminho.stat()
+            except OSError:
+                continue
+            arquivos.append((str(caminho), estado.st_mtime_ns, estado.st_size))
+        return versao, tuple(arquivos)
+
+    def _dados_referencia(self):
+        if self._referencia is None:
+            try:
+                import pandas as pd
+                self._referencia = pd.read_parquet(self.caminho_referencia)
+            except OSError as e:
+                logger.warning("Dados de referência indisponíveis", extra={'erro': str(e)})
+                return None
+        return self._referencia
+
+    def matriz_canario(self, features) -> np.ndarray | None:
+        """Primeiras linhas da referência na ordem de `features` (None sem dados de referência)"""
+        referencia = self._dados_referencia()
+        if referencia is None:
+            return None
+        return matriz_features(calcular_features_tabela(referencia.head(TAMANHO_CANARIO)), list(features))
+
+    # ------------------------------------------------------------- carregamento
+    @staticmethod
+    def _validar(versao: str, features: list, threshold: float):
+        faltantes = set(features) - set(FEATURES_MODELO)
+        if faltantes:
+            raise ArtefatoInvalido(f"Artefato {versao} usa features que a API não calcula: {faltantes}")
+        if not 0 < threshold < 1:
+            raise ArtefatoInvalido(f"Artefato {versao} com threshold inválido: {threshold}")
+
+    def carregar(self, versao: str, compacto: bool = True) -> ModeloCarregado:
+        """Carrega e valida uma versão sem ativá-la. compacto=False ignora o .npz e lê o .joblib"""
+        caminho = self.caminho_artefato(versao, compacto)
+        if caminho.suffix == '.npz':
+            try:
+                return self._carregar_compacto(versao, caminho)
+            except ArtefatoDesatualizado as e:
+                logger.warning("Artefato compacto desatualizado; usando o .joblib",
+                               extra={'versao': versao, 'artefato': str(caminho), 'erro': str(e)})
+                caminho = self.caminho_artefato(versao, compacto=False)
+
+        import joblib
+        dados_modelo = joblib.load(caminho)
+
+        try:
+            pipeline = dados_modelo['modelo']
+            threshold = float(dados_modelo['threshold_f2'])
+            features = list(dados_modelo['features'])
+        except (KeyError, TypeError) as e:
+            raise ArtefatoInvalido(f"Artefato {versao} sem a chave obrigatória {e}") from e
+        self._validar(versao, features, threshold)
+
+        referencia = self._dados_referencia()
+        scorer = criar_scorer(pipeline, features, referencia)
+
+        # canário: a versão precisa pontuar os dados de referência com probabilidades válidas
+        if referencia is not None:
+            canario = self.matriz_canario(features)
+            try:
+                proba = scorer.proba_positiva(canario)
+            except Exception as e:
+                raise ArtefatoInvalido(f"Artefato {versao} falhou ao pontuar o canário: {e}") from e
+            if proba.shape != (len(canario),) or not np.all(np.isfinite(proba)) \
+                    or proba.min() < 0 or proba.max() > 1:
+                raise ArtefatoInvalido(f"Artefato {versao} gerou probabilidades inválidas no canário")
+
+        return ModeloCarregado(
+            versao=versao,
+            pipeline=pipeline,
+            scorer=scorer,
+            threshold=threshold,
+            features=tuple(features),
+            metricas=dict(dados_modelo.get('metricas', {})),
+            artefato=str(caminho),
+        )
+
+    def _carregar_compacto(self, versao: str, caminho: Path) -> ModeloCarregado:
+        """
+        Monta o ScorerLinear direto dos parâmetros do .npz. O canário vem no próprio artefato,
+        com as probabilidades do sklearn: não lê a referência nem importa o pipeline
+        """
+        try:
+            dados = artefato_compacto.carregar(caminho)
+            features = list(dados['features'])
+            threshold = float(dados['threshold_f2'])
+            scorer = ScorerLinear.dos_parametros(dados['centro'], dados['escala'], dados['coef'],
+                                                 dados['intercepto'], features)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            raise ArtefatoInvalido(f"Artefato compacto {versao} inválido: {e}") from e
+        self._validar(versao, features, threshold)
+
+        origem = caminho.with_suffix('.joblib')
+        if origem.is_file() and not artefato_compacto.fonte_confere(dados.get('fonte'), origem):
+            raise ArtefatoDesatualizado(f"{caminho.name} não foi gerado a partir do {origem.name} atual")
+
+        desvio = desvio_esperado(scorer, dados['canario'], dados['canario_proba'])
+        if not desvio <= TOLERANCIA_AUTOVERIFICACAO:
+            raise ArtefatoInvalido(f"Artefato compacto {versao} diverge do canário (desvio {desvio})")
+
+        return ModeloCarregado(
+            versao=versao,
+            pipeline=None,
+            scorer=scorer,
+            threshold=threshold,
+            features=tuple(features),
+            metricas=dict(dados.get('metricas', {})),
+            formato='npz',
+            artefato=str(caminho),
+        )
+
+    def ativar(self, versao: str | None = None, fixar: bool = False) -> ModeloCarregado:
+        """
+        Carrega, valida e troca atomicamente a versão servida. Com fixar=True grava a versão
+        no arquivo ATUAL, para que os outros workers (via observador) também a ativem
+        """
+        with self._lock:
+            versao = versao or self.versao_desejada()
+            novo = self.carregar(versao)
+
+            if fixar:
+                self.diretorio.mkdir(parents=True, exist_ok=True)
+                temporario = self.diretorio / f".{ARQUIVO_VERSAO_ATIVA}.tmp"
+                temporario.write_text(versao)
+                os.replace(temporario, self.diretorio / ARQUIVO_VERSAO_ATIVA)
+
+            anterior, self.atual = self.atual, novo
+            if anterior is not None:
+                self._aposentados.add(anterior)
+
+        logger.info("Modelo ativado", extra={'versao': novo.versao, 'formato': novo.formato, 'artefato': novo.artefato,
+                                             'anterior': anterior.versao if anterior else None})
+        for ouvinte in self._ouvintes:
+            ouvinte(anterior, novo)
+        return novo
+
+    def ao_trocar(self, ouvinte):
+        """Registra ouvinte(anterior, novo) chamado após cada troca de versão"""
+        self._ouvintes.append(ouvinte)
+
+    def aposentados_em_memoria(self) -> list[str]:
+        """Versões antigas que ainda estão vivas (presas a requests em andamento)"""
+        return sorted(m.versao for m in self._aposentados)
+
+    # --------------------------------------------------------------- observador
+    def verificar(self):
+        """
+        Um passo do observador: ativa a versão desejada quando ela muda. Uma versão que falhou só
+        é tentada de novo quando a assinatura dos artefatos dela muda (arquivo corrigido no lugar)
+        """
+        versao = assinatura = None
+        try:
+            versao = self.versao_desejada()
+            if self.atual is not None and versao == self.atual.versao:
+                return
+            assinatura = self.assinatura(versao)
+            if assinatura == self._falha_observada:
+                return
+            self.ativar(versao)
+            self._falha_observada = None
+        except Exception as e:
+            self._falha_observada = assinatura
+            logger.warning("Falha ao ativar a versão", extra={'versao': versao, 'erro': str(e)})
+
+    def observar(self, intervalo: float):
+        """Verifica o diretório a cada `intervalo` segundos e ativa a versão desejada quando ela muda"""
+        def executar():
+            while not self._parar_observador.wait(intervalo):
+                self.verificar()
+
+        self._observador = threading.Thread(target=executar, name="observador-modelos", daemon=True)
+        self._observador.start()
+
+    def parar(self):
+        self._parar_observador.set()
+        if self._observador is not None:
+            self._observador.join(timeout=5)
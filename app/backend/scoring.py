@@ -0,0 +1,280 @@
+import logging
+import math
+import threading
+
+import numpy as np
+
+from features import calcular_features_tabela, matriz_features
+
+logger = logging.getLogger(__name__)
+
+TOLERANCIA_AUTOVERIFICACAO = 1e-9
+# Tabela de contribuições dos modelos não lineares: faixas por feature e linhas da referência usadas
+FAIXAS_CONTRIBUICOES = 10
+AMOSTRA_CONTRIBUICOES = 500
+
+
+def _sigmoide(z: float) -> float:
+    # forma estável para logits muito negativos (evita OverflowError em math.exp)
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    ez = math.exp(z)
+    return ez / (1.0 + ez)
+
+
+def parametros_lineares(pipeline, features: list) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Extrai center_/scale_ dos escalonadores e coef_/intercept_ do classificador, com os
+    escalonadores compostos num único (x - centro) / escala. Lança ValueError se o pipeline
+    não for escalonador(es) + LogisticRegression binária
+    """
+    passos = [passo for _, passo in getattr(pipeline, 'steps', [])]
+    if not passos:
+        raise ValueError("O artefato não é um sklearn Pipeline")
+
+    *escalonadores, classificador = passos
+    coef = getattr(classificador, 'coef_', None)
+    intercepto = getattr(classificador, 'intercept_', None)
+    classes = getattr(classificador, 'classes_', None)
+    if coef is None or intercepto is None or type(classificador).__name__ != 'LogisticRegression':
+        raise ValueError(f"Classificador não linear: {type(classificador).__name__}")
+    if coef.shape != (1, len(features)) or classes is None or len(classes) != 2:
+        raise ValueError("Apenas LogisticRegression binária é suportada")
+
+    centro = np.zeros(len(features))
+    escala = np.ones(len(features))
+    for escalonador in escalonadores:
+        # RobustScaler expõe center_; StandardScaler expõe mean_ (ambos None quando desligados)
+        if type(escalonador).__name__ == 'RobustScaler':
+            c = escalonador.center_
+        elif type(escalonador).__name__ == 'StandardScaler':
+            c = escalonador.mean_
+        else:
+            raise ValueError(f"Etapa não suportada no pipeline: {type(escalonador).__name__}")
+        s = escalonador.scale_
+        nomes = getattr(escalonador, 'feature_names_in_', None)
+        if nomes is not None and list(nomes) != list(features):
+            raise ValueError("A ordem das colunas do escalonador difere de 'features'")
+        c = np.zeros(len(features)) if c is None else np.asarray(c, dtype=np.float64)
+        s = np.ones(len(features)) if s is None else np.asarray(s, dtype=np.float64)
+        # composição de transformações afins: ((x - centro)/escala - c)/s
+        centro = centro + c * escala
+        escala = escala * s
+
+    return centro, escala, np.asarray(coef[0], dtype=np.float64), float(intercepto[0])
+
+
+class ScorerLinear:
+    """
+    Scorer compilado para pipelines escalonador + LogisticRegression.
+
+    O escalonamento é dobrado nos coeficientes: coef·((x - centro) / escala) + b
+    vira pesos·x + intercepto, então pontuar um cliente é um produto escalar NumPy
+    sobre um vetor pré-alocado seguido de uma sigmoide.
+
+    A contribuição de cada feature para o log-odds é coef·(x - centro) / escala, ou
+    pesos·(x - centro): exata, e a soma delas mais intercepto + pesos·centro é o próprio logit
+    """
+    compilado = True
+
+    def __init__(self, pesos: np.ndarray, intercepto: float, features: list, centro: np.ndarray | None = None):
+        self.pesos = np.ascontiguousarray(pesos, dtype=np.float64)
+        self.intercepto = float(intercepto)
+        self.features = list(features)
+        self.centro = np.zeros(len(self.features)) if centro is None else np.asarray(centro, dtype=np.float64)
+        self._intercepto_centro = self.intercepto + float(self.pesos.dot(self.centro))
+        # para o caminho de um único cliente: com ~10 features, listas Python saem mais baratas que NumPy
+        self._termos = list(zip(self.features, self.pesos.tolist(), self.centro.tolist()))
+        # um buffer por thread: o scorer também é chamado a partir do threadpool
+        self._local = threading.local()
+
+    def __reduce__(self):
+        # o buffer por thread não é serializável: os processos do pontuar_lote recriam o scorer
+        return ScorerLinear, (self.pesos, self.intercepto, self.features, self.centro)
+
+    @classmethod
+    def dos_parametros(cls, centro: np.ndarray, escala: np.ndarray, coef: np.ndarray, intercepto: float,
+                       features: list) -> 'ScorerLinear':
+        """Dobra o escalonamento (x - centro) / escala nos coeficientes"""
+        pesos = np.asarray(coef, dtype=np.float64) / escala
+        return cls(pesos, float(intercepto) - float(np.dot(pesos, centro)), features, centro)
+
+    @classmethod
+    def do_pipeline(cls, pipeline, features: list) -> 'ScorerLinear':
+        """Lança ValueError se o pipeline não for linear"""
+        return cls.dos_parametros(*parametros_lineares(pipeline, features), features)
+
+    def _buffer(self) -> np.ndarray:
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty(len(self.features), dtype=np.float64)
+        return buffer
+
+    def proba_positiva(self, matriz: np.ndarray) -> np.ndarray:
+        """Probabilidade da classe 1 para uma matriz (n, features) na ordem de self.features"""
+        z = matriz @ self.pesos + self.intercepto
+        return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+    def proba_positiva_valores(self, valores: dict) -> float:
+        """Probabilidade da classe 1 para um único cliente a partir do dict de features"""
+        buffer = self._buffer()
+        for j, feature in enumerate(self.features):
+            buffer[j] = valores[feature]
+        return _sigmoide(float(self.pesos.dot(buffer)) + self.intercepto)
+
+    def proba_e_contribuicoes(self, matriz: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Probabilidade da classe 1 e contribuição de cada feature para o log-odds, (n, features)"""
+        contribuicoes = (matriz - self.centro) * self.pesos
+        z = contribuicoes.sum(axis=1) + self._intercepto_centro
+        return 0.5 * (1.0 + np.tanh(0.5 * z)), contribuicoes
+
+    def proba_e_contribuicoes_valores(self, valores: dict) -> tuple[float, list]:
+        """Versão de um único cliente: as contribuições saem da mesma passada que o score"""
+        contribuicoes = [peso * (valores[feature] - centro) for feature, peso, centro in self._termos]
+        return _sigmoide(math.fsum(contribuicoes) + self._intercepto_centro), contribuicoes
+
+
+class TabelaContribuicoes:
+    """
+    Contribuições aproximadas para modelos não lineares, pré-calculadas nos dados de referência.
+
+    Para cada feature, as faixas são os quantis da referência e o efeito de cada faixa é quanto
+    o log-odds médio da referência muda quando a feature assume o valor mediano da faixa
+    (dependência parcial). Consultar um cliente é um searchsorted por feature
+    """
+
+    def __init__(self, cortes: list, efeitos: list):
+        self.cortes = cortes
+        self.efeitos = efeitos
+
+    @classmethod
+    def da_referencia(cls, pipeline, features: list, matriz: np.ndarray, faixas: int = FAIXAS_CONTRIBUICOES,
+                      amostra: int = AMOSTRA_CONTRIBUICOES) -> 'TabelaContribuicoes':
+        linhas = matriz[np.linspace(0, len(matriz) - 1, min(amostra, len(matriz))).astype(int)]
+
+        import pandas as pd
+
+        def log_odds(m: np.ndarray) -> np.ndarray:
+            p = np.clip(pipeline.predict_proba(pd.DataFrame(m, columns=features))[:, 1], 1e-6, 1 - 1e-6)
+            return np.log(p / (1 - p))
+
+        cortes, valores_faixas, variacoes = [], [], []
+        for j in range(len(features)):
+            c = np.unique(np.quantile(matriz[:, j], np.linspace(0, 1, faixas + 1)[1:-1]))
+            faixa = np.searchsorted(c, matriz[:, j], side='right')
+            cortes.append(c)
+            # em features discretas a faixa abaixo do primeiro corte pode ficar vazia: usa o próprio corte
+            valores_faixas.append([np.median(matriz[faixa == b, j]) if np.any(faixa == b) else c[max(b - 1, 0)]
+                                   for b in range(len(c) + 1)])
+            for valor in valores_faixas[-1]:
+                variacao = linhas.copy()
+                variacao[:, j] = valor
+                variacoes.append(variacao)
+
+        # uma única chamada ao pipeline para todas as faixas de todas as features
+        base = log_odds(linhas).mean()
+        medias = log_odds(np.concatenate(variacoes)).reshape(-1, len(linhas)).mean(axis=1) - base
+        efeitos, inicio = [], 0
+        for valores in valores_faixas:
+            efeitos.append(medias[inicio:inicio + len(valores)])
+            inicio += len(valores)
+        return cls(cortes, efeitos)
+
+    def contribuicoes(self, matriz: np.ndarray) -> np.ndarray:
+        saida = np.empty(matriz.shape, dtype=np.float64)
+        for j, (cortes, efeitos) in enumerate(zip(self.cortes, self.efeitos)):
+            saida[:, j] = efeitos[np.searchsorted(cortes, matriz[:, j], side='right')]
+        return saida
+
+
+class ScorerPipeline:
+    """
+    Fallback para artefatos que não são lineares: delega ao pipeline sklearn. As contribuições
+    vêm da TabelaContribuicoes, quando houver (None sem dados de referência)
+    """
+    compilado = False
+
+    def __init__(self, pipeline, features: list, tabela: TabelaContribuicoes | None = None):
+        self.pipeline = pipeline
+        self.features = list(features)
+        self.tabela = tabela
+
+    def proba_positiva(self, matriz: np.ndarray) -> np.ndarray:
+        import pandas as pd
+        return self.pipeline.predict_proba(pd.DataFrame(matriz, columns=self.features))[:, 1]
+
+    def proba_positiva_valores(self, valores: dict) -> float:
+        import pandas as pd
+        df = pd.DataFrame({feature: [valores[feature]] for feature in self.features})
+        return float(self.pipeline.predict_proba(df)[0][1])
+
+    def proba_e_contribuicoes(self, matriz: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        contribuicoes = self.tabela.contribuicoes(matriz) if self.tabela is not None else None
+        return self.proba_positiva(matriz), contribuicoes
+
+    def proba_e_contribuicoes_valores(self, valores: dict) -> tuple[float, list | None]:
+        matriz = np.array([[valores[feature] for feature in self.features]], dtype=np.float64)
+        proba, contribuicoes = self.proba_e_contribuicoes(matriz)
+        return float(proba[0]), None if contribuicoes is None else contribuicoes[0].tolist()
+
+
+def autoverificar(scorer: ScorerLinear, pipeline, matriz: np.ndarray) -> float:
+    """
+    Compara o scorer compilado com pipeline.predict_proba e devolve o maior desvio absoluto
+    """
+    import pandas as pd
+    esperado = pipeline.predict_proba(pd.DataFrame(matriz, columns=scorer.features))[:, 1]
+    return desvio_esperado(scorer, matriz, esperado)
+
+
+def desvio_esperado(scorer: ScorerLinear, matriz: np.ndarray, esperado: np.ndarray) -> float:
+    """
+    Maior desvio absoluto entre o scorer e as probabilidades `esperado` (do sklearn). Também
+    usado no carregamento do artefato compacto, cujo canário traz as probabilidades prontas
+    """
+    desvio = float(np.max(np.abs(scorer.proba_positiva(matriz) - esperado)))
+
+    # confere também o caminho de um único cliente, usado pelo /predict, e o das contribuições
+    desvio = max(desvio, float(np.max(np.abs(scorer.proba_e_contribuicoes(matriz)[0] - esperado))))
+    for i in range(min(len(matriz), 50)):
+        valores = dict(zip(scorer.features, matriz[i]))
+        desvio = max(desvio, abs(scorer.proba_positiva_valores(valores) - esperado[i]),
+                     abs(scorer.proba_e_contribuicoes_valores(valores)[0] - esperado[i]))
+    return desvio
+
+
+def scorer_pipeline(pipeline, features: list, matriz: np.ndarray | None) -> ScorerPipeline:
+    """ScorerPipeline com a tabela de contribuições calculada na matriz de referência, se houver"""
+    tabela = None
+    if matriz is not None:
+        try:
+            tabela = TabelaContribuicoes.da_referencia(pipeline, features, matriz)
+        except Exception as e:
+            logger.warning("Tabela de contribuições indisponível", extra={'erro': str(e)})
+    return ScorerPipeline(pipeline, features, tabela)
+
+
+def criar_scorer(pipeline, features: list, referencia):
+    """
+    Compila o pipeline num ScorerLinear e valida contra o sklearn nos dados de referência
+    (data/dados_credito_processados.parquet). Se o artefato não for linear, se não houver
+    referência ou se a validação falhar, usa o ScorerPipeline
+    """
+    matriz = matriz_features(calcular_features_tabela(referencia), features) if referencia is not None else None
+    try:
+        scorer = ScorerLinear.do_pipeline(pipeline, features)
+    except ValueError as e:
+        logger.warning("Scorer compilado indisponível; usando o pipeline sklearn", extra={'motivo': str(e)})
+        return scorer_pipeline(pipeline, features, matriz)
+
+    if matriz is None:
+        logger.warning("Sem dados de referência para autoverificar o scorer compilado; usando o pipeline sklearn")
+        return ScorerPipeline(pipeline, features)
+
+    desvio = autoverificar(scorer, pipeline, matriz)
+    if not desvio <= TOLERANCIA_AUTOVERIFICACAO:
+        logger.warning("Scorer compilado diverge do pipeline; usando o pipeline sklearn", extra={'desvio': desvio})
+        return scorer_pipeline(pipeline, features, matriz)
+
+    logger.info("Scorer compilado validado", extra={'linhas': len(matriz), 'desvio_maximo': desvio})
+    return scorer
@@ -0,0 +1,394 @@
+"""
+Servidor pré-fork para produção: um processo mestre importa o app e carrega o modelo uma vez e
+cria um worker uvicorn por núcleo com fork(). O código e o modelo ficam em páginas
+compartilhadas (copy-on-write) entre os workers, em vez de uma cópia por worker.
+
+- O orçamento global de conexões com o banco (DB_CONEXOES_TOTAL) é dividido entre os workers,
+  com folga para um worker a mais durante o reload. Os pools não usam overflow: sob pico, o
+  request espera uma conexão do pool (DB_POOL_TIMEOUT) em vez de abrir outra.
+- Os workers sobem um de cada vez, cada um só depois que o anterior terminou o lifespan, e os
+  engines herdados do mestre são descartados após o fork (sem compartilhar sockets).
+- O mestre observa o arquivo ATUAL do registro (e atende SIGHUP): carrega a nova versão uma vez
+  e troca os workers um a um, cada novo só entra antes de o antigo sair. Um worker que morre é
+  recriado.
+- A cada SERVIDOR_ESTADO_SEGUNDOS o mestre registra a memória (RSS/PSS/USS) e as conexões com o
+  banco de cada worker.
+- As métricas usam o modo multiprocesso do prometheus_client: cada worker grava as suas em
+  PROMETHEUS_MULTIPROC_DIR (limpo na partida) e o /metrics de qualquer worker soma todos. Quando
+  um worker sai, o mestre descarta os gauges dele; os contadores continuam somando.
+
+Uso (a partir de app/backend):
+    python migrar.py
+    python servidor.py                              # um worker por núcleo, porta 8000
+    python servidor.py --workers 16 --porta 8080 --conexoes-total 180
+    kill -HUP <pid do mestre>                       # recarrega o modelo e troca os workers
+"""
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SERVIDOR_TIMEOUT_INICIO = float(os.getenv("SERVIDOR_TIMEOUT_INICIO", "60"))
+SERVIDOR_TIMEOUT_ENCERRAMENTO = float(os.getenv("SERVIDOR_TIMEOUT_ENCERRAMENTO", "30"))
+SERVIDOR_ESTADO_SEGUNDOS = float(os.getenv("SERVIDOR_ESTADO_SEGUNDOS", "60"))
+# Espera máxima entre recriações seguidas de um worker que não sobe
+SERVIDOR_ESPERA_MAXIMA = 30.0
+
+
+def orcamento_conexoes(total: int, workers: int) -> dict:
+    """
+    Divide `total` conexões entre os workers, reservando um worker a mais para o reload.
+    O engine síncrono (fila de gravação de predictions e alocador de ids) fica com 1 ou 2, e o
+    auxiliar (manutenção e arquivamento de partições, índice da simulação de threshold e fila do
+    desafiante) com 1 própria: uma leitura de um mês inteiro nunca segura o flush nem a reserva de
+    ids. O resto vai para o pool dos endpoints. Lança ValueError se não couberem 3 conexões por worker
+    """
+    por_worker = total // (workers + 1)
+    if por_worker < 3:
+        raise ValueError(f"DB_CONEXOES_TOTAL={total} não comporta {workers} workers "
+                         f"(mínimo de 3 conexões por worker, {3 * (workers + 1)} no total)")
+    sincrono = 1 if por_worker < 5 else 2
+    return {
+        'DB_POOL_SIZE': por_worker - sincrono - 1,
+        'DB_MAX_OVERFLOW': 0,
+        'DB_SYNC_POOL_SIZE': 1,
+        'DB_SYNC_MAX_OVERFLOW': sincrono - 1,
+        'DB_AUX_POOL_SIZE': 1,
+        'DB_AUX_MAX_OVERFLOW': 0,
+    }
+
+
+def conexoes_banco(pid: int, porta: int | None) -> int | None:
+    """Conexões TCP abertas pelo processo com a porta do banco (None para SQLite)"""
+    import psutil
+    if porta is None:
+        return None
+    try:
+        return sum(1 for c in psutil.Process(pid).net_connections(kind='tcp') if c.raddr and c.raddr.port == porta)
+    except psutil.Error:
+        return None
+
+
+class Mestre:
+    """Cria, supervisiona, recarrega e encerra os workers. Roda só no processo mestre"""
+
+    def __init__(self, api, ouvinte: socket.socket, workers: int, observar_segundos: float,
+                 porta_banco: int | None, config_uvicorn: dict):
+        self.api = api
+        self.registro = api.registro
+        self.ouvinte = ouvinte
+        self.quantidade = workers
+        self.observar_segundos = observar_segundos
+        self.porta_banco = porta_banco
+        self.config_uvicorn = config_uvicorn
+
+        self.workers = {}  # pid -> instante de criação
+        self._encerrando = set()
+        self._sinais = []
+        self._falhas_seguidas = 0
+        self._falha_observada = None
+
+    # ---------------------------------------------------------------- workers
+    def _executar_worker(self, escrita: int):
+        """Processo filho: descarta o estado herdado que não pode ser compartilhado e serve"""
+        import uvicorn
+        from database import async_engine, engine, engine_auxiliar
+
+        for sinal in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sinal, signal.SIG_DFL)
+        gc.enable()
+        # o import foi pago uma vez, no mestre: no worker, a primeira predição conta a partir do fork
+        self.api.INICIO_IMPORTACAO = time.perf_counter()
+        # as conexões (se houver) pertencem ao mestre: close=False só esquece o pool, sem fechá-las
+        engine.dispose(close=False)
+        engine_auxiliar.dispose(close=False)
+        async_engine.sync_engine.dispose(close=False)
+
+        class ServidorWorker(uvicorn.Server):
+            async def startup(self, sockets=None):
+                await super().startup(sockets=sockets)
+                # lifespan concluído e socket aceitando: avisa o mestre
+                os.write(escrita, b'1')
+                os.close(escrita)
+
+        servidor = ServidorWorker(uvicorn.Config(self.api.app, **self.config_uvicorn))
+        servidor.run(sockets=[self.ouvinte])
+
+    def _criar_worker(self) -> int | None:
+        """Faz o fork e espera o worker ficar pronto. Devolve o pid, ou None se ele não subir"""
+        leitura, escrita = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(leitura)
+            codigo = 1
+            try:
+                self._executar_worker(escrita)
+                codigo = 0
+            except BaseException:
+                logger.exception("Worker encerrado com erro")
+            finally:
+                os._exit(codigo)
+
+        os.close(escrita)
+        inicio = time.monotonic()
+        try:
+            prontos, _, _ = select.select([leitura], [], [], SERVIDOR_TIMEOUT_INICIO)
+            pronto = bool(prontos) and os.read(leitura, 1) == b'1'
+        finally:
+            os.close(leitura)
+        if not pronto:
+            logger.error("Worker não ficou pronto", extra={'pid': pid, 'timeout_segundos': SERVIDOR_TIMEOUT_INICIO})
+            self._parar_worker(pid, signal.SIGKILL)
+            return None
+
+        self.workers[pid] = time.monotonic()
+        logger.info("Worker pronto", extra={'pid': pid, 'inicio_ms': round((time.monotonic() - inicio) * 1000, 1)})
+        return pid
+
+    def _parar_worker(self, pid: int, sinal=signal.SIGTERM, esperar: bool = True):
+        """Encerramento gracioso: o uvicorn termina os requests em andamento e o lifespan esvazia as filas"""
+        self.workers.pop(pid, None)
+        self._encerrando.add(pid)
+        try:
+            os.kill(pid, sinal)
+        except ProcessLookupError:
+            pass
+        if not esperar:
+            return
+        limite = time.monotonic() + SERVIDOR_TIMEOUT_ENCERRAMENTO + 5
+        while pid in self._encerrando and time.monotonic() < limite:
+            self._recolher()
+            time.sleep(0.05)
+        if pid in self._encerrando:
+            logger.warning("Worker não encerrou a tempo; enviando SIGKILL", extra={'pid': pid})
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._worker_saiu(pid)
+            self._encerrando.discard(pid)
+
+    @staticmethod
+    def _worker_saiu(pid: int):
+        # importado só aqui: o prometheus_client escolhe o modo multiprocesso no próprio import
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+    def _recolher(self):
+        """Recolhe os filhos que terminaram; os que não estavam sendo encerrados são recriados no laço"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._worker_saiu(pid)
+            if pid in self._encerrando:
+                self._encerrando.discard(pid)
+            elif self.workers.pop(pid, None) is not None:
+                logger.warning("Worker terminou inesperadamente",
+                               extra={'pid': pid, 'codigo': os.waitstatus_to_exitcode(status)})
+
+    def _completar(self):
+        """Recria workers até a quantidade configurada, com espera crescente se eles não sobem"""
+        while len(self.workers) < self.quantidade and not self._sinais:
+            if self._criar_worker() is None:
+                self._falhas_seguidas += 1
+                time.sleep(min(2 ** self._falhas_seguidas, SERVIDOR_ESPERA_MAXIMA))
+            else:
+                self._falhas_seguidas = 0
+
+    # --------------------------------------------------------------- modelo
+    def recarregar(self):
+        """
+        Carrega a versão desejada no mestre (uma vez, para todos) e troca os workers um a um.
+        Se a versão for inválida, os workers atuais continuam servindo a anterior
+        """
+        versao = self.registro.versao_desejada()
+        assinatura = self.registro.assinatura(versao)
+        try:
+            modelo = self.registro.ativar(versao)
+        except Exception as e:
+            # tentada de novo só quando os artefatos da versão mudarem (correção no lugar)
+            self._falha_observada = assinatura
+            logger.warning("Falha ao recarregar o modelo; os workers seguem na versão atual",
+                           extra={'versao': versao, 'erro': str(e)})
+            return
+        self._falha_observada = None
+        gc.freeze()
+
+        antigos = list(self.workers)
+        for pid in antigos:
+            if self._criar_worker() is None:
+                logger.error("Reload interrompido: novo worker não subiu", extra={'versao': modelo.versao})
+                return
+            self._parar_worker(pid)
+        logger.info("Workers trocados", extra={'versao': modelo.versao, 'workers': len(self.workers)})
+
+    def _observar(self):
+        versao = self.registro.versao_desejada()
+        atual = self.registro.atual
+        if atual is not None and versao != atual.versao \
+                and self.registro.assinatura(versao) != self._falha_observada:
+            logger.info("Nova versão no registro", extra={'versao': versao, 'anterior': atual.versao})
+            self.recarregar()
+
+    # ---------------------------------------------------------------- estado
+    def estado(self) -> dict:
+        from metricas import memoria_processo
+
+        workers = []
+        for pid in sorted(self.workers):
+            memoria = memoria_processo(pid)
+            workers.append({
+                'pid': pid,
+                **{f'{tipo}_mb': round(valor / 2 ** 20, 1) for tipo, valor in memoria.items()},
+                'conexoes_banco': conexoes_banco(pid, self.porta_banco),
+            })
+        mestre = memoria_processo()
+        return {
+            'workers': workers,
+            'mestre_rss_mb': round(mestre.get('rss', 0) / 2 ** 20, 1),
+            'pss_total_mb': round(sum(w.get('pss_mb', 0) for w in workers) + mestre.get('pss', 0) / 2 ** 20, 1),
+            'conexoes_banco_total': sum(w['conexoes_banco'] or 0 for w in workers),
+        }
+
+    # ------------------------------------------------------------------ laço
+    def _ao_sinal(self, sinal, _quadro):
+        self._sinais.append(sinal)
+
+    def executar(self):
+        for sinal in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sinal, self._ao_sinal)
+
+        # tudo que já existe (app, modelo) vai para a geração permanente: o GC dos workers não toca
+        # nesses objetos, então as páginas continuam compartilhadas
+        gc.freeze()
+        self._completar()
+        logger.info("Servidor pronto", extra={'workers': len(self.workers), **self.estado()})
+
+        proximo_estado = time.monotonic() + SERVIDOR_ESTADO_SEGUNDOS
+        proxima_observacao = time.monotonic() + self.observar_segundos
+        while True:
+            while self._sinais:
+                sinal = self._sinais.pop(0)
+                if sinal == signal.SIGHUP:
+                    logger.info("SIGHUP: recarregando o modelo e trocando os workers")
+                    self.recarregar()
+                else:
+                    self.encerrar()
+                    return
+
+            self._recolher()
+            self._completar()
+            agora = time.monotonic()
+            if self.observar_segundos > 0 and agora >= proxima_observacao:
+                proxima_observacao = agora + self.observar_segundos
+                try:
+                    self._observar()
+                except Exception as e:
+                    logger.warning("Falha ao verificar o registro de modelos", extra={'erro': str(e)})
+            if SERVIDOR_ESTADO_SEGUNDOS > 0 and agora >= proximo_estado:
+                proximo_estado = agora + SERVIDOR_ESTADO_SEGUNDOS
+                logger.info("Estado dos workers", extra=self.estado())
+            time.sleep(0.2)
+
+    def encerrar(self):
+        logger.info("Encerrando os workers", extra={'workers': len(self.workers)})
+        pids = list(self.workers)
+        for pid in pids:
+            self._parar_worker(pid, esperar=False)
+        limite = time.monotonic() + SERVIDOR_TIMEOUT_ENCERRAMENTO + 5
+        while self._encerrando and time.monotonic() < limite:
+            self._recolher()
+            time.sleep(0.05)
+        for pid in list(self._encerrando):
+            logger.warning("Worker não encerrou a tempo; enviando SIGKILL", extra={'pid': pid})
+            os.kill(pid, signal.SIGKILL)
+        self.ouvinte.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor pré-fork da API (um worker uvicorn por núcleo)")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv("SERVIDOR_WORKERS", len(os.sched_getaffinity(0))
+                                              if hasattr(os, 'sched_getaffinity') else os.cpu_count())))
+    parser.add_argument('--host', default=os.getenv("SERVIDOR_HOST", "0.0.0.0"))
+    parser.add_argument('--porta', type=int, default=int(os.getenv("SERVIDOR_PORTA", "8000")))
+    parser.add_argument('--conexoes-total', type=int, default=int(os.getenv("DB_CONEXOES_TOTAL", "90")),
+                        help="Conexões com o banco somando todos os workers (abaixo do max_connections)")
+    parser.add_argument('--backlog', type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    # o orçamento precisa estar no ambiente antes do import do database, que cria os engines
+    orcamento = orcamento_conexoes(args.conexoes_total, args.workers)
+    os.environ.update({nome: str(valor) for nome, valor in orcamento.items()})
+    # um processo por núcleo: threads do BLAS em cada worker só disputariam os mesmos núcleos
+    for variavel in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ.setdefault(variavel, '1')
+
+    # métricas de todos os workers num só /metrics; o diretório precisa estar no ambiente antes do
+    # import do prometheus_client, e os arquivos de uma execução anterior não podem entrar na soma
+    diretorio_metricas = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if diretorio_metricas:
+        Path(diretorio_metricas).mkdir(parents=True, exist_ok=True)
+        for arquivo in Path(diretorio_metricas).glob('*.db'):
+            arquivo.unlink()
+    else:
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='metricas-credito-')
+
+    # sem coletas no mestre, os objetos carregados antes do fork não deixam buracos nas páginas
+    gc.disable()
+    import main as api
+    from database import DATABASE_URL, engine
+    from sqlalchemy.engine import make_url
+
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() == 'sqlite' and args.workers > 1:
+        # o AlocadorIds só reserva blocos exclusivos entre processos com a sequência do PostgreSQL
+        raise SystemExit("SQLite não suporta vários workers: os ids das predições colidiriam (use --workers 1)")
+    porta_banco = None if url.get_backend_name() == 'sqlite' else (url.port or 5432)
+    logger.info("Orçamento de conexões com o banco", extra={
+        'total': args.conexoes_total, 'workers': args.workers, 'reserva_reload': 1,
+        'por_worker': sum(valor for nome, valor in orcamento.items() if nome != 'DB_MAX_OVERFLOW'),
+        **{nome.lower(): valor for nome, valor in orcamento.items()},
+    })
+
+    # schema e modelo uma vez, no mestre; os workers herdam o modelo e não observam o registro
+    if api.PREPARAR_SCHEMA:
+        api.preparar_schema()
+        api.PREPARAR_SCHEMA = False
+        engine.dispose()
+    modelo = api.registro.ativar()
+    logger.info("Modelo carregado no mestre", extra={'versao': modelo.versao, 'formato': modelo.formato})
+    if api.DRIFT_CAPACIDADE > 0:
+        # a referência do drift (e o pandas, que a lê) também fica nas páginas compartilhadas;
+        # cada worker só recebe a referência do score e inicia a própria thread
+        try:
+            api.drift['preparado'] = api.criar_monitor_drift()
+        except Exception as e:
+            logger.warning("Monitor de drift não preparado no mestre", extra={'erro': str(e)})
+    observar_segundos, api.MODELO_OBSERVAR_SEGUNDOS = api.MODELO_OBSERVAR_SEGUNDOS, 0
+
+    ouvinte = socket.create_server((args.host, args.porta), backlog=args.backlog)
+    config_uvicorn = {
+        'lifespan': 'on',
+        'access_log': False,
+        # os logs do uvicorn seguem pelo handler JSON de logs.py
+        'log_config': None,
+        'timeout_graceful_shutdown': SERVIDOR_TIMEOUT_ENCERRAMENTO,
+    }
+    logger.info("Servidor pré-fork escutando", extra={'host': args.host, 'porta': args.porta, 'pid': os.getpid(),
+                                                      'metricas_dir': os.environ['PROMETHEUS_MULTIPROC_DIR']})
+    Mestre(api, ouvinte, args.workers, observar_segundos, porta_banco, config_uvicorn).executar()
+
+
+if __name__ == '__main__':
+    main()
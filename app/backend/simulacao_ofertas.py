@@ -0,0 +1,161 @@
+"""
+Simulação de ofertas para um cliente: "quanto ele pode tomar em cada prazo?".
+
+A grade prazo × valor inteira (mais a curva de risco no prazo pedido e a própria oferta pedida)
+vira uma única matriz de features, calculada por calcular_features com as fórmulas de
+preparar_dados_modelo, e é pontuada com uma única chamada ao scorer. O maior valor aprovável de
+cada prazo parte do maior valor aprovado na grade e é refinado por bisseção até o primeiro
+valor reprovado acima dele, com todos os prazos avançando juntos a cada passo. Nada é gravado:
+a simulação não entra no histórico, nas métricas de decisão, no drift nem no desafiante.
+"""
+import numpy as np
+
+from features import calcular_features, matriz_features
+
+# limite de passos da bisseção: com a precisão mínima de R$ 0,01 sobra folga para valores de bilhões
+MAXIMO_ITERACOES_BISSECAO = 50
+
+
+def pontuar_ofertas(scorer, features: list, cliente: dict, prazos, valores) -> np.ndarray:
+    """
+    probabilidade_risco (1 - proba de bom pagador) de cada oferta (prazos[i], valores[i]) para
+    um mesmo cliente. Os dados do cliente entram como escalares e são propagados pelo NumPy
+    """
+    dados = calcular_features(
+        idade=cliente['idade'],
+        valor_conta_poupanca=cliente['valor_conta_poupanca'],
+        valor_conta_corrente=cliente['valor_conta_corrente'],
+        salario_anual=cliente['salario_anual'],
+        valor_emprestimo=valores,
+        prazo_meses=prazos,
+        situacao_moradia=cliente['situacao_moradia'],
+    )
+    return 1 - scorer.proba_positiva(matriz_features(dados, features))
+
+
+def valor_maximo_aprovavel(scorer, features: list, threshold: float, cliente: dict, prazos: np.ndarray,
+                           valores: np.ndarray, risco: np.ndarray, precisao: float = 1.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Maior valor aprovável de cada prazo a partir do risco da grade (len(prazos), len(valores)),
+    com valores crescentes. O ponto de partida é o maior valor aprovado da grade; se há um valor
+    reprovado acima dele, a bisseção estreita o intervalo até `precisao`. Devolve os valores e o
+    risco em cada um, com NaN nos prazos sem nenhum valor aprovado na grade.
+
+    A busca fica entre pontos da grade: se o risco não cresce com o valor, um valor aprovado
+    além do primeiro reprovado não é procurado
+    """
+    aprovado = risco < threshold
+    tem_aprovado = aprovado.any(axis=1)
+    ultimo = len(valores) - 1
+    # índice do maior valor aprovado em cada prazo
+    indice = ultimo - np.argmax(aprovado[:, ::-1], axis=1)
+    maximo = np.where(tem_aprovado, valores[indice], np.nan)
+    risco_maximo = np.where(tem_aprovado, risco[np.arange(len(prazos)), indice], np.nan)
+
+    refinar = tem_aprovado & (indice < ultimo)
+    if refinar.any():
+        prazos_busca = prazos[refinar]
+        baixo = valores[indice[refinar]]
+        alto = valores[indice[refinar] + 1]
+        risco_baixo = risco_maximo[refinar]
+        for _ in range(MAXIMO_ITERACOES_BISSECAO):
+            if (alto - baixo).max() <= precisao:
+                break
+            meio = (baixo + alto) / 2
+            risco_meio = pontuar_ofertas(scorer, features, cliente, prazos_busca, meio)
+            ok = risco_meio < threshold
+            baixo = np.where(ok, meio, baixo)
+            risco_baixo = np.where(ok, risco_meio, risco_baixo)
+            alto = np.where(ok, alto, meio)
+        maximo[refinar] = baixo
+        risco_maximo[refinar] = risco_baixo
+    return maximo, risco_maximo
+
+
+def _oferta(prazo, valor, risco, threshold) -> dict:
+    return {
+        'prazo_meses': int(prazo),
+        'valor_emprestimo': round(float(valor), 2),
+        'parcela_mensal_estimada': round(float(valor) / int(prazo), 2),
+        'resultado': "Aprovado" if risco < threshold else "Reprovado",
+        'probabilidade_risco': round(float(risco), 4),
+    }
+
+
+def simular_grade(scorer, features: list, threshold: float, cliente: dict, prazos: np.ndarray,
+                  valores: np.ndarray, precisao: float = 1.0) -> dict:
+    """
+    Superfície de aprovação na grade prazos × valores, maior valor aprovável por prazo e curva de
+    risco por valor no prazo pedido (cliente['prazo_meses']). `cliente` é o ClienteInput já
+    validado; o valor e o prazo dele são a oferta pedida, pontuada na mesma chamada
+    """
+    prazos = np.asarray(prazos, dtype=np.float64)
+    valores = np.asarray(valores, dtype=np.float64)
+    n_prazos, n_valores = len(prazos), len(valores)
+    prazo_grade, valor_grade = np.meshgrid(prazos, valores, indexing='ij')
+
+    # grade, curva de risco e oferta pedida numa só matriz
+    todos_prazos = np.concatenate([prazo_grade.ravel(), np.full(n_valores, cliente['prazo_meses']),
+                                   [cliente['prazo_meses']]])
+    todos_valores = np.concatenate([valor_grade.ravel(), valores, [cliente['valor_emprestimo']]])
+    risco_todos = pontuar_ofertas(scorer, features, cliente, todos_prazos, todos_valores)
+    risco = risco_todos[:n_prazos * n_valores].reshape(n_prazos, n_valores)
+    curva = risco_todos[n_prazos * n_valores:-1]
+
+    maximo, risco_maximo = valor_maximo_aprovavel(scorer, features, threshold, cliente, prazos, valores,
+                                                  risco, precisao)
+
+    return {
+        'threshold_utilizado': round(float(threshold), 4),
+        'oferta_solicitada': _oferta(cliente['prazo_meses'], cliente['valor_emprestimo'], risco_todos[-1], threshold),
+        'prazos': prazos.astype(int).tolist(),
+        'valores': np.round(valores, 2).tolist(),
+        # linhas = prazos, colunas = valores
+        'probabilidade_risco': np.round(risco, 4).tolist(),
+        'aprovado': (risco < threshold).tolist(),
+        'valor_maximo_aprovavel': [
+            {'prazo_meses': int(prazo), 'valor_emprestimo': None, 'parcela_mensal_estimada': None,
+             'probabilidade_risco': None}
+            if np.isnan(valor) else
+            {'prazo_meses': int(prazo), 'valor_emprestimo': round(float(valor), 2),
+             'parcela_mensal_estimada': round(float(valor) / prazo, 2),
+             'probabilidade_risco': round(float(risco_valor), 4)}
+            for prazo, valor, risco_valor in zip(prazos, maximo, risco_maximo)
+        ],
+        'curva_risco': {
+            'prazo_meses': int(cliente['prazo_meses']),
+            'valores': np.round(valores, 2).tolist(),
+            'probabilidade_risco': np.round(curva, 4).tolist(),
+        },
+    }
+
+
+def simular_lista(scorer, features: list, threshold: float, cliente: dict, ofertas: list[dict]) -> dict:
+    """
+    Pontua uma lista de ofertas candidatas ({prazo_meses, valor_emprestimo}) numa única chamada.
+    O maior valor aprovável de cada prazo é o maior valor aprovado entre as ofertas dele
+    """
+    prazos = np.array([oferta['prazo_meses'] for oferta in ofertas], dtype=np.float64)
+    valores = np.array([oferta['valor_emprestimo'] for oferta in ofertas], dtype=np.float64)
+    risco = pontuar_ofertas(scorer, features, cliente, np.append(prazos, cliente['prazo_meses']),
+                            np.append(valores, cliente['valor_emprestimo']))
+    risco, risco_solicitada = risco[:-1], risco[-1]
+
+    maximos = {}
+    for prazo, valor, risco_oferta in zip(prazos, valores, risco):
+        atual = maximos.get(int(prazo))
+        if risco_oferta < threshold and (atual is None or valor > atual[0]):
+            maximos[int(prazo)] = (valor, risco_oferta)
+
+    return {
+        'threshold_utilizado': round(float(threshold), 4),
+        'oferta_solicitada': _oferta(cliente['prazo_meses'], cliente['valor_emprestimo'], risco_solicitada, threshold),
+        'ofertas': [_oferta(prazo, valor, risco_oferta, threshold)
+                    for prazo, valor, risco_oferta in zip(prazos, valores, risco)],
+        'valor_maximo_aprovavel': [
+            {'prazo_meses': prazo, 'valor_emprestimo': round(float(valor), 2),
+             'parcela_mensal_estimada': round(float(valor) / prazo, 2),
+             'probabilidade_risco': round(float(risco_oferta), 4)}
+            for prazo, (valor, risco_oferta) in sorted(maximos.items())
+        ],
+    }
@@ -0,0 +1,271 @@
+"""
+Simulação de threshold sobre o histórico: "qual seria a taxa de aprovação com threshold X?".
+
+As predições gravadas são lidas uma vez, em blocos, e condensadas num índice de contagens por
+(situação de moradia, faixa de idade, faixa de valor, resultado gravado, score). Como
+probabilidade_risco é gravada com 4 casas, cada um dos 10.001 valores possíveis tem o seu contador:
+o índice é exato, não um histograma aproximado. Cada consulta lê só as predições gravadas
+desde a anterior e responde qualquer lista de thresholds com somas acumuladas. Os meses já
+arquivados em Parquet (particoes.py) entram na primeira leitura.
+
+Uso (a partir de app/backend):
+    python simulacao_threshold.py 0.30 0.35 0.40
+    python simulacao_threshold.py 0.35 --cache indice_scores.npz
+"""
+import argparse
+import json
+import threading
+from datetime import datetime, timedelta
+from itertools import chain
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import Float, Integer, case, cast, func, or_, select
+
+# probabilidade_risco é gravada com 4 casas: 0.0000, 0.0001, ..., 1.0000
+ESCALA_SCORE = 10_000
+NIVEIS_SCORE = ESCALA_SCORE + 1
+
+MORADIAS = ('own', 'rent', 'free')
+RESULTADOS = ('Aprovado', 'Reprovado')
+# limites superiores (inclusive) de cada faixa; a última faixa é aberta
+LIMITES_IDADE = (25, 35, 45, 60)
+LIMITES_VALOR_EMPRESTIMO = (2000, 5000, 10000)
+FAIXAS_IDADE = ('18-25', '26-35', '36-45', '46-60', '61+')
+FAIXAS_VALOR_EMPRESTIMO = ('até 2000', '2000-5000', '5000-10000', 'acima de 10000')
+
+# predições com timestamp mais recente que isso ainda podem estar na fila de gravação
+MARGEM_GRAVACAO_SEGUNDOS = 60
+
+
+def _taxa(aprovados, total):
+    return round(aprovados / total * 100, 2) if total > 0 else 0
+
+
+class IndiceScores:
+    """
+    Contagens de predições por segmento e score, estendidas incrementalmente.
+
+    Cobre as predições com timestamp anterior a `corte`. Cada atualização lê só a janela
+    [corte, agora - margem), usando o índice em timestamp de predictions. A margem cobre as
+    linhas que ainda estão na fila de gravação quando a consulta roda
+    """
+
+    def __init__(self, margem_segundos: float = MARGEM_GRAVACAO_SEGUNDOS):
+        self.margem = timedelta(seconds=margem_segundos)
+        self.contagens = np.zeros((len(MORADIAS), len(FAIXAS_IDADE), len(FAIXAS_VALOR_EMPRESTIMO),
+                                   len(RESULTADOS), NIVEIS_SCORE), dtype=np.int64)
+        self.corte: datetime | None = None
+        self.atualizado_em: datetime | None = None
+        self._acumulado = None
+        self._lock = threading.Lock()
+
+    @property
+    def linhas(self) -> int:
+        return int(self.contagens.sum())
+
+    # ---------------------------------------------------------------- construção
+    def _consulta(self, tabela, inicio: datetime | None, fim: datetime):
+        t = tabela.c
+        consulta = select(
+            case(*((t.situacao_moradia == m, i) for i, m in enumerate(MORADIAS)), else_=-1),
+            t.idade,
+            cast(t.valor_emprestimo, Float),
+            case((t.resultado == RESULTADOS[0], 0), else_=1),
+            cast(func.round(t.probabilidade_risco * ESCALA_SCORE), Integer),
+        ).where(t.timestamp < fim, t.probabilidade_risco.is_not(None), t.resultado.is_not(None))
+        if inicio is not None:
+            consulta = consulta.where(t.timestamp >= inicio)
+        return consulta
+
+    def atualizar(self, engine, tabela, arquivo=None, tamanho_bloco: int = 100_000,
+                  margem_segundos: float | None = None, pendente: datetime | None = None) -> int:
+        """
+        Soma ao índice as predições gravadas desde a última atualização; devolve quantas leu.
+        Na primeira, soma também os meses arquivados em `arquivo` (ArquivoPredicoes) e só lê do
+        banco o que vem depois deles. `margem_segundos` substitui a margem do índice nesta leitura,
+        e o corte nunca passa da predição mais antiga ainda na fila de gravação (`pendente`)
+        """
+        margem = self.margem if margem_segundos is None else timedelta(seconds=margem_segundos)
+        with self._lock:
+            return self._atualizar(engine, tabela, arquivo, tamanho_bloco, margem, pendente)
+
+    def _contar(self, novas: np.ndarray, colunas: np.ndarray):
+        """Soma em `novas` as linhas de `colunas` (moradia, idade, valor, aprovado, score)"""
+        moradia, idade, valor, aprovado, score = colunas.T
+        validas = (moradia >= 0) & (score >= 0) & (score < NIVEIS_SCORE)
+        posicao = np.ravel_multi_index((
+            moradia[validas].astype(np.intp),
+            np.searchsorted(LIMITES_IDADE, idade[validas], side='left'),
+            np.searchsorted(LIMITES_VALOR_EMPRESTIMO, valor[validas], side='left'),
+            aprovado[validas].astype(np.intp),
+            score[validas].astype(np.intp),
+        ), self.contagens.shape)
+        novas += np.bincount(posicao, minlength=novas.size)
+
+    def _contar_arquivo(self, novas: np.ndarray, arquivo) -> int:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        lidas = 0
+        for tabela in arquivo.blocos(colunas=['idade', 'valor_emprestimo', 'situacao_moradia', 'resultado',
+                                              'probabilidade_risco']):
+            tabela = tabela.filter(pc.field('probabilidade_risco').is_valid() & pc.field('resultado').is_valid())
+            colunas = np.column_stack([
+                pc.fill_null(pc.index_in(tabela['situacao_moradia'], value_set=pa.array(MORADIAS)), -1).to_numpy(),
+                tabela['idade'].to_numpy(),
+                tabela['valor_emprestimo'].to_numpy(),
+                pc.not_equal(tabela['resultado'], RESULTADOS[0]).to_numpy(),
+                np.round(tabela['probabilidade_risco'].to_numpy() * ESCALA_SCORE),
+            ]).astype(np.float64)
+            self._contar(novas, colunas)
+            lidas += len(colunas)
+        return lidas
+
+    def _atualizar(self, engine, tabela, arquivo, tamanho_bloco: int, margem: timedelta,
+                   pendente: datetime | None) -> int:
+        novo_corte = datetime.now() - margem
+        if pendente is not None and pendente < novo_corte:
+            novo_corte = pendente
+        if self.corte is not None and novo_corte <= self.corte:
+            return 0
+
+        novas = np.zeros(self.contagens.size, dtype=np.int64)
+        lidas = 0
+        inicio = self.corte
+        if inicio is None and arquivo is not None:
+            # o que está antes da fronteira do arquivo é lido só do Parquet (nunca duas vezes)
+            inicio = arquivo.fronteira
+            lidas += self._contar_arquivo(novas, arquivo)
+        with engine.connect() as conn:
+            resultado = conn.execution_options(yield_per=tamanho_bloco).execute(
+                self._consulta(tabela, inicio, novo_corte)
+            )
+            for bloco in resultado.partitions():
+                # fromiter evita o np.array(list[Row]), que consulta atributos de cada Row
+                colunas = np.fromiter(chain.from_iterable(bloco), dtype=np.float64,
+                                      count=5 * len(bloco)).reshape(-1, 5)
+                self._contar(novas, colunas)
+                lidas += len(colunas)
+
+        self.contagens += novas.reshape(self.contagens.shape)
+        self.corte = novo_corte
+        self.atualizado_em = datetime.now()
+        self._acumulado = None
+        return lidas
+
+    # ------------------------------------------------------------------ consulta
+    def simular(self, thresholds: list[float]) -> dict:
+        """Taxa de aprovação geral e por segmento para cada threshold, mais as decisões que mudariam"""
+        with self._lock:
+            return self._simular(thresholds)
+
+    def _simular(self, thresholds: list[float]) -> dict:
+        if self._acumulado is None:
+            # acumulado[..., k] = predições com score < k / ESCALA_SCORE
+            self._acumulado = np.concatenate(
+                [np.zeros(self.contagens.shape[:-1] + (1,), dtype=np.int64),
+                 np.cumsum(self.contagens, axis=-1)], axis=-1
+            )
+        acumulado = self._acumulado
+
+        por_segmento = self.contagens.sum(axis=-1)
+        total = int(por_segmento.sum())
+        aprovados_gravados = int(por_segmento[..., 0].sum())
+
+        simulacoes = []
+        valores_score = np.arange(NIVEIS_SCORE) / ESCALA_SCORE
+        for threshold in thresholds:
+            # mesma regra do /predict: aprovado se probabilidade_risco < threshold
+            k = int(np.searchsorted(valores_score, threshold, side='left'))
+            aprovados = acumulado[..., k]                         # (moradia, idade, valor, resultado)
+            aprovado_para_reprovado = int(por_segmento[..., 0].sum() - aprovados[..., 0].sum())
+            reprovado_para_aprovado = int(aprovados[..., 1].sum())
+
+            def segmento(eixo: int, rotulos: tuple) -> dict:
+                outros = tuple(i for i in range(aprovados.ndim) if i != eixo)
+                aprovados_eixo = aprovados.sum(axis=outros)
+                total_eixo = por_segmento.sum(axis=outros)
+                return {
+                    rotulo: {'total': int(total_eixo[i]), 'aprovados': int(aprovados_eixo[i]),
+                             'taxa_aprovacao': _taxa(int(aprovados_eixo[i]), int(total_eixo[i]))}
+                    for i, rotulo in enumerate(rotulos) if total_eixo[i] > 0
+                }
+
+            aprovados_total = int(aprovados.sum())
+            taxa_aprovacao = _taxa(aprovados_total, total)
+            simulacoes.append({
+                'threshold': threshold,
+                'aprovados': aprovados_total,
+                'reprovados': total - aprovados_total,
+                'taxa_aprovacao': taxa_aprovacao,
+                'variacao_taxa_aprovacao': round(taxa_aprovacao - _taxa(aprovados_gravados, total), 2),
+                'por_moradia': segmento(0, MORADIAS),
+                'por_faixa_idade': segmento(1, FAIXAS_IDADE),
+                'por_faixa_valor_emprestimo': segmento(2, FAIXAS_VALOR_EMPRESTIMO),
+                'decisoes_alteradas': {
+                    'total': aprovado_para_reprovado + reprovado_para_aprovado,
+                    'aprovado_para_reprovado': aprovado_para_reprovado,
+                    'reprovado_para_aprovado': reprovado_para_aprovado,
+                },
+            })
+
+        return {
+            'total_predicoes': total,
+            'taxa_aprovacao_gravada': _taxa(aprovados_gravados, total),
+            'predicoes_ate': self.corte.isoformat() if self.corte else None,
+            'simulacoes': simulacoes,
+        }
+
+    # ------------------------------------------------------------- persistência
+    def salvar(self, caminho: Path):
+        with self._lock:
+            np.savez_compressed(caminho, contagens=self.contagens,
+                                corte=np.array(self.corte.isoformat() if self.corte else ''))
+
+    @classmethod
+    def carregar(cls, caminho: Path, margem_segundos: float = MARGEM_GRAVACAO_SEGUNDOS) -> 'IndiceScores':
+        indice = cls(margem_segundos)
+        with np.load(caminho) as dados:
+            if dados['contagens'].shape != indice.contagens.shape:
+                raise ValueError(f"Índice em {caminho} foi gerado com outras faixas; apague o arquivo")
+            indice.contagens = dados['contagens']
+            corte = str(dados['corte'])
+        indice.corte = datetime.fromisoformat(corte) if corte else None
+        return indice
+
+
+def consulta_decisoes_alteradas(tabela, threshold: float, limite: int):
+    """ids das predições mais recentes cuja decisão mudaria com `threshold`"""
+    t = tabela.c
+    return select(t.id).where(or_(
+        (t.resultado == RESULTADOS[0]) & (t.probabilidade_risco >= threshold),
+        (t.resultado == RESULTADOS[1]) & (t.probabilidade_risco < threshold),
+    )).order_by(t.timestamp.desc(), t.id.desc()).limit(limite)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Taxa de aprovação do histórico com outros thresholds")
+    parser.add_argument('thresholds', type=float, nargs='+')
+    parser.add_argument('--cache', type=Path, help="Arquivo .npz do índice, reaproveitado e estendido a cada execução")
+    parser.add_argument('--margem-segundos', type=float, default=MARGEM_GRAVACAO_SEGUNDOS)
+    args = parser.parse_args(argv)
+
+    # só importa o backend aqui: database.py exige DATABASE_URL
+    from database import engine
+    from main import Prediction, arquivo_predicoes
+
+    if engine.dialect.name == 'postgresql':
+        arquivo_predicoes.atualizar(engine)
+    if args.cache is not None and args.cache.is_file():
+        indice = IndiceScores.carregar(args.cache, args.margem_segundos)
+    else:
+        indice = IndiceScores(args.margem_segundos)
+    indice.atualizar(engine, Prediction.__table__, arquivo_predicoes)
+    if args.cache is not None:
+        indice.salvar(args.cache)
+    print(json.dumps(indice.simular(args.thresholds), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+"""
+Treinamento reprodutível do modelo de crédito, extraído do notebook 03.2_machine_learning.
+
+As features são calculadas pelo mesmo código do backend (features.py), então o modelo treinado
+e a API nunca divergem. A matriz de features e os folds de validação ficam em cache no disco
+(joblib Memory). Cada família de modelos roda em um processo próprio, com busca por successive
+halving (HalvingRandomSearchCV) e early stopping no HistGradientBoosting. O melhor modelo por
+F2 é exportado no formato do registro (modelos/registro/<versao>.joblib, mais o <versao>.npz
+compacto quando o modelo é linear), com o threshold ótimo de F2 e as métricas no conjunto de teste.
+
+Uso (a partir de app/backend):
+    python treinar.py
+    python treinar.py --familias logistica hist_gb --candidatos 60 --versao v3
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Memory
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import (f1_score, fbeta_score, make_scorer, precision_recall_curve, precision_score,
+                             recall_score, roc_auc_score)
+from sklearn.model_selection import HalvingRandomSearchCV, StratifiedKFold, cross_val_predict, train_test_split
+from sklearn.pipeline import Pipeline as SklearnPipeline
+from sklearn.preprocessing import RobustScaler
+
+import artefato_compacto
+from features import FEATURES_MODELO, calcular_features_tabela, matriz_features
+from registro_modelos import RegistroModelos
+
+logger = logging.getLogger(__name__)
+
+RAIZ = Path(__file__).parent.parent.parent
+CAMINHO_DADOS = RAIZ / "data" / "dados_credito_processados.parquet"
+CAMINHO_MODELO = RAIZ / "modelos" / "modelo_credito_final.joblib"
+CAMINHO_REGISTRO = Path(os.getenv("CAMINHO_REGISTRO", RAIZ / "modelos" / "registro"))
+CAMINHO_CACHE = RAIZ / ".cache" / "treino"
+
+ALVO = 'status_inadimplencia'
+SCORER_F2 = make_scorer(fbeta_score, beta=2)
+
+# Grades do notebook 03.2. O parâmetro que mede o esforço de cada família (linhas de treino,
+# árvores ou iterações de boosting) sai da grade e vira o recurso do successive halving
+GRADES = {
+    'logistica': {
+        'classifier__C': [0.001, 0.01, 0.1, 1, 10, 100],
+        'classifier__penalty': ['l1', 'l2'],
+        'classifier__solver': ['liblinear', 'saga'],
+        'classifier__max_iter': [100, 200],
+    },
+    'random_forest': {
+        'classifier__max_depth': [None, 10, 20, 30],
+        'classifier__min_samples_split': [2, 5, 10],
+        'classifier__min_samples_leaf': [1, 2, 4],
+        'classifier__bootstrap': [True, False],
+    },
+    'xgboost': {
+        'classifier__learning_rate': [0.01, 0.05, 0.1],
+        'classifier__max_depth': [3, 5, 7],
+        'classifier__subsample': [0.6, 0.8, 1.0],
+        'classifier__colsample_bytree': [0.6, 0.8, 1.0],
+        'classifier__gamma': [0, 0.1, 0.2],
+    },
+    'hist_gb': {
+        'classifier__learning_rate': [0.01, 0.05, 0.1],
+        'classifier__max_depth': [3, 5, 10],
+        'classifier__l2_regularization': [0, 0.1, 1.0],
+    },
+}
+# família -> (recurso, mínimo, máximo); None nos limites = calculado pelo tamanho do treino
+RECURSOS = {
+    'logistica': ('n_samples', None, None),
+    'random_forest': ('classifier__n_estimators', 60, 500),
+    'xgboost': ('classifier__n_estimators', 60, 500),
+    'hist_gb': ('classifier__max_iter', 40, 300),
+}
+
+
+def classificador(familia: str, semente: int):
+    if familia == 'logistica':
+        return LogisticRegression(max_iter=1000)
+    if familia == 'random_forest':
+        return RandomForestClassifier(random_state=semente)
+    if familia == 'xgboost':
+        from xgboost import XGBClassifier
+        return XGBClassifier(random_state=semente, verbosity=0, n_jobs=1)
+    if familia == 'hist_gb':
+        # early stopping pela perda numa validação interna: max_iter é só o teto
+        return HistGradientBoostingClassifier(random_state=semente, early_stopping=True,
+                                              validation_fraction=0.15, n_iter_no_change=10)
+    raise ValueError(f"Família desconhecida: {familia}")
+
+
+def pipeline_treino(familia: str, semente: int):
+    """Escalonador + SMOTETomek + classificador, como no notebook (o SMOTE só existe no treino)"""
+    from imblearn.combine import SMOTETomek
+    from imblearn.pipeline import Pipeline
+
+    return Pipeline([
+        ('scaler', RobustScaler()),
+        ('smote', SMOTETomek(random_state=semente)),
+        ('classifier', classificador(familia, semente)),
+    ])
+
+
+def pipeline_producao(pipeline):
+    """Tira o SMOTE: o artefato servido é só escalonador + classificador"""
+    return SklearnPipeline([(nome, passo) for nome, passo in pipeline.steps if nome != 'smote'])
+
+
+# ------------------------------------------------------------- dados (em cache)
+def preparar_dados(caminho: str, assinatura: tuple) -> tuple[pd.DataFrame, np.ndarray]:
+    """Matriz de features do backend e alvo; `assinatura` (tamanho, mtime) invalida o cache"""
+    dados = pd.read_parquet(caminho)
+    X = pd.DataFrame(matriz_features(calcular_features_tabela(dados), FEATURES_MODELO), columns=FEATURES_MODELO)
+    return X, dados[ALVO].to_numpy(np.int64)
+
+
+def gerar_folds(y: np.ndarray, n_folds: int, semente: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    return list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=semente)
+                .split(np.zeros(len(y)), y))
+
+
+def pico_rss_mb() -> float:
+    """Pico de RSS do próprio processo (sem os filhos)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class AmostradorRss:
+    """
+    Pico da soma do RSS do processo e de todos os descendentes (workers loky do joblib com
+    n_jobs > 1), amostrado com psutil por uma thread enquanto o bloco roda. O RUSAGE_CHILDREN
+    não serve: só conta filhos já encerrados e recolhidos, e os workers loky continuam vivos
+    """
+
+    def __init__(self, intervalo: float = 0.2):
+        self.intervalo = intervalo
+        self.pico_bytes = 0
+        self._parar = threading.Event()
+        self._thread = None
+
+    def amostrar(self):
+        import psutil
+        processo = psutil.Process()
+        total = 0
+        for p in [processo, *processo.children(recursive=True)]:
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                continue
+        self.pico_bytes = max(self.pico_bytes, total)
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self.amostrar()
+
+    def __enter__(self):
+        self.amostrar()
+        self._thread = threading.Thread(target=self._executar, name='amostrador-rss', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        self.amostrar()
+
+    @property
+    def pico_mb(self) -> float:
+        return self.pico_bytes / 1024 / 1024
+
+
+# --------------------------------------------------------------------- busca
+def silenciar_avisos():
+    # os mesmos avisos que o notebook ignora: candidatos sem convergência são só pior pontuados
+    warnings.simplefilter('ignore', category=FutureWarning)
+    warnings.simplefilter('ignore', category=UserWarning)
+    warnings.simplefilter('ignore', category=ConvergenceWarning)
+
+
+def buscar_familia(familia: str, X: pd.DataFrame, y: np.ndarray, folds: list, candidatos: int,
+                   n_jobs: int, semente: int) -> dict:
+    """
+    Successive halving de uma família. Roda num processo próprio, então o pico de RSS (o processo
+    mais os workers do joblib, somados) é só dela
+    """
+    silenciar_avisos()
+    recurso, minimo, maximo = RECURSOS[familia]
+    if recurso == 'n_samples':
+        # o SMOTE precisa de vizinhos da classe minoritária em cada fold: não começa com poucas linhas
+        minimo, maximo = len(y) // 4, len(y)
+
+    inicio = time.perf_counter()
+    busca = HalvingRandomSearchCV(
+        pipeline_treino(familia, semente),
+        param_distributions=GRADES[familia],
+        n_candidates=candidatos,
+        factor=3,
+        resource=recurso,
+        min_resources=minimo,
+        max_resources=maximo,
+        cv=folds,
+        scoring=SCORER_F2,
+        refit=True,
+        n_jobs=n_jobs,
+        random_state=semente,
+    )
+    with AmostradorRss() as amostrador:
+        busca.fit(X, y)
+    return {
+        'familia': familia,
+        'estimador': busca.best_estimator_,
+        'parametros': {k: v for k, v in busca.best_params_.items()},
+        'f2_cv': float(busca.best_score_),
+        'candidatos_avaliados': int(sum(busca.n_candidates_)),
+        'iteracoes_halving': int(busca.n_iterations_),
+        'segundos': round(time.perf_counter() - inicio, 2),
+        'pico_rss_mb': round(amostrador.pico_mb, 1),
+    }
+
+
+def threshold_f2(y: np.ndarray, probabilidades: np.ndarray) -> tuple[float, float]:
+    """Threshold que maximiza o F2 (mesma conta do notebook) e o F2 correspondente"""
+    precisoes, recalls, thresholds = precision_recall_curve(y, probabilidades)
+    f2 = (1 + 2 ** 2) * (precisoes * recalls) / (2 ** 2 * precisoes + recalls + 1e-10)
+    melhor = int(np.argmax(f2[:-1]))
+    return float(thresholds[melhor]), float(f2[melhor])
+
+
+def exportar(pipeline, threshold: float, metricas: dict, versao: str, destino: Path,
+             caminho_referencia: Path) -> Path:
+    """
+    Grava <versao>.joblib no diretório do registro e, se o pipeline for linear, também o
+    <versao>.npz (artefato_compacto.py), que a API carrega sem sklearn. Os artefatos são
+    validados pelo próprio RegistroModelos (chaves, features, canário) num diretório temporário
+    antes do rename, então o observador da API nunca vê um arquivo parcial ou inválido
+    """
+    destino.mkdir(parents=True, exist_ok=True)
+    final = destino / f"{versao}.joblib"
+    if final.exists() or final.with_suffix('.npz').exists():
+        raise FileExistsError(f"A versão {versao} já existe em {destino}")
+
+    with tempfile.TemporaryDirectory(dir=destino, prefix='.treino-') as temporario:
+        caminho = Path(temporario) / final.name
+        joblib.dump({
+            'modelo': pipeline,
+            'features': list(FEATURES_MODELO),
+            'threshold_f2': threshold,
+            'metricas': metricas,
+        }, caminho)
+        registro = RegistroModelos(Path(temporario), CAMINHO_MODELO, caminho_referencia)
+        modelo = registro.carregar(versao)
+        if modelo.scorer.compilado:
+            compacto = artefato_compacto.salvar(caminho.with_suffix('.npz'), pipeline, list(FEATURES_MODELO),
+                                                threshold, metricas, registro.matriz_canario(FEATURES_MODELO),
+                                                fonte=caminho)
+            registro.carregar(versao)
+            # o .npz entra primeiro: quando a versão aparece para o observador, ela já é compacta
+            os.replace(compacto, final.with_suffix('.npz'))
+        os.replace(caminho, final)
+    return final
+
+
+def main(argv=None):
+    from logs import configurar_logs
+
+    parser = argparse.ArgumentParser(description="Treina as famílias de modelos e exporta o melhor para o registro")
+    parser.add_argument('--dados', type=Path, default=CAMINHO_DADOS)
+    parser.add_argument('--familias', nargs='+', choices=list(GRADES), default=list(GRADES))
+    parser.add_argument('--candidatos', type=int, default=30, help="Candidatos sorteados por família")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--processos', type=int, default=None,
+                        help="Famílias treinadas ao mesmo tempo (padrão: min(famílias, núcleos))")
+    parser.add_argument('--versao', default=f"v{datetime.now():%Y%m%d%H%M%S}",
+                        help="Nome da versão exportada (padrão: data e hora)")
+    parser.add_argument('--saida', type=Path, default=CAMINHO_REGISTRO, help="Diretório do registro de modelos")
+    parser.add_argument('--cache', type=Path, default=CAMINHO_CACHE, help="Cache de features e folds (joblib Memory)")
+    parser.add_argument('--limpar-cache', action='store_true')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--nao-exportar', action='store_true', help="Só compara as famílias")
+    args = parser.parse_args(argv)
+    configurar_logs()
+    silenciar_avisos()
+    if not args.nao_exportar and any((args.saida / f"{args.versao}{extensao}").exists()
+                                     for extensao in ('.joblib', '.npz')):
+        raise SystemExit(f"A versão {args.versao} já existe em {args.saida}")
+
+    memoria = Memory(args.cache, verbose=0)
+    if args.limpar_cache:
+        memoria.clear(warn=False)
+
+    inicio = time.perf_counter()
+    estado = args.dados.stat()
+    X, y = memoria.cache(preparar_dados)(str(args.dados.resolve()), (estado.st_size, estado.st_mtime))
+    X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=args.semente,
+                                                            stratify=y)
+    folds = memoria.cache(gerar_folds)(y_treino, args.folds, args.semente)
+    logger.info("Dados preparados", extra={'linhas_treino': len(y_treino), 'linhas_teste': len(y_teste),
+                                           'segundos': round(time.perf_counter() - inicio, 2)})
+
+    nucleos = os.cpu_count() or 1
+    processos = args.processos or min(len(args.familias), nucleos)
+    n_jobs = max(1, nucleos // processos)
+
+    resultados = []
+    # um processo novo por família (max_tasks_per_child=1): o pico de memória medido é só dela
+    with ProcessPoolExecutor(max_workers=processos, max_tasks_per_child=1,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futuros = {
+            familia: pool.submit(buscar_familia, familia, X_treino, y_treino, folds, args.candidatos,
+                                 n_jobs, args.semente)
+            for familia in args.familias
+        }
+        for familia, futuro in futuros.items():
+            try:
+                resultado = futuro.result()
+            except ImportError as e:
+                logger.warning("Família ignorada: dependência ausente", extra={'familia': familia, 'erro': str(e)})
+                continue
+            resultados.append(resultado)
+            logger.info("Família treinada", extra={k: v for k, v in resultado.items() if k != 'estimador'})
+
+    if not resultados:
+        raise SystemExit("Nenhuma família foi treinada")
+    melhor = max(resultados, key=lambda r: r['f2_cv'])
+
+    # threshold escolhido com predições out-of-fold do treino; o teste só mede
+    probabilidades_oof = cross_val_predict(clone(melhor['estimador']), X_treino, y_treino, cv=folds,
+                                           method='predict_proba', n_jobs=nucleos)[:, 1]
+    threshold, f2_oof = threshold_f2(y_treino, probabilidades_oof)
+    probabilidades = melhor['estimador'].predict_proba(X_teste)[:, 1]
+    previsto = (probabilidades >= threshold).astype(int)
+    metricas = {
+        'tipo_modelo': melhor['familia'],
+        'parametros': {k: (v if isinstance(v, (int, float, str, bool, type(None))) else str(v))
+                       for k, v in melhor['parametros'].items()},
+        'f2_score': round(float(fbeta_score(y_teste, previsto, beta=2)), 4),
+        'f1_score': round(float(f1_score(y_teste, previsto)), 4),
+        'precisao': round(float(precision_score(y_teste, previsto, zero_division=0)), 4),
+        'recall': round(float(recall_score(y_teste, previsto)), 4),
+        'roc_auc': round(float(roc_auc_score(y_teste, probabilidades)), 4),
+        'f2_cv': round(melhor['f2_cv'], 4),
+        'f2_oof_threshold': round(f2_oof, 4),
+        'treinado_em': datetime.now().isoformat(timespec='seconds'),
+        'familias': {r['familia']: {'f2_cv': round(r['f2_cv'], 4), 'segundos': r['segundos'],
+                                    'pico_rss_mb': r['pico_rss_mb']} for r in resultados},
+    }
+    logger.info("Melhor família", extra={'familia': melhor['familia'], 'threshold_f2': round(threshold, 4),
+                                         **{k: metricas[k] for k in ('f2_score', 'f1_score', 'recall', 'roc_auc')}})
+
+    if not args.nao_exportar:
+        caminho = exportar(pipeline_producao(melhor['estimador']), threshold, metricas, args.versao, args.saida,
+                           args.dados)
+        logger.info("Artefato exportado", extra={'versao': args.versao, 'caminho': str(caminho)})
+    logger.info("Treinamento concluído", extra={'segundos': round(time.perf_counter() - inicio, 2),
+                                                'pico_rss_mb_principal': round(pico_rss_mb(), 1)})
+
+
+if __name__ == '__main__':
+    main()
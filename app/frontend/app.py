@@ -1,17 +1,98 @@
+import os
+import uuid
+
+import numpy as np
 import streamlit as st
 import requests
 import pandas as pd
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 st.set_page_config(page_title="Credit Score Analysis Project", page_icon="💰", layout="wide")
 st.title("Sistema de Análise de Crédito")
 
-API_URL = "http://localhost:8000"
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+# (conexão, leitura) em segundos: um backend travado não prende a sessão do analista
+TIMEOUT = (3.05, 15)
+# Estatísticas e histórico mudam devagar para quem olha o painel; o botão Atualizar limpa o cache
+CACHE_ESTATISTICAS_SEGUNDOS = 60
+CACHE_HISTORICO_SEGUNDOS = 30
+
+MORADIA_LABELS = {'own': 'Própria', 'rent': 'Aluguel', 'free': 'Graça'}
+PERIODOS_DIAS = {"Últimas 24 horas": 1, "Últimos 7 dias": 7, "Últimos 30 dias": 30, "Todo o período": None}
+
+
+@st.cache_resource
+def sessao_http() -> requests.Session:
+    """
+    Uma sessão compartilhada por todos os analistas e reruns: reaproveita as conexões
+    (keep-alive) e repete falhas de conexão e 502/503/504 com backoff. O POST /predict pode
+    ser repetido porque sempre leva uma Idempotency-Key; timeouts de leitura não são repetidos
+    """
+    tentativas = Retry(
+        total=3,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET', 'POST'}),
+        respect_retry_after_header=True,
+    )
+    sessao = requests.Session()
+    sessao.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=tentativas))
+    sessao.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=tentativas))
+    return sessao
+
+
+@st.cache_data(ttl=CACHE_ESTATISTICAS_SEGUNDOS, show_spinner=False)
+def buscar_estatisticas(dias: int | None) -> dict:
+    resposta = sessao_http().get(f"{API_URL}/predictions/stats", params={'dias': dias}, timeout=TIMEOUT)
+    resposta.raise_for_status()
+    return resposta.json()
+
+
+@st.cache_data(ttl=CACHE_HISTORICO_SEGUNDOS, show_spinner=False)
+def buscar_historico(limit: int, cursor: str | None, resultado: str | None, situacao_moradia: str | None) -> dict:
+    """Uma página do histórico; o total estimado só é pedido na primeira"""
+    params = {
+        'limit': limit,
+        'cursor': cursor,
+        'resultado': resultado,
+        'situacao_moradia': situacao_moradia,
+        'total': 'estimado' if cursor is None else 'nenhum',
+    }
+    resposta = sessao_http().get(f"{API_URL}/predictions", params=params, timeout=TIMEOUT)
+    resposta.raise_for_status()
+    return resposta.json()
+
+
+def formatar_historico(predictions: list[dict]) -> pd.DataFrame:
+    """Conversões por coluna; a formatação de moeda e percentual fica no column_config da tabela"""
+    df = pd.DataFrame(predictions)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['situacao_moradia'] = df['situacao_moradia'].map(MORADIA_LABELS).fillna(df['situacao_moradia'])
+    df['probabilidade_risco'] = df['probabilidade_risco'] * 100
+    return df
+
+
+def cor_resultado(coluna: pd.Series) -> np.ndarray:
+    return np.where(coluna == 'Aprovado', 'background-color: green; color: white',
+                    'background-color: red; color: white')
+
+
+def superficie_aprovacao(simulacao: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Risco (%) da grade, prazos nas linhas e valores nas colunas, e as cores de aprovado/reprovado"""
+    colunas = [f"R$ {valor:,.0f}" for valor in simulacao['valores']]
+    risco = pd.DataFrame(np.asarray(simulacao['probabilidade_risco']) * 100, index=simulacao['prazos'],
+                         columns=colunas).rename_axis("Prazo (meses)")
+    cores = pd.DataFrame(np.where(simulacao['aprovado'], 'background-color: #2e7d32; color: white',
+                                  'background-color: #c62828; color: white'),
+                         index=risco.index, columns=colunas)
+    return risco, cores
 
 # Sidebar para navegação
 menu = st.sidebar.selectbox(
     "Menu",
-    ["Nova Análise", "Histórico de Análises", "Estatísticas"]
+    ["Nova Análise", "Simular Ofertas", "Histórico de Análises", "Estatísticas"]
 )
 
 if menu == "Nova Análise":
@@ -66,7 +147,9 @@ if menu == "Nova Análise":
 
             try:
                 with st.spinner("Consultando o modelo..."):
-                    response = requests.post(f"{API_URL}/predict", json=payload)
+                    response = sessao_http().post(f"{API_URL}/predict", json=payload, timeout=TIMEOUT,
+                                                  params={'motivos': 'true'},
+                                                  headers={'Idempotency-Key': str(uuid.uuid4())})
 
                 if response.status_code == 200:
                     resultado = response.json()
@@ -80,187 +163,295 @@ if menu == "Nova Análise":
                         st.error(f"❌ REPROVADO")
                         st.metric(label="Probabilidade de Risco", value=f"{probabilidade:.2%}", delta_color="inverse",
                                   delta="Alto Risco")
+                        if resultado.get("motivos"):
+                            st.markdown("**Principais motivos:**")
+                            for motivo in resultado["motivos"]:
+                                st.write(f"- {motivo['descricao']} ({motivo['codigo']})")
 
                     with st.expander("Ver detalhes técnicos"):
                         st.json(resultado)
                 else:
                     st.error(f"Erro na API: {response.text}")
 
-            except requests.exceptions.ConnectionError:
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
                 st.error("Não foi possível conectar à API. Verifique se o backend está funcionando corretamente.")
 
 
 elif menu == "Histórico de Análises":
     st.subheader("📋 Histórico de Análises de Crédito")
 
-    col1, col2 = st.columns([3, 1])
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
     with col1:
-        limit = st.slider("Número de registros", min_value=5, max_value=100, value=20, step=5)
+        limit = st.slider("Registros por página", min_value=5, max_value=100, value=20, step=5)
     with col2:
+        filtro_resultado = st.selectbox("Resultado", ["Todos", "Aprovado", "Reprovado"])
+    with col3:
+        filtro_moradia = st.selectbox("Moradia", ["Todas", *MORADIA_LABELS.values()])
+    with col4:
         if st.button("🔄 Atualizar"):
-            st.rerun()
+            buscar_historico.clear()
+            st.session_state.pop('cursores', None)
 
-    try:
-        response = requests.get(f"{API_URL}/predictions", params={"limit": limit})
+    resultado_param = None if filtro_resultado == "Todos" else filtro_resultado
+    moradia_param = next((k for k, v in MORADIA_LABELS.items() if v == filtro_moradia), None)
 
-        if response.status_code == 200:
-            data = response.json()
-            predictions = data['predictions']
-            total = data['total']
+    # Paginação por cursor no servidor: a pilha guarda o cursor de cada página já visitada.
+    # Mudar o tamanho da página ou os filtros volta para a primeira
+    consulta_atual = (limit, resultado_param, moradia_param)
+    if st.session_state.get('consulta_historico') != consulta_atual:
+        st.session_state['consulta_historico'] = consulta_atual
+        st.session_state.pop('cursores', None)
+    cursores = st.session_state.setdefault('cursores', [None])
 
-            if total == 0:
-                st.info("Nenhuma análise realizada ainda. Faça sua primeira análise!")
-            else:
-                st.info(f"Total de análises no banco: {total}")
-
-                # Converter para DataFrame
-                df = pd.DataFrame(predictions)
-
-                # Formatar colunas
-                df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%d/%m/%Y %H:%M:%S')
-                df['valor_emprestimo'] = df['valor_emprestimo'].apply(lambda x: f"R$ {x:,.2f}")
-                df['salario_anual'] = df['salario_anual'].apply(lambda x: f"R$ {x:,.2f}")
-                df['probabilidade_risco'] = df['probabilidade_risco'].apply(lambda x: f"{x:.2%}")
-
-                # Mapear situação moradia
-                moradia_map = {'own': 'Própria', 'rent': 'Aluguel', 'free': 'Graça'}
-                df['situacao_moradia'] = df['situacao_moradia'].map(moradia_map)
-
-                # Renomear colunas
-                df_display = df[[
-                    'id', 'timestamp', 'idade', 'salario_anual', 'valor_emprestimo',
-                    'prazo_meses', 'situacao_moradia', 'resultado', 'probabilidade_risco'
-                ]].rename(columns={
-                    'id': 'ID',
-                    'timestamp': 'Data/Hora',
-                    'idade': 'Idade',
-                    'salario_anual': 'Salário Anual',
-                    'valor_emprestimo': 'Valor Empréstimo',
-                    'prazo_meses': 'Prazo (meses)',
-                    'situacao_moradia': 'Moradia',
-                    'resultado': 'Resultado',
-                    'probabilidade_risco': 'Prob. Risco'
-                })
+    try:
+        data = buscar_historico(limit, cursores[-1], resultado_param, moradia_param)
+        predictions = data['predictions']
+        total = data['total']
 
+        if not predictions:
+            st.info("Nenhuma análise encontrada. Faça sua primeira análise!")
+        else:
+            if total is not None:
+                st.session_state['total_historico'] = total
+            if st.session_state.get('total_historico') is not None and resultado_param is None and moradia_param is None:
+                st.info(f"Total de análises no banco: {st.session_state['total_historico']}")
+
+            df = formatar_historico(predictions)
+
+            df_display = df[[
+                'id', 'timestamp', 'idade', 'salario_anual', 'valor_emprestimo',
+                'prazo_meses', 'situacao_moradia', 'resultado', 'probabilidade_risco'
+            ]].rename(columns={
+                'id': 'ID',
+                'timestamp': 'Data/Hora',
+                'idade': 'Idade',
+                'salario_anual': 'Salário Anual',
+                'valor_emprestimo': 'Valor Empréstimo',
+                'prazo_meses': 'Prazo (meses)',
+                'situacao_moradia': 'Moradia',
+                'resultado': 'Resultado',
+                'probabilidade_risco': 'Prob. Risco'
+            })
+
+            # Mostrar tabela com cores
+            st.dataframe(
+                df_display.style.apply(cor_resultado, subset=['Resultado']),
+                width='stretch',
+                height=600,
+                hide_index=True,
+                column_config={
+                    'Data/Hora': st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm:ss"),
+                    'Salário Anual': st.column_config.NumberColumn(format="R$ %.2f"),
+                    'Valor Empréstimo': st.column_config.NumberColumn(format="R$ %.2f"),
+                    'Prob. Risco': st.column_config.NumberColumn(format="%.2f%%"),
+                }
+            )
 
-                # Mostrar tabela com cores
-                def color_resultado(val):
-                    color = 'green' if val == 'Aprovado' else 'red'
-                    return f'background-color: {color}; color: white'
+            col_anterior, col_pagina, col_proxima = st.columns([1, 2, 1])
+            with col_anterior:
+                if st.button("⬅️ Anterior", disabled=len(cursores) == 1):
+                    cursores.pop()
+                    st.rerun()
+            with col_pagina:
+                st.caption(f"Página {len(cursores)}")
+            with col_proxima:
+                if st.button("Próxima ➡️", disabled=data['proximo_cursor'] is None):
+                    cursores.append(data['proximo_cursor'])
+                    st.rerun()
 
+            # Detalhes de uma análise da página: as linhas já vieram na listagem
+            st.divider()
+            st.subheader("🔍 Ver Detalhes de uma Análise")
 
-                st.dataframe(
-                    df_display.style.applymap(color_resultado, subset=['Resultado']),
-                    use_container_width=True,
-                    height=600
-                )
+            prediction_id = st.selectbox("ID da análise", df['id'])
+            detail = df.loc[df['id'] == prediction_id].iloc[0]
 
-                # Detalhes de uma análise específica
-                st.divider()
-                st.subheader("🔍 Ver Detalhes de uma Análise")
+            col1, col2, col3 = st.columns(3)
 
-                prediction_id = st.number_input(
-                    "Digite o ID da análise",
-                    min_value=1,
-                    max_value=int(df['ID'].max()) if len(df) > 0 else 1,
-                    value=1
-                )
+            with col1:
+                st.metric("Idade", int(detail['idade']))
+                st.metric("Salário Anual", f"R$ {detail['salario_anual']:,.2f}")
+                st.metric("Conta Corrente", f"R$ {detail['valor_conta_corrente']:,.2f}")
 
-                if st.button("Buscar"):
-                    try:
-                        detail_response = requests.get(f"{API_URL}/predictions/{prediction_id}")
-                        if detail_response.status_code == 200:
-                            detail = detail_response.json()
-
-                            col1, col2, col3 = st.columns(3)
-
-                            with col1:
-                                st.metric("Idade", detail['idade'])
-                                st.metric("Salário Anual", f"R$ {detail['salario_anual']:,.2f}")
-                                st.metric("Conta Corrente", f"R$ {detail['valor_conta_corrente']:,.2f}")
-
-                            with col2:
-                                st.metric("Valor Empréstimo", f"R$ {detail['valor_emprestimo']:,.2f}")
-                                st.metric("Prazo", f"{detail['prazo_meses']} meses")
-                                st.metric("Poupança", f"R$ {detail['valor_conta_poupanca']:,.2f}")
-
-                            with col3:
-                                moradia_label = moradia_map.get(detail['situacao_moradia'], detail['situacao_moradia'])
-                                st.metric("Moradia", moradia_label)
-                                st.metric("Resultado", detail['resultado'])
-                                st.metric("Prob. Risco", f"{detail['probabilidade_risco']:.2%}")
-
-                        else:
-                            st.error("Análise não encontrada")
-                    except Exception as e:
-                        st.error(f"Erro ao buscar análise: {e}")
-        else:
-            st.error("Erro ao carregar histórico")
+            with col2:
+                st.metric("Valor Empréstimo", f"R$ {detail['valor_emprestimo']:,.2f}")
+                st.metric("Prazo", f"{detail['prazo_meses']} meses")
+                st.metric("Poupança", f"R$ {detail['valor_conta_poupanca']:,.2f}")
+
+            with col3:
+                st.metric("Moradia", detail['situacao_moradia'])
+                st.metric("Resultado", detail['resultado'])
+                st.metric("Prob. Risco", f"{detail['probabilidade_risco']:.2f}%")
 
-    except requests.exceptions.ConnectionError:
+    except requests.exceptions.HTTPError:
+        st.error("Erro ao carregar histórico")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         st.error("Não foi possível conectar à API. Verifique se o backend está funcionando.")
 
 elif menu == "Estatísticas":
     st.subheader("📊 Estatísticas Gerais")
 
+    col_periodo, col_atualizar = st.columns([3, 1])
+    with col_periodo:
+        periodo = st.selectbox("Período", list(PERIODOS_DIAS), index=len(PERIODOS_DIAS) - 1)
+    with col_atualizar:
+        if st.button("🔄 Atualizar"):
+            buscar_estatisticas.clear()
+
     try:
-        response = requests.get(f"{API_URL}/predictions/stats")
+        stats = buscar_estatisticas(PERIODOS_DIAS[periodo])
+
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            st.metric(
+                label="Total de Análises",
+                value=stats['total_predicoes']
+            )
+
+        with col2:
+            st.metric(
+                label="Aprovados",
+                value=stats['aprovados'],
+                delta=f"{stats['taxa_aprovacao']}%"
+            )
+
+        with col3:
+            st.metric(
+                label="Reprovados",
+                value=stats['reprovados'],
+                delta=f"{100 - stats['taxa_aprovacao']:.2f}%",
+                delta_color="inverse"
+            )
+
+        with col4:
+            st.metric(
+                label="Taxa de Aprovação",
+                value=f"{stats['taxa_aprovacao']}%"
+            )
 
-        if response.status_code == 200:
-            stats = response.json()
+        # Gráfico de pizza
+        if stats['total_predicoes'] > 0:
+            st.divider()
 
-            col1, col2, col3, col4 = st.columns(4)
+            col1, col2 = st.columns(2)
 
             with col1:
-                st.metric(
-                    label="Total de Análises",
-                    value=stats['total_predicoes']
-                )
+                st.subheader("Distribuição de Resultados")
+                chart_data = pd.DataFrame({
+                    'Resultado': ['Aprovados', 'Reprovados'],
+                    'Quantidade': [stats['aprovados'], stats['reprovados']]
+                })
+                st.bar_chart(chart_data.set_index('Resultado'))
 
             with col2:
-                st.metric(
-                    label="Aprovados",
-                    value=stats['aprovados'],
-                    delta=f"{stats['taxa_aprovacao']}%"
-                )
+                st.subheader("Percentuais")
+                st.write(f"**Aprovados:** {stats['taxa_aprovacao']}%")
+                st.write(f"**Reprovados:** {100 - stats['taxa_aprovacao']:.2f}%")
 
-            with col3:
-                st.metric(
-                    label="Reprovados",
-                    value=stats['reprovados'],
-                    delta=f"{100 - stats['taxa_aprovacao']:.2f}%",
-                    delta_color="inverse"
-                )
+                # Barra de progresso
+                st.progress(stats['taxa_aprovacao'] / 100)
 
-            with col4:
-                st.metric(
-                    label="Taxa de Aprovação",
-                    value=f"{stats['taxa_aprovacao']}%"
-                )
+    except requests.exceptions.HTTPError:
+        st.error("Erro ao carregar estatísticas")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        st.error("Não foi possível conectar à API. Verifique se o backend está funcionando.")
 
-            # Gráfico de pizza
-            if stats['total_predicoes'] > 0:
-                st.divider()
+elif menu == "Simular Ofertas":
+    st.subheader("🧮 Simulação de Ofertas")
+    st.markdown("Aprovação do cliente numa grade de prazos × valores. A simulação não é gravada no histórico")
+
+    with st.form('formulario_simulacao'):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            idade = st.number_input("Idade", min_value=18, max_value=120, value=25, step=1)
+            salario_anual = st.number_input("Salário Anual (R$)", min_value=0.0, value=50000.0, step=1000.0)
+            situacao_moradia = st.selectbox("Situação de Moradia", options=list(MORADIA_LABELS),
+                                            format_func=MORADIA_LABELS.get)
+        with col2:
+            valor_conta_corrente = st.number_input("Saldo Conta Corrente (R$)", min_value=0.0, value=1500.0)
+            valor_conta_poupanca = st.number_input("Saldo Poupança (R$)", min_value=0.0, value=5000.0)
+        with col3:
+            valor_emprestimo = st.number_input("Valor Solicitado (R$)", min_value=1.0, value=10000.0)
+            prazo_meses = st.number_input("Prazo Solicitado (meses)", min_value=1, max_value=360, value=24)
 
-                col1, col2 = st.columns(2)
+        st.divider()
+        col4, col5 = st.columns(2)
+        with col4:
+            prazo_min, prazo_max = st.slider("Prazos (meses)", min_value=1, max_value=360, value=(6, 72))
+            prazo_passo = st.number_input("Passo entre prazos", min_value=1, max_value=60, value=6)
+        with col5:
+            valor_min = st.number_input("Valor mínimo (R$)", min_value=1.0, value=1000.0, step=1000.0)
+            valor_max = st.number_input("Valor máximo (R$)", min_value=1.0, value=50000.0, step=1000.0)
+            valor_pontos = st.number_input("Quantidade de valores", min_value=2, max_value=200, value=25)
+
+        simular = st.form_submit_button("Simular")
+
+    if simular:
+        payload = {
+            'cliente': {
+                "idade": idade,
+                "valor_conta_poupanca": valor_conta_poupanca,
+                "valor_conta_corrente": valor_conta_corrente,
+                "salario_anual": salario_anual,
+                "valor_emprestimo": valor_emprestimo,
+                "prazo_meses": prazo_meses,
+                "situacao_moradia": situacao_moradia
+            },
+            'prazos': {'minimo': prazo_min, 'maximo': prazo_max, 'passo': prazo_passo},
+            'valores': {'minimo': valor_min, 'maximo': valor_max, 'pontos': valor_pontos},
+        }
+        try:
+            with st.spinner("Simulando..."):
+                response = sessao_http().post(f"{API_URL}/predict/simulacao-ofertas", json=payload, timeout=TIMEOUT)
+
+            if response.status_code == 200:
+                simulacao = response.json()
+                solicitada = simulacao['oferta_solicitada']
+                st.caption(f"{simulacao['pontos']} ofertas simuladas em {simulacao['tempo_ms']:.1f} ms "
+                           f"(modelo {simulacao['versao_modelo']}, threshold {simulacao['threshold_utilizado']:.2%})")
+
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Oferta solicitada", solicitada['resultado'])
+                col2.metric("Prob. Risco", f"{solicitada['probabilidade_risco']:.2%}")
+                col3.metric("Parcela estimada", f"R$ {solicitada['parcela_mensal_estimada']:,.2f}")
 
-                with col1:
-                    st.subheader("Distribuição de Resultados")
-                    chart_data = pd.DataFrame({
-                        'Resultado': ['Aprovados', 'Reprovados'],
-                        'Quantidade': [stats['aprovados'], stats['reprovados']]
-                    })
-                    st.bar_chart(chart_data.set_index('Resultado'))
+                st.divider()
+                col_maximo, col_curva = st.columns(2)
+                maximos = pd.DataFrame(simulacao['valor_maximo_aprovavel'])
+                with col_maximo:
+                    st.subheader("Valor máximo aprovável por prazo")
+                    st.line_chart(maximos.set_index('prazo_meses')['valor_emprestimo'], x_label="Prazo (meses)",
+                                  y_label="R$")
+                with col_curva:
+                    st.subheader(f"Risco por valor em {simulacao['curva_risco']['prazo_meses']} meses")
+                    curva = pd.DataFrame({
+                        'Prob. Risco': simulacao['curva_risco']['probabilidade_risco'],
+                        'Threshold': simulacao['threshold_utilizado'],
+                    }, index=simulacao['curva_risco']['valores'])
+                    st.line_chart(curva, x_label="Valor (R$)")
 
-                with col2:
-                    st.subheader("Percentuais")
-                    st.write(f"**Aprovados:** {stats['taxa_aprovacao']}%")
-                    st.write(f"**Reprovados:** {100 - stats['taxa_aprovacao']:.2f}%")
+                st.dataframe(
+                    maximos.rename(columns={
+                        'prazo_meses': 'Prazo (meses)',
+                        'valor_emprestimo': 'Valor Máximo',
+                        'parcela_mensal_estimada': 'Parcela',
+                        'probabilidade_risco': 'Prob. Risco'
+                    }),
+                    width='stretch',
+                    hide_index=True,
+                    column_config={
+                        'Valor Máximo': st.column_config.NumberColumn(format="R$ %.2f"),
+                        'Parcela': st.column_config.NumberColumn(format="R$ %.2f"),
+                        'Prob. Risco': st.column_config.NumberColumn(format="%.4f"),
+                    }
+                )
 
-                    # Barra de progresso
-                    st.progress(stats['taxa_aprovacao'] / 100)
-        else:
-            st.error("Erro ao carregar estatísticas")
+                st.subheader("Superfície de aprovação (Prob. Risco %)")
+                risco, cores = superficie_aprovacao(simulacao)
+                st.dataframe(risco.style.apply(lambda _: cores, axis=None).format("{:.2f}"), width='stretch')
+            else:
+                st.error(f"Erro na API: {response.text}")
 
-    except requests.exceptions.ConnectionError:
-        st.error("Não foi possível conectar à API. Verifique se o backend está funcionando.")
\ No newline at end of file
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            st.error("Não foi possível conectar à API. Verifique se o backend está funcionando corretamente.")
@@ -0,0 +1,80 @@
+"""
+Compara dois resultados JSON do mesmo tipo (micro, carga ou semear) caso a caso e sai com
+código 1 se algum caso piorar além da tolerância. Serve como verificação de regressão no CI
+ou antes de um merge:
+
+    python benchmarks/comparar.py antes.json depois.json --tolerancia 0.10
+"""
+import argparse
+import json
+import sys
+
+# métrica -> True se maior é melhor
+METRICAS = {
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'linhas_por_segundo': True,
+    'requisicoes_por_segundo': True,
+}
+
+
+def _formatar(valor: float) -> str:
+    return f"{valor:,.0f}" if abs(valor) >= 1000 else f"{valor:.4f}"
+
+
+def comparar(base: dict, novo: dict, tolerancia: float, metricas: list[str]) -> list[str]:
+    """Imprime a variação de cada métrica e devolve a lista de regressões"""
+    if base['tipo'] != novo['tipo']:
+        sys.exit(f"Tipos diferentes: {base['tipo']} x {novo['tipo']}")
+    for chave in ('cpus', 'plataforma', 'banco', 'versao_modelo'):
+        if base['metadados'].get(chave) != novo['metadados'].get(chave):
+            print(f"aviso: {chave} difere ({base['metadados'].get(chave)} x {novo['metadados'].get(chave)})")
+
+    casos_base = {c['nome']: c for c in base['casos']}
+    regressoes = []
+    for caso in novo['casos']:
+        anterior = casos_base.get(caso['nome'])
+        if anterior is None:
+            print(f"{caso['nome']:<40} (novo)")
+            continue
+        for metrica in metricas:
+            antes, depois = anterior.get(metrica), caso.get(metrica)
+            if not antes or depois is None:
+                continue
+            variacao = (depois - antes) / antes
+            piorou = -variacao > tolerancia if METRICAS[metrica] else variacao > tolerancia
+            marca = '  REGRESSÃO' if piorou else ''
+            print(f"{caso['nome']:<40} {metrica:<24} {_formatar(antes):>14} -> {_formatar(depois):>14}  "
+                  f"{variacao:+7.1%}{marca}")
+            if piorou:
+                regressoes.append(f"{caso['nome']} {metrica} {variacao:+.1%}")
+        if caso.get('erros', 0) > anterior.get('erros', 0):
+            regressoes.append(f"{caso['nome']} erros {anterior.get('erros', 0)} -> {caso['erros']}")
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara dois resultados de benchmark")
+    parser.add_argument('base', help="Resultado de referência (ex.: da branch principal)")
+    parser.add_argument('novo', help="Resultado a verificar")
+    parser.add_argument('--tolerancia', type=float, default=0.10, help="Piora relativa aceita (0.10 = 10%%)")
+    parser.add_argument('--metricas', nargs='+', choices=list(METRICAS), default=list(METRICAS))
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.novo) as f:
+        novo = json.load(f)
+
+    regressoes = comparar(base, novo, args.tolerancia, args.metricas)
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}:")
+        for regressao in regressoes:
+            print(f"   {regressao}")
+        sys.exit(1)
+    print(f"\nsem regressões acima de {args.tolerancia:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Utilitários compartilhados pelos benchmarks: caminhos do backend, gerador de clientes
+sintéticos com as distribuições do german_credit_data.csv, percentis e gravação dos resultados
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+RAIZ = Path(__file__).resolve().parent.parent
+BACKEND = RAIZ / "app" / "backend"
+CAMINHO_GERMAN = RAIZ / "data" / "german_credit_data.csv"
+DIRETORIO_RESULTADOS = Path(__file__).resolve().parent / "resultados"
+
+# os módulos do backend são importados como módulos de topo (como o uvicorn faz em app/backend)
+if str(BACKEND) not in sys.path:
+    sys.path.insert(0, str(BACKEND))
+
+# Faixas (mín, máx) sorteadas por categoria, as mesmas regras do notebook 01; categoria ausente vale 0
+FAIXAS_SALARIO = {0: (15000, 22000), 1: (25000, 40000), 2: (45000, 80000), 3: (90000, 180000)}
+FAIXAS_CONTA_CORRENTE = {'little': (25000, 40000), 'moderate': (45000, 80000),
+                         'rich': (90000, 180000), 'quite rich': (100001, 1000000)}
+FAIXAS_POUPANCA = {'little': (1, 1000), 'moderate': (1001, 10000),
+                   'rich': (10001, 100000), 'quite rich': (100001, 1000000)}
+
+
+def _sortear_faixas(rng: np.random.Generator, categorias: np.ndarray, faixas: dict) -> np.ndarray:
+    valores = np.zeros(len(categorias))
+    for categoria, (minimo, maximo) in faixas.items():
+        mascara = categorias == categoria
+        valores[mascara] = rng.uniform(minimo, maximo, int(mascara.sum()))
+    return np.round(valores, 2)
+
+
+def gerar_clientes(n: int, semente: int = 42) -> dict:
+    """
+    Gera `n` clientes no formato do ClienteInput: as linhas do german_credit_data.csv são
+    reamostradas (bootstrap) e os valores em reais sorteados pelas faixas do notebook 01
+    """
+    rng = np.random.default_rng(semente)
+    german = pd.read_csv(CAMINHO_GERMAN)
+    amostra = german.iloc[rng.integers(0, len(german), n)]
+    return {
+        'idade': amostra['Age'].to_numpy(np.int64),
+        'valor_conta_poupanca': _sortear_faixas(rng, amostra['Saving accounts'].to_numpy(object), FAIXAS_POUPANCA),
+        'valor_conta_corrente': _sortear_faixas(rng, amostra['Checking account'].to_numpy(object),
+                                                FAIXAS_CONTA_CORRENTE),
+        'salario_anual': _sortear_faixas(rng, amostra['Job'].to_numpy(), FAIXAS_SALARIO),
+        'valor_emprestimo': amostra['Credit amount'].to_numpy(np.float64),
+        'prazo_meses': amostra['Duration'].to_numpy(np.int64),
+        'situacao_moradia': amostra['Housing'].to_numpy(object),
+    }
+
+
+def clientes_json(clientes: dict) -> list[dict]:
+    """Converte as colunas de gerar_clientes em payloads JSON do /predict"""
+    return pd.DataFrame(clientes).to_dict(orient='records')
+
+
+def percentis(duracoes_segundos) -> dict:
+    """Resumo de latência em milissegundos"""
+    ms = np.asarray(duracoes_segundos, dtype=np.float64) * 1000
+    if len(ms) == 0:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'media_ms': None, 'max_ms': None}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'media_ms': round(float(ms.mean()), 4),
+        'max_ms': round(float(ms.max()), 4),
+    }
+
+
+def metadados(**extras) -> dict:
+    """Contexto da execução, para só comparar resultados de máquinas e versões equivalentes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    import sklearn
+
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        **extras,
+    }
+
+
+def salvar_resultado(tipo: str, casos: list[dict], destino: Path | None = None, **extras) -> Path:
+    """Grava {tipo, metadados, casos} em JSON; cada caso tem um `nome` único usado pelo comparar.py"""
+    if destino is None:
+        DIRETORIO_RESULTADOS.mkdir(parents=True, exist_ok=True)
+        destino = DIRETORIO_RESULTADOS / f"{tipo}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    destino = Path(destino)
+    destino.write_text(json.dumps({'tipo': tipo, 'metadados': metadados(**extras), 'casos': casos},
+                                  indent=2, ensure_ascii=False))
+    return destino
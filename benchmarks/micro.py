@@ -0,0 +1,114 @@
+"""
+Micro-benchmarks do caminho de decisão, sem HTTP e sem banco:
+preparar_dados_modelo / preparar_dados_lote, pipeline.predict_proba e o scorer compilado,
+com um cliente por chamada e em lotes.
+
+Uso (a partir da raiz do repositório):
+    python benchmarks/micro.py
+    python benchmarks/micro.py --lotes 100 10000 --repeticoes 5000 --saida antes.json
+"""
+import argparse
+import gc
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from comum import clientes_json, gerar_clientes, percentis, salvar_resultado
+
+# importar main cria os engines; nenhum request é feito, então um SQLite em memória basta
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from main import ClienteInput, preparar_dados_lote, preparar_dados_modelo, registro  # noqa: E402
+from motivos import codificar, motivos_adversos, motivos_adversos_cliente  # noqa: E402
+
+
+def medir(nome: str, funcao, argumentos: list, linhas_por_chamada: int, aquecimento: int = 50) -> dict:
+    """Cronometra `funcao(arg)` para cada arg de `argumentos`, uma chamada por amostra"""
+    for arg in argumentos[:aquecimento]:
+        funcao(arg)
+
+    duracoes = np.empty(len(argumentos))
+    gc_ativo = gc.isenabled()
+    gc.disable()
+    try:
+        for i, arg in enumerate(argumentos):
+            inicio = time.perf_counter()
+            funcao(arg)
+            duracoes[i] = time.perf_counter() - inicio
+    finally:
+        if gc_ativo:
+            gc.enable()
+
+    total = float(duracoes.sum())
+    caso = {
+        'nome': nome,
+        'chamadas': len(argumentos),
+        'linhas_por_chamada': linhas_por_chamada,
+        **percentis(duracoes),
+        'linhas_por_segundo': round(len(argumentos) * linhas_por_chamada / total) if total > 0 else None,
+    }
+    print(f"{nome:<45} p50 {caso['p50_ms']:>10.4f} ms   p99 {caso['p99_ms']:>10.4f} ms   "
+          f"{caso['linhas_por_segundo']:>12,} linhas/s")
+    return caso
+
+
+def pontuar_com_motivos(modelo, matriz):
+    """Caminho do /predict/batch com os motivos gravados: contribuições, top-3 e forma compacta"""
+    proba, contribuicoes = modelo.scorer.proba_e_contribuicoes(matriz)
+    indices, _ = motivos_adversos(contribuicoes, modelo.features, 3)
+    return proba, codificar(indices, modelo.features)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de features e scoring")
+    parser.add_argument('--repeticoes', type=int, default=2000, help="Chamadas por caso de um cliente")
+    parser.add_argument('--lotes', type=int, nargs='+', default=[100, 1000, 10000], help="Tamanhos de lote")
+    parser.add_argument('--repeticoes-lote', type=int, default=50, help="Chamadas por caso de lote")
+    parser.add_argument('--versao', help="Versão do registro de modelos (padrão: a versão ativa)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help="Arquivo JSON do resultado (padrão: benchmarks/resultados/)")
+    args = parser.parse_args(argv)
+
+    # o pipeline sklearn só existe no .joblib: os casos de comparação precisam dele
+    modelo = registro.carregar(args.versao or registro.versao_desejada(), compacto=False)
+    features = list(modelo.features)
+    clientes = [ClienteInput(**c) for c in clientes_json(gerar_clientes(max(args.repeticoes, max(args.lotes)),
+                                                                        args.semente))]
+    unitarios = clientes[:args.repeticoes]
+    print(f"modelo {modelo.versao} (scorer {'compilado' if modelo.scorer.compilado else 'sklearn'})\n")
+
+    casos = []
+    valores = [preparar_dados_modelo(c) for c in unitarios]
+    linhas_df = [pd.DataFrame({f: [v[f]] for f in features}) for v in valores]
+    casos.append(medir('preparar_dados_modelo[1]', preparar_dados_modelo, unitarios, 1))
+    casos.append(medir('pipeline.predict_proba[1]', modelo.pipeline.predict_proba, linhas_df, 1))
+    casos.append(medir('scorer.proba_positiva_valores[1]', modelo.scorer.proba_positiva_valores, valores, 1))
+    casos.append(medir('scorer+motivos[1]',
+                       lambda v: motivos_adversos_cliente(modelo.scorer.proba_e_contribuicoes_valores(v)[1],
+                                                          modelo.features, 3), valores, 1))
+    casos.append(medir('preparar+pipeline.predict_proba[1]',
+                       lambda c: modelo.pipeline.predict_proba(
+                           pd.DataFrame([preparar_dados_modelo(c)], columns=features)), unitarios, 1))
+
+    for tamanho in args.lotes:
+        lotes = [clientes[:tamanho]] * args.repeticoes_lote
+        matriz = preparar_dados_lote(clientes[:tamanho], features)
+        df = pd.DataFrame(matriz, columns=features)
+        casos.append(medir(f'preparar_dados_lote[{tamanho}]', lambda lote: preparar_dados_lote(lote, features),
+                           lotes, tamanho, aquecimento=3))
+        casos.append(medir(f'pipeline.predict_proba[{tamanho}]', modelo.pipeline.predict_proba,
+                           [df] * args.repeticoes_lote, tamanho, aquecimento=3))
+        casos.append(medir(f'scorer.proba_positiva[{tamanho}]', modelo.scorer.proba_positiva,
+                           [matriz] * args.repeticoes_lote, tamanho, aquecimento=3))
+        casos.append(medir(f'scorer+motivos[{tamanho}]', lambda m: pontuar_com_motivos(modelo, m),
+                           [matriz] * args.repeticoes_lote, tamanho, aquecimento=3))
+
+    destino = salvar_resultado('micro', casos, args.saida, versao_modelo=modelo.versao,
+                               scorer_compilado=modelo.scorer.compilado)
+    print(f"\nresultado gravado em {destino}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / "app" / "backend"
+sys.path.insert(0, str(BACKEND))
+
+# database.py cria os engines na importação; os testes usam engines próprios em tmp_path
+os.environ.setdefault("DATABASE_URL", "sqlite://")
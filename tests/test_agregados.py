@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from agregados import PredictionAgregado, atualizar_agregados, consultar_estatisticas
+
+
+def _linha(timestamp, resultado="Aprovado", probabilidade=0.1):
+    return {'timestamp': timestamp, 'resultado': resultado, 'situacao_moradia': 'own',
+            'probabilidade_risco': probabilidade}
+
+
+def _consultar(url, **janela):
+    async def consulta():
+        engine = create_async_engine(url)
+        try:
+            async with AsyncSession(engine) as db:
+                return await consultar_estatisticas(db, **janela)
+        finally:
+            await engine.dispose()
+    return asyncio.run(consulta())
+
+
+def test_janela_inclui_a_hora_corrente(tmp_path):
+    caminho = tmp_path / "stats.db"
+    engine = create_engine(f"sqlite:///{caminho}")
+    PredictionAgregado.__table__.create(engine)
+    agora = datetime.now()
+    with engine.begin() as conn:
+        atualizar_agregados(conn, [_linha(agora), _linha(agora - timedelta(days=3), "Reprovado", 0.9)])
+
+    url = f"sqlite+aiosqlite:///{caminho}"
+    # ?dias=1 (sem fim) e uma janela explícita que termina agora contam a predição desta hora
+    assert _consultar(url, inicio=agora - timedelta(days=1))['total_predicoes'] == 1
+    stats = _consultar(url, inicio=agora - timedelta(days=1), fim=agora)
+    assert stats['total_predicoes'] == 1
+    assert stats['aprovados'] == 1
+    # o fim arredondado como o início: a hora que contém `fim` entra inteira
+    assert _consultar(url, inicio=agora - timedelta(days=4), fim=agora.replace(minute=0, second=0, microsecond=0))['total_predicoes'] == 2
+    assert _consultar(url, fim=agora - timedelta(days=2))['total_predicoes'] == 1
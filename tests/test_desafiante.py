@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+from sqlalchemy.dialects import postgresql
+
+from database import tipos_divergentes
+from desafiante import AvaliadorSombra, PredictionDesafiante
+from main import Prediction
+from registro_modelos import ModeloCarregado
+
+
+class ScorerPid:
+    """Scorer não compilado que devolve o pid do processo que o executou"""
+    compilado = False
+
+    def proba_positiva(self, matriz):
+        return np.full(len(matriz), os.getpid() / 10_000_000)
+
+
+def _tipos_no_banco(**divergentes):
+    """Tipos como o inspector do PostgreSQL lê uma predictions_desafiante criada pelo modelo atual"""
+    return {
+        'prediction_id': postgresql.BIGINT(),
+        'timestamp': postgresql.TIMESTAMP(),
+        'versao_campeao': postgresql.VARCHAR(64),
+        'versao_desafiante': postgresql.VARCHAR(64),
+        'probabilidade_campeao': postgresql.DOUBLE_PRECISION(),
+        'probabilidade_desafiante': postgresql.DOUBLE_PRECISION(),
+        'resultado_campeao': postgresql.VARCHAR(20),
+        'resultado_desafiante': postgresql.VARCHAR(20),
+        'latencia_desafiante_ms': postgresql.DOUBLE_PRECISION(),
+        **divergentes,
+    }
+
+
+def test_tipos_da_tabela_do_desafiante_acompanham_predictions():
+    tabela = PredictionDesafiante.__table__
+    assert type(tabela.c.prediction_id.type) is type(Prediction.__table__.c.id.type)
+    assert type(tabela.c.probabilidade_campeao.type) is type(Prediction.__table__.c.probabilidade_risco.type)
+    assert type(tabela.c.probabilidade_desafiante.type) is type(Prediction.__table__.c.probabilidade_risco.type)
+
+
+def test_migracao_converte_a_tabela_antiga_do_desafiante():
+    tabela = PredictionDesafiante.__table__
+    assert tipos_divergentes(_tipos_no_banco(), tabela) == []
+
+    antiga = _tipos_no_banco(prediction_id=postgresql.INTEGER(),
+                             probabilidade_campeao=postgresql.NUMERIC(5, 4),
+                             probabilidade_desafiante=postgresql.NUMERIC(5, 4))
+    assert [coluna.name for coluna in tipos_divergentes(antiga, tabela)] == [
+        'prediction_id', 'probabilidade_campeao', 'probabilidade_desafiante']
+
+
+def test_desafiante_nao_compilado_roda_fora_do_worker():
+    modelo = ModeloCarregado(versao="v2", pipeline=None, scorer=ScorerPid(), threshold=0.5,
+                             features=('idade', 'prazo_meses'))
+    avaliador = AvaliadorSombra(modelo, workers=1)
+    avaliador.iniciar()
+    try:
+        item = {'idade': 30, 'valor_conta_poupanca': 100.0, 'valor_conta_corrente': 50.0, 'salario_anual': 40000.0,
+                'valor_emprestimo': 5000.0, 'prazo_meses': 12, 'situacao_moradia': 'own',
+                'resultado': "Aprovado", 'probabilidade_risco': 0.2, 'id': None, 'versao_modelo': "v1"}
+        avaliador._avaliar([item, item])
+    finally:
+        avaliador.parar()
+    (_, p_desafiante, _, _), _ = avaliador._pares
+    assert round((1 - p_desafiante) * 10_000_000) != os.getpid()
+    assert avaliador.comparacao()['pool_processos'] is True
@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from exportacao import consulta_exportacao, limite_exportacao
+from main import Prediction
+
+MARGEM = 60
+INICIO = datetime(2026, 1, 1)
+
+
+def _predicoes():
+    """
+    Dois workers com blocos de ids intercalados (hi/lo): A com 1..1000, B com 1001..2000. Cada
+    predição é gravada pela fila até 30s depois do seu timestamp, fora da ordem de id
+    """
+    aleatorio = random.Random(7)
+    ids = {'A': iter(range(1, 1001)), 'B': iter(range(1001, 2001))}
+    predicoes = []
+    for segundo in range(0, 300, 2):
+        worker = aleatorio.choice('AB')
+        timestamp = INICIO + timedelta(seconds=segundo)
+        gravada_em = timestamp + timedelta(seconds=aleatorio.uniform(0, 30))
+        predicoes.append((next(ids[worker]), timestamp, gravada_em))
+    return predicoes
+
+
+def _linha(prediction_id, timestamp):
+    return {'id': prediction_id, 'timestamp': timestamp, 'idade': 30, 'valor_conta_poupanca': 0.0,
+            'valor_conta_corrente': 0.0, 'salario_anual': 1.0, 'valor_emprestimo': 1.0, 'prazo_meses': 12,
+            'situacao_moradia': 'own', 'resultado': 'Aprovado', 'probabilidade_risco': 0.1,
+            'threshold_utilizado': 0.4, 'versao_modelo': 'v1', 'motivos': None}
+
+
+def test_carga_incremental_por_timestamp_nao_perde_linhas_gravadas_fora_de_ordem(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'exportacao.db'}")
+    tabela = Prediction.__table__
+    tabela.create(engine)
+    predicoes = _predicoes()
+
+    exportados_por_timestamp, exportados_por_id = [], []
+    marca_timestamp, marca_id = None, 0
+    gravadas = set()
+    for segundo in [*range(10, 400, 15), 10_000]:
+        agora = INICIO + timedelta(seconds=segundo)
+        novas = [(i, t) for i, t, gravada_em in predicoes if gravada_em <= agora and i not in gravadas]
+        with engine.begin() as conn:
+            if novas:
+                conn.execute(insert(tabela), [_linha(i, t) for i, t in novas])
+            gravadas.update(i for i, _ in novas)
+
+            ate = limite_exportacao(None, MARGEM, agora)
+            lote = conn.execute(consulta_exportacao(tabela, marca_timestamp, ate)).all()
+            exportados_por_timestamp += [linha.id for linha in lote]
+            marca_timestamp = ate
+
+            # a marca d'água antiga: só ids maiores que o maior já exportado
+            lote = [linha.id for linha in conn.execute(consulta_exportacao(tabela)).all() if linha.id > marca_id]
+            exportados_por_id += lote
+            marca_id = max([marca_id, *lote])
+
+    todos = sorted(i for i, _, _ in predicoes)
+    assert sorted(exportados_por_timestamp) == todos
+    assert len(exportados_por_timestamp) == len(set(exportados_por_timestamp))
+    # com ids reservados em blocos por worker, a marca d'água por id perde linhas
+    assert len(exportados_por_id) < len(todos)
+
+
+def test_limite_nunca_passa_da_margem():
+    agora = datetime(2026, 1, 1, 12)
+    assert limite_exportacao(None, MARGEM, agora) == agora - timedelta(seconds=MARGEM)
+    assert limite_exportacao(agora, MARGEM, agora) == agora - timedelta(seconds=MARGEM)
+    assert limite_exportacao(agora - timedelta(hours=1), MARGEM, agora) == agora - timedelta(hours=1)
+
+
+def test_limite_para_antes_da_predicao_mais_antiga_na_fila():
+    agora = datetime(2026, 1, 1, 12)
+    pendente = agora - timedelta(minutes=5)
+    assert limite_exportacao(None, MARGEM, agora, pendente) == pendente
+    assert limite_exportacao(agora - timedelta(hours=1), MARGEM, agora, pendente) == agora - timedelta(hours=1)
+    # uma pendente mais nova que a margem não muda nada
+    assert limite_exportacao(None, MARGEM, agora, agora) == agora - timedelta(seconds=MARGEM)
@@ -0,0 +1,90 @@
+import asyncio
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from idempotencia import ChaveIdempotencia, IdempotenciaBanco, IdempotenciaMemoria
+
+RESPOSTA = {'resultado': 'Aprovado', 'probabilidade_risco': 0.12, 'prediction_id': 41, 'motivos': [['R03', 0.2]]}
+
+
+def _decidir(linhas: list, armazem, chave: str, hash_payload: str):
+    """O /predict resumido: reserva a chave, grava a predição e guarda a resposta"""
+    async def executar():
+        original = await armazem.reservar(chave, hash_payload)
+        if original is not None:
+            return original[1]
+        linhas.append(chave)
+        await armazem.concluir(chave, hash_payload, RESPOSTA)
+        return RESPOSTA
+    return executar()
+
+
+def test_repeticao_em_outro_worker_devolve_a_resposta_original(tmp_path):
+    url = tmp_path / 'idempotencia.db'
+    ChaveIdempotencia.__table__.create(create_engine(f"sqlite:///{url}"))
+
+    async def cenario():
+        # dois workers: cada um com o próprio engine, o mesmo banco
+        worker_a = IdempotenciaBanco(create_async_engine(f"sqlite+aiosqlite:///{url}"), ttl=3600)
+        worker_b = IdempotenciaBanco(create_async_engine(f"sqlite+aiosqlite:///{url}"), ttl=3600)
+        gravadas = []
+        primeira = await _decidir(gravadas, worker_a, 'chave-1', 'hash-1')
+        repeticao = await _decidir(gravadas, worker_b, 'chave-1', 'hash-1')
+        outro_payload = await worker_b.reservar('chave-1', 'hash-2')
+        await worker_a.engine.dispose()
+        await worker_b.engine.dispose()
+        return gravadas, primeira, repeticao, outro_payload
+
+    gravadas, primeira, repeticao, outro_payload = asyncio.run(cenario())
+    assert gravadas == ['chave-1']
+    assert repeticao == primeira
+    assert outro_payload[0] == 'hash-1'
+    with create_engine(f"sqlite:///{url}").connect() as conn:
+        assert conn.execute(select(func.count()).select_from(ChaveIdempotencia.__table__)).scalar() == 1
+
+
+def test_reserva_concorrente_so_um_request_fica_com_a_chave(tmp_path):
+    url = tmp_path / 'idempotencia.db'
+    ChaveIdempotencia.__table__.create(create_engine(f"sqlite:///{url}"))
+
+    async def cenario():
+        workers = [IdempotenciaBanco(create_async_engine(f"sqlite+aiosqlite:///{url}"), ttl=3600) for _ in range(4)]
+        resultados = await asyncio.gather(*(w.reservar('chave-1', 'hash-1') for w in workers))
+        for w in workers:
+            await w.engine.dispose()
+        return resultados
+
+    resultados = asyncio.run(cenario())
+    assert sum(r is None for r in resultados) == 1
+    # os outros veem a reserva em andamento (409 no /predict)
+    assert all(r == ('hash-1', None) for r in resultados if r is not None)
+
+
+def test_reserva_abandonada_e_chave_liberada_voltam_a_ficar_livres(tmp_path):
+    url = tmp_path / 'idempotencia.db'
+    ChaveIdempotencia.__table__.create(create_engine(f"sqlite:///{url}"))
+
+    async def cenario():
+        armazem = IdempotenciaBanco(create_async_engine(f"sqlite+aiosqlite:///{url}"), ttl=3600, reserva_expira=0)
+        abandonada = await armazem.reservar('chave-1', 'hash-1')
+        retomada = await armazem.reservar('chave-1', 'hash-1')
+        await armazem.remover('chave-1')
+        liberada = await armazem.reservar('chave-1', 'hash-1')
+        await armazem.engine.dispose()
+        return abandonada, retomada, liberada
+
+    assert asyncio.run(cenario()) == (None, None, None)
+
+
+def test_na_memoria_a_chave_vale_so_para_o_proprio_worker():
+    """Sem o banco, a limitação conhecida: a repetição em outro worker é processada de novo"""
+    async def cenario():
+        worker_a, worker_b = IdempotenciaMemoria(100, 3600), IdempotenciaMemoria(100, 3600)
+        gravadas = []
+        await _decidir(gravadas, worker_a, 'chave-1', 'hash-1')
+        await _decidir(gravadas, worker_a, 'chave-1', 'hash-1')
+        await _decidir(gravadas, worker_b, 'chave-1', 'hash-1')
+        return gravadas
+
+    assert asyncio.run(cenario()) == ['chave-1', 'chave-1']
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import BACKEND
+
+# o prometheus_client escolhe o modo multiprocesso no import: o cenário roda num processo novo
+CENARIO = textwrap.dedent("""
+    import os
+    from prometheus_client import multiprocess
+    import metricas
+
+    def worker(aprovadas, reprovadas):
+        pid = os.fork()
+        if pid == 0:
+            for _ in range(aprovadas):
+                metricas.registrar_decisoes(True, 0.1)
+            for _ in range(reprovadas):
+                metricas.registrar_decisoes(False, 0.9)
+            metricas.FALHAS_BANCO_PREDICT.inc()
+            metricas.INICIALIZACAO['modelo'] = 0.5
+            metricas.publicar()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    encerrado = worker(3, 1)
+    worker(2, 4)
+    # o mestre descarta os gauges do worker que saiu; os contadores dele continuam somando
+    multiprocess.mark_process_dead(encerrado)
+    print(f"encerrado={encerrado}")
+    print(metricas.exportar()[0].decode())
+""")
+
+
+def test_metrics_soma_os_workers_e_descarta_gauges_de_quem_saiu(tmp_path):
+    saida = subprocess.run([sys.executable, '-c', CENARIO], cwd=BACKEND, capture_output=True, text=True, check=True,
+                           env={**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path)}).stdout
+    linhas = saida.splitlines()
+    encerrado = linhas[0].split('=')[1]
+
+    assert 'credito_decisoes_total{resultado="Aprovado"} 5.0' in linhas
+    assert 'credito_decisoes_total{resultado="Reprovado"} 5.0' in linhas
+    assert 'credito_falhas_banco_total{operacao="predict"} 2.0' in linhas
+    assert 'credito_probabilidade_risco_count 10.0' in linhas
+    assert 'credito_probabilidade_risco_bucket{le="0.1"} 5.0' in linhas
+    inicializacao = [linha for linha in linhas if linha.startswith('credito_inicializacao_segundos{')]
+    assert len(inicializacao) == 1
+    assert f'pid="{encerrado}"' not in inicializacao[0]
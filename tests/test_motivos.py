@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import motivos
+from features import features_cliente, matriz_features
+from registro_modelos import RegistroModelos
+
+RAIZ = Path(__file__).resolve().parent.parent
+CLIENTE_SEM_SALDO = dict(idade=30, valor_conta_poupanca=200.0, valor_conta_corrente=0.0, salario_anual=36000.0,
+                         valor_emprestimo=5000.0, prazo_meses=12, situacao_moradia='own')
+
+
+@pytest.fixture(scope="module")
+def modelo():
+    registro = RegistroModelos(RAIZ / "modelos" / "registro_inexistente", RAIZ / "modelos" / "modelo_credito_final.joblib",
+                               RAIZ / "data" / "dados_credito_processados.parquet")
+    return registro.carregar("modelo_credito_final")
+
+
+def test_saldo_em_conta_corrente_e_um_unico_fator(modelo):
+    features = modelo.features
+    valores = features_cliente(**CLIENTE_SEM_SALDO)
+    _, contribuicoes = modelo.scorer.proba_e_contribuicoes_valores(valores)
+    contribuicao = dict(zip(features, contribuicoes))
+    # impacto no risco: soma das duas contribuições do saldo, com o sinal trocado
+    esperado = -(contribuicao['is_conta_corrente_zero'] + contribuicao['log_valor_conta_corrente'])
+
+    impactos = dict(motivos.motivos_adversos_cliente(contribuicoes, features, len(features)))
+    assert 'R04' not in impactos
+    assert impactos['R03'] == pytest.approx(esperado)
+    # o log do saldo compensa quase todo o indicador de saldo zero: o motivo mostra o efeito líquido
+    assert 0 < impactos['R03'] < -contribuicao['is_conta_corrente_zero']
+
+    # a versão vetorizada (/predict/batch e pontuar_lote) agrupa do mesmo jeito
+    matriz = matriz_features({nome: np.asarray([valor]) for nome, valor in valores.items()}, list(features))
+    _, contribuicoes_lote = modelo.scorer.proba_e_contribuicoes(matriz)
+    codigos = motivos.agrupamento(tuple(features))[0]
+    indices, impactos_lote = motivos.motivos_adversos(contribuicoes_lote, features, len(codigos))
+    agrupados = {str(codigos[i]): impacto for i, impacto in zip(indices[0], impactos_lote[0]) if i >= 0}
+    assert agrupados == pytest.approx(impactos)
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+
+from main import Prediction, PredictionArquivada
+from particoes import ArquivoIndisponivel, ArquivoPredicoes, arquivar_particao, remover_particao
+
+JANEIRO = datetime(2026, 1, 1)
+FEVEREIRO = datetime(2026, 2, 1)
+
+
+def _linha(prediction_id, timestamp):
+    return {'id': prediction_id, 'timestamp': timestamp, 'idade': 30, 'valor_conta_poupanca': 0.0,
+            'valor_conta_corrente': 0.0, 'salario_anual': 1.0, 'valor_emprestimo': 1.0, 'prazo_meses': 12,
+            'situacao_moradia': 'own', 'resultado': 'Aprovado', 'probabilidade_risco': 0.1,
+            'threshold_utilizado': 0.4, 'versao_modelo': 'v1', 'motivos': None}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'particoes.db'}")
+    Prediction.__table__.create(engine)
+    PredictionArquivada.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Prediction.__table__), [
+            _linha(i, (JANEIRO if i <= 40 else FEVEREIRO) + timedelta(hours=i)) for i in range(1, 61)
+        ])
+    return engine
+
+
+def test_mes_arquivado_por_um_host_aparece_nos_outros_pelo_catalogo(engine, tmp_path):
+    catalogo = PredictionArquivada.__table__
+    host_a = ArquivoPredicoes(tmp_path / 'host_a', catalogo)
+    host_b = ArquivoPredicoes(tmp_path / 'host_b', catalogo)
+
+    with engine.connect() as conn:
+        assert arquivar_particao(conn, Prediction.__table__, JANEIRO, host_a) == 40
+
+    # o host B não tem nada no próprio diretório: os meses arquivados vêm do catálogo no banco
+    assert host_b.fronteira is None
+    host_b.atualizar(engine)
+    assert host_b.fronteira == FEVEREIRO
+    assert host_b.total_linhas() == 40
+    assert host_b.contar() == 40
+    assert host_b.buscar(7)['id'] == 7
+
+
+def test_parquet_fora_do_armazenamento_compartilhado_falha_em_vez_de_sumir(engine, tmp_path):
+    catalogo = PredictionArquivada.__table__
+    host_a = ArquivoPredicoes(tmp_path / 'host_a', catalogo)
+    host_b = ArquivoPredicoes(tmp_path / 'host_b', catalogo)
+    with engine.connect() as conn:
+        arquivar_particao(conn, Prediction.__table__, JANEIRO, host_a)
+    host_b.atualizar(engine)
+
+    # o Parquet só existia no disco local do host A
+    host_a.destino(JANEIRO).unlink()
+    with pytest.raises(ArquivoIndisponivel):
+        host_b.contar()
+    with engine.connect() as conn, pytest.raises(ArquivoIndisponivel):
+        remover_particao(conn, Prediction.__table__, JANEIRO, host_b)
+
+
+def test_particao_sem_registro_no_catalogo_nao_e_removida(engine, tmp_path):
+    arquivo = ArquivoPredicoes(tmp_path / 'host_a', PredictionArquivada.__table__)
+    # o Parquet existe no diretório, mas o mês nunca foi registrado
+    with engine.connect() as conn:
+        arquivar_particao(conn, Prediction.__table__, JANEIRO, arquivo)
+        with conn.begin():
+            conn.execute(PredictionArquivada.__table__.delete())
+        with pytest.raises(RuntimeError, match="catálogo"):
+            remover_particao(conn, Prediction.__table__, JANEIRO, arquivo)
+        assert conn.execute(select(func.count()).select_from(Prediction.__table__)).scalar() == 60
@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, Table, create_engine, func, select
+
+from persistencia import LATENCIA_FLUSH_REFERENCIA_SEGUNDOS, FilaPersistencia
+
+metadata = MetaData()
+tabela = Table("linhas", metadata,
+               Column("id", Integer, primary_key=True),
+               Column("timestamp", DateTime),
+               Column("valor", Float))
+
+
+def _linhas(inicio, n):
+    agora = datetime(2024, 5, 1, 12)
+    return [{'id': i, 'timestamp': agora + timedelta(seconds=i), 'valor': i / 2} for i in range(inicio, inicio + n)]
+
+
+def _fila(engine, pendentes, **opcoes):
+    return FilaPersistencia(engine, tabela, tamanho_lote=10, intervalo=0.01, tentativas=2,
+                            diretorio_pendentes=pendentes, **opcoes)
+
+
+def _gravadas(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(tabela).order_by(tabela.c.id)).mappings().all()
+
+
+def test_banco_fora_do_ar_nao_perde_o_lote(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fila.db'}")
+    fila = _fila(engine, tmp_path / "pendentes")
+    # sem a tabela o INSERT falha com OperationalError, como um banco indisponível
+    fila.iniciar()
+    fila.enfileirar(_linhas(0, 25))
+    while fila.falhas_flush < 2:
+        time.sleep(0.01)
+    # o lote esgotou as tentativas e voltou para a fila; o banco volta e o parar grava tudo
+    metadata.create_all(engine)
+    fila.parar()
+
+    assert [linha['id'] for linha in _gravadas(engine)] == list(range(25))
+    assert fila.linhas_perdidas == 0
+    assert fila.linhas_pendentes == 0
+
+
+def test_lote_recusado_vai_para_pendentes_e_volta_no_inicio(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fila.db'}")
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(tabela.insert(), _linhas(5, 1))
+    pendentes = tmp_path / "pendentes"
+
+    fila = _fila(engine, pendentes)
+    fila.iniciar()
+    fila.enfileirar(_linhas(0, 10))
+    fila.parar()
+    # o id 5 duplicado faz o banco recusar o lote inteiro, que fica no arquivo
+    assert fila.linhas_pendentes == 10
+    assert fila.linhas_perdidas == 0
+    assert len(list(pendentes.glob("linhas_*.jsonl"))) == 1
+
+    with engine.begin() as conn:
+        conn.execute(tabela.delete())
+    nova = _fila(engine, pendentes)
+    nova.iniciar()
+    nova.parar()
+    assert nova.linhas_recuperadas == 10
+    assert _gravadas(engine) == [dict(linha) for linha in _linhas(0, 10)]
+    assert not list(pendentes.iterdir())
+
+
+def test_parar_sem_banco_guarda_o_buffer(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fila.db'}")
+    pendentes = tmp_path / "pendentes"
+    fila = _fila(engine, pendentes)
+    fila.enfileirar(_linhas(0, 35))
+    fila.iniciar()
+    fila.parar()
+    assert fila.linhas_pendentes == 35
+
+    metadata.create_all(engine)
+    nova = _fila(engine, pendentes)
+    nova.iniciar()
+    nova.parar()
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(tabela)).scalar() == 35
+    assert not list(pendentes.iterdir())
+
+
+def test_pendente_mais_antiga_acompanha_o_lote_em_voo(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fila.db'}")
+    fila = _fila(engine, tmp_path / "pendentes")
+    assert fila.pendente_mais_antiga() is None
+    linhas = _linhas(0, 15)
+    fila.enfileirar(linhas)
+    assert fila.pendente_mais_antiga() == linhas[0]['timestamp']
+    # retirado do buffer, o lote continua pendente até o commit
+    lote = fila._proximo_lote()
+    assert fila.pendente_mais_antiga() == linhas[0]['timestamp']
+    fila._devolver(lote)
+    assert fila.pendente_mais_antiga() == linhas[0]['timestamp']
+
+    metadata.create_all(engine)
+    fila.iniciar()
+    fila.parar()
+    assert fila.pendente_mais_antiga() is None
+    # o pior atraso cobre ao menos o timeout, o intervalo e um flush por lote do buffer cheio
+    assert fila.atraso_maximo() >= fila.timeout_enfileirar + fila.intervalo + fila.capacidade / fila.tamanho_lote * LATENCIA_FLUSH_REFERENCIA_SEGUNDOS
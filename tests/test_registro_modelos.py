@@ -0,0 +1,63 @@
+import os
+import shutil
+from pathlib import Path
+
+from registro_modelos import RegistroModelos
+
+RAIZ = Path(__file__).resolve().parent.parent
+ARTEFATO_COMPACTO = RAIZ / "modelos" / "modelo_credito_final.npz"
+
+
+def _registro(tmp_path) -> RegistroModelos:
+    diretorio = tmp_path / "registro"
+    diretorio.mkdir()
+    return RegistroModelos(diretorio, tmp_path / "padrao.joblib", tmp_path / "referencia.parquet")
+
+
+def test_versao_com_falha_e_tentada_de_novo_quando_o_arquivo_muda(tmp_path):
+    registro = _registro(tmp_path)
+    artefato = registro.diretorio / "v1.npz"
+    artefato.write_bytes(b"corrompido")
+
+    tentativas = []
+    carregar = registro.carregar
+    registro.carregar = lambda versao, compacto=True: tentativas.append(versao) or carregar(versao, compacto)
+
+    registro.verificar()
+    registro.verificar()
+    assert tentativas == ["v1"]
+    assert registro.atual is None
+
+    # artefato corrigido no lugar, com o mesmo nome de versão
+    temporario = registro.diretorio / ".v1.npz.tmp"
+    shutil.copyfile(ARTEFATO_COMPACTO, temporario)
+    os.replace(temporario, artefato)
+
+    registro.verificar()
+    assert tentativas == ["v1", "v1"]
+    assert registro.atual is not None and registro.atual.versao == "v1"
+
+
+ARTEFATO_JOBLIB = RAIZ / "modelos" / "modelo_credito_final.joblib"
+
+
+def test_npz_so_vale_enquanto_o_joblib_de_origem_nao_muda(tmp_path):
+    import joblib
+
+    registro = _registro(tmp_path)
+    origem = registro.diretorio / "v1.joblib"
+    # cópia sem preservar o mtime (como um checkout): o sha256 confirma que é o mesmo .joblib
+    shutil.copyfile(ARTEFATO_JOBLIB, origem)
+    shutil.copyfile(ARTEFATO_COMPACTO, registro.diretorio / "v1.npz")
+    modelo = registro.carregar("v1")
+    assert modelo.formato == "npz"
+    assert modelo.artefato == str(registro.diretorio / "v1.npz")
+
+    # retreinado com o mesmo nome: o .npz antigo não pode esconder o novo .joblib
+    dados = joblib.load(origem)
+    dados['threshold_f2'] = 0.5
+    joblib.dump(dados, origem)
+    modelo = registro.carregar("v1")
+    assert modelo.formato == "joblib"
+    assert modelo.artefato == str(origem)
+    assert modelo.threshold == 0.5
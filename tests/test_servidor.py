@@ -0,0 +1,20 @@
+import pytest
+
+from servidor import orcamento_conexoes
+
+
+@pytest.mark.parametrize('total, workers', [(9, 2), (20, 3), (90, 4), (500, 16)])
+def test_orcamento_cabe_no_total_com_conexao_propria_para_leituras_longas(total, workers):
+    orcamento = orcamento_conexoes(total, workers)
+    por_worker = sum(valor for nome, valor in orcamento.items() if nome != 'DB_MAX_OVERFLOW')
+    assert por_worker * (workers + 1) <= total
+    assert orcamento['DB_MAX_OVERFLOW'] == 0
+    assert orcamento['DB_POOL_SIZE'] >= 1
+    # fila de gravação e alocador de ids nunca dividem conexão com a manutenção nem com o desafiante
+    assert orcamento['DB_SYNC_POOL_SIZE'] >= 1
+    assert orcamento['DB_AUX_POOL_SIZE'] + orcamento['DB_AUX_MAX_OVERFLOW'] == 1
+
+
+def test_orcamento_sem_conexoes_suficientes():
+    with pytest.raises(ValueError):
+        orcamento_conexoes(8, 3)
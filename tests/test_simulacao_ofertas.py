@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from simulacao_ofertas import pontuar_ofertas, valor_maximo_aprovavel
+
+FEATURES = ['log_valor_emprestimo', 'prazo_meses']
+THRESHOLD = 0.6
+CLIENTE = {'idade': 35, 'valor_conta_poupanca': 1000.0, 'valor_conta_corrente': 500.0, 'salario_anual': 60000.0,
+           'situacao_moradia': 'own'}
+# com o scorer abaixo: o prazo 6 aprova a grade inteira, 12 e 24 param entre dois pontos e 36 e 60 não aprovam nada
+PRAZOS = np.array([6, 12, 24, 36, 60], dtype=np.float64)
+VALORES = np.array([500, 1000, 5000, 10000, 20000, 40000], dtype=np.float64)
+
+
+class ScorerMonotono:
+    """Risco crescente no valor e no prazo: log1p(valor) / 20 + prazo / 100"""
+    compilado = True
+
+    def proba_positiva(self, matriz):
+        return 1 - (matriz[:, 0] / 20 + matriz[:, 1] / 100)
+
+
+def _grade():
+    prazo, valor = np.meshgrid(PRAZOS, VALORES, indexing='ij')
+    risco = pontuar_ofertas(ScorerMonotono(), FEATURES, CLIENTE, prazo.ravel(), valor.ravel())
+    return risco.reshape(len(PRAZOS), len(VALORES))
+
+
+def _forca_bruta(prazo, passo):
+    """Maior valor aprovado varrendo o intervalo da grade com passo fixo (NaN se nenhum)"""
+    valores = np.arange(VALORES[0], VALORES[-1] + passo, passo)
+    risco = pontuar_ofertas(ScorerMonotono(), FEATURES, CLIENTE, np.full(len(valores), prazo), valores)
+    aprovados = valores[risco < THRESHOLD]
+    return aprovados.max() if len(aprovados) else np.nan
+
+
+@pytest.mark.parametrize('precisao', [1.0, 0.01])
+def test_bissecao_converge_para_a_forca_bruta(precisao):
+    maximo, risco = valor_maximo_aprovavel(ScorerMonotono(), FEATURES, THRESHOLD, CLIENTE, PRAZOS, VALORES,
+                                           _grade(), precisao=precisao)
+
+    # prazos sem nenhum valor aprovado na grade
+    assert np.isnan(maximo[3:]).all() and np.isnan(risco[3:]).all()
+    # a grade inteira aprovada: o máximo é o último ponto, sem bisseção além dele
+    assert maximo[0] == VALORES[-1]
+    for i in (1, 2):
+        assert abs(maximo[i] - _forca_bruta(PRAZOS[i], 0.5)) <= max(precisao, 0.5)
+        # o valor devolvido é aprovado e o seguinte, a `precisao` dele, já é reprovado
+        acima = pontuar_ofertas(ScorerMonotono(), FEATURES, CLIENTE, np.array([PRAZOS[i]]),
+                                np.array([maximo[i] + precisao]))
+        assert risco[i] < THRESHOLD <= acima[0]
+        assert risco[i] == pytest.approx(
+            pontuar_ofertas(ScorerMonotono(), FEATURES, CLIENTE, np.array([PRAZOS[i]]), np.array([maximo[i]]))[0])
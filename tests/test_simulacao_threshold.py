@@ -0,0 +1,107 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+import simulacao_threshold
+from main import Prediction, PredictionArquivada
+from particoes import ArquivoPredicoes, arquivar_particao
+from simulacao_threshold import FAIXAS_IDADE, LIMITES_IDADE, MORADIAS, IndiceScores
+
+INICIO = datetime(2026, 1, 1)
+THRESHOLDS = [0.0, 0.15, 0.35, 0.3501, 0.5, 1.0, 1.01]
+
+
+class Relogio(datetime):
+    agora = INICIO
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.agora
+
+
+def _linhas(sorteio, ids, inicio, horas):
+    linhas = []
+    for prediction_id in ids:
+        probabilidade = round(sorteio.random(), 4)
+        linhas.append({
+            'id': prediction_id, 'timestamp': inicio + timedelta(hours=sorteio.uniform(0, horas)),
+            'idade': sorteio.randint(18, 80), 'valor_conta_poupanca': 0.0, 'valor_conta_corrente': 0.0,
+            'salario_anual': 1.0, 'valor_emprestimo': float(sorteio.choice([500, 2000, 2000.5, 5000, 9000, 20000])),
+            'prazo_meses': 12, 'situacao_moradia': sorteio.choice(MORADIAS),
+            'resultado': 'Aprovado' if probabilidade < 0.35 else 'Reprovado', 'probabilidade_risco': probabilidade,
+            'threshold_utilizado': 0.35, 'versao_modelo': 'v1', 'motivos': None,
+        })
+    return linhas
+
+
+def _faixa_idade(idade):
+    return FAIXAS_IDADE[sum(idade > limite for limite in LIMITES_IDADE)]
+
+
+def _conferir(indice, linhas):
+    """Compara a simulação do índice com a contagem direta, linha a linha"""
+    resultado = indice.simular(THRESHOLDS)
+    assert resultado['total_predicoes'] == len(linhas)
+    for threshold, simulacao in zip(THRESHOLDS, resultado['simulacoes']):
+        aprovadas = [linha for linha in linhas if linha['probabilidade_risco'] < threshold]
+        assert simulacao['aprovados'] == len(aprovadas)
+        assert simulacao['decisoes_alteradas']['reprovado_para_aprovado'] == sum(
+            linha['resultado'] == 'Reprovado' for linha in aprovadas)
+        for moradia, segmento in simulacao['por_moradia'].items():
+            assert segmento['aprovados'] == sum(linha['situacao_moradia'] == moradia for linha in aprovadas)
+        for faixa, segmento in simulacao['por_faixa_idade'].items():
+            assert segmento['total'] == sum(_faixa_idade(linha['idade']) == faixa for linha in linhas)
+            assert segmento['aprovados'] == sum(_faixa_idade(linha['idade']) == faixa for linha in aprovadas)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(simulacao_threshold, 'datetime', Relogio)
+    engine = create_engine(f"sqlite:///{tmp_path / 'simulacao.db'}")
+    Prediction.__table__.create(engine)
+    PredictionArquivada.__table__.create(engine)
+    return engine
+
+
+def test_atualizacoes_incrementais_contam_cada_predicao_uma_vez(engine):
+    sorteio = random.Random(13)
+    linhas = _linhas(sorteio, range(1, 401), INICIO, 10)
+    with engine.begin() as conn:
+        conn.execute(insert(Prediction.__table__), linhas)
+
+    indice = IndiceScores(margem_segundos=3600)
+    Relogio.agora = INICIO + timedelta(hours=5)
+    corte = Relogio.agora - timedelta(hours=1)
+    assert indice.atualizar(engine, Prediction.__table__) == sum(linha['timestamp'] < corte for linha in linhas)
+    _conferir(indice, [linha for linha in linhas if linha['timestamp'] < corte])
+
+    # novas predições chegam depois do corte; a consulta seguinte lê só a janela nova
+    novas = _linhas(sorteio, range(401, 601), INICIO + timedelta(hours=8), 4)
+    with engine.begin() as conn:
+        conn.execute(insert(Prediction.__table__), novas)
+    Relogio.agora = INICIO + timedelta(hours=11)
+    novo_corte = Relogio.agora - timedelta(hours=1)
+    assert indice.atualizar(engine, Prediction.__table__) == sum(
+        corte <= linha['timestamp'] < novo_corte for linha in linhas + novas)
+    # sem tempo novo, nada é relido
+    assert indice.atualizar(engine, Prediction.__table__) == 0
+    _conferir(indice, [linha for linha in linhas + novas if linha['timestamp'] < novo_corte])
+
+
+def test_meses_arquivados_e_banco_somados_sem_repetir(engine, tmp_path):
+    sorteio = random.Random(22)
+    janeiro = _linhas(sorteio, range(1, 301), INICIO, 24 * 30)
+    fevereiro = _linhas(sorteio, range(301, 501), datetime(2026, 2, 1), 24 * 20)
+    with engine.begin() as conn:
+        conn.execute(insert(Prediction.__table__), janeiro + fevereiro)
+    arquivo = ArquivoPredicoes(tmp_path / 'arquivo', PredictionArquivada.__table__)
+    with engine.connect() as conn:
+        assert arquivar_particao(conn, Prediction.__table__, INICIO, arquivo) == len(janeiro)
+
+    # janeiro continua no banco (a partição só sai na manutenção seguinte), mas vem do Parquet
+    Relogio.agora = datetime(2026, 3, 1)
+    indice = IndiceScores(margem_segundos=0)
+    assert indice.atualizar(engine, Prediction.__table__, arquivo) == len(janeiro) + len(fevereiro)
+    _conferir(indice, janeiro + fevereiro)